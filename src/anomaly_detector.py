@@ -0,0 +1,297 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+from partitions import partition_tables
+
+ANOMALY_WINDOW_SECONDS = int(os.environ.get("ANOMALY_WINDOW_SECONDS", "300"))
+ANOMALY_SIGMA = float(os.environ.get("ANOMALY_SIGMA", "2.0"))
+ANOMALY_MIN_WINDOWS = int(os.environ.get("ANOMALY_MIN_WINDOWS", "3"))
+ANOMALY_MIN_PURCHASES = int(os.environ.get("ANOMALY_MIN_PURCHASES", "5"))
+ANOMALY_MIN_USERS = int(os.environ.get("ANOMALY_MIN_USERS", "5"))
+ANOMALY_MIN_EVENTS = 10
+ANOMALY_ALERT_TTL_SECONDS = int(os.environ.get("ANOMALY_ALERT_TTL_SECONDS", "900"))
+ANOMALY_MAX_ALERTS = 100
+
+DETECTION_TYPES = ["traffic_spike", "unusual_purchase", "hyperactive_user"]
+
+
+class RunningStats:
+    """
+    Welford's online mean/variance, with removal so a value can be updated
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def remove(self, value: float):
+        if self.count <= 1:
+            self.count = 0
+            self.mean = 0.0
+            self._m2 = 0.0
+            return
+        delta = value - self.mean
+        self.mean = (self.mean * self.count - value) / (self.count - 1)
+        self.count -= 1
+        self._m2 = max(0.0, self._m2 - delta * (value - self.mean))
+
+    @property
+    def stdev(self) -> float:
+        # Sample standard deviation, matching statistics.stdev
+        return math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+
+class AnomalyDetector:
+    """
+    Streaming anomaly detection over the whole event stream.
+
+    Every ingested event updates O(1) state: the event count of the
+    current time window against the distribution of past windows, the
+    purchase amount distribution, and per-user activity within the
+    current window. Alerts are queued as soon as a threshold is crossed.
+    """
+
+    def __init__(
+        self,
+        window_seconds: int = ANOMALY_WINDOW_SECONDS,
+        sigma: float = ANOMALY_SIGMA,
+    ):
+        self.window = window_seconds
+        self.sigma = sigma
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self.total_events = 0
+        self._traffic = RunningStats()
+        self._purchases = RunningStats()
+        self._window_start = 0
+        self._window_count = 0
+        self._spike_reported = False
+        self._user_counts: Dict[str, int] = {}
+        self._user_activity = RunningStats()
+        self._reported_users = set()
+        self._alerts = deque(maxlen=ANOMALY_MAX_ALERTS)
+        self._pending: List[Dict[str, Any]] = []
+
+    def _alert(self, alert: Dict[str, Any], at: int, notify: bool):
+        alert["detected_at"] = datetime.fromtimestamp(at, timezone.utc).isoformat()
+        alert["_at"] = at
+        self._alerts.append(alert)
+        if notify:
+            self._pending.append(alert)
+
+    def _roll_window(self, at: int):
+        window_start = at - (at % self.window)
+        if window_start == self._window_start:
+            return
+
+        if self._window_count:
+            self._traffic.add(self._window_count)
+        self._window_start = window_start
+        self._window_count = 0
+        self._spike_reported = False
+        self._user_counts = {}
+        self._user_activity = RunningStats()
+        self._reported_users = set()
+
+    def _check_traffic(self, at: int, notify: bool):
+        stats = self._traffic
+        if self._spike_reported or stats.count < ANOMALY_MIN_WINDOWS:
+            return
+
+        current_rate = self._window_count
+        std_rate = stats.stdev
+        avg_rate = stats.mean
+        if std_rate > 0 and current_rate > avg_rate + (self.sigma * std_rate):
+            self._spike_reported = True
+            minutes = self.window // 60
+            self._alert(
+                {
+                    "type": "traffic_spike",
+                    "severity": "high",
+                    "message": f"Traffic spike detected: {current_rate} events in {minutes} min (avg: {avg_rate:.1f})",
+                    "current_value": current_rate,
+                    "expected_range": f"{avg_rate - std_rate:.1f} - {avg_rate + std_rate:.1f}",
+                },
+                at,
+                notify,
+            )
+
+    def _check_purchase(self, amount, user_id: Optional[str], at: int, notify: bool):
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)):
+            return
+        if amount <= 0:
+            return
+
+        stats = self._purchases
+        if stats.count >= ANOMALY_MIN_PURCHASES:
+            avg_amount = stats.mean
+            std_amount = stats.stdev
+            if amount > avg_amount + (self.sigma * std_amount):
+                self._alert(
+                    {
+                        "type": "unusual_purchase",
+                        "severity": "medium",
+                        "message": f"Unusual high purchase: ${amount} (avg: ${avg_amount:.2f})",
+                        "current_value": amount,
+                        "expected_range": f"${avg_amount - std_amount:.2f} - ${avg_amount + std_amount:.2f}",
+                        "user_id": user_id,
+                    },
+                    at,
+                    notify,
+                )
+        stats.add(amount)
+
+    def _check_user(self, user_id: Optional[str], at: int, notify: bool):
+        key = user_id if user_id is not None else "anonymous"
+        activity = self._user_activity
+        previous = self._user_counts.get(key, 0)
+        if previous:
+            activity.remove(previous)
+        activity_count = previous + 1
+        self._user_counts[key] = activity_count
+        activity.add(activity_count)
+
+        if key in self._reported_users or activity.count < ANOMALY_MIN_USERS:
+            return
+
+        avg_activity = activity.mean
+        std_activity = activity.stdev
+        if activity_count > avg_activity + (self.sigma * std_activity):
+            self._reported_users.add(key)
+            self._alert(
+                {
+                    "type": "hyperactive_user",
+                    "severity": "low",
+                    "message": f"User {user_id} has unusual activity: {activity_count} events (avg: {avg_activity:.1f})",
+                    "current_value": activity_count,
+                    "expected_range": f"{avg_activity - std_activity:.1f} - {avg_activity + std_activity:.1f}",
+                    "user_id": user_id,
+                },
+                at,
+                notify,
+            )
+
+    def _record(self, event_type, user_id, data, at: int, notify: bool = True):
+        self.total_events += 1
+        self._roll_window(at)
+        self._window_count += 1
+
+        self._check_traffic(at, notify)
+        if event_type == "purchase" and data:
+            self._check_purchase(data.get("amount", 0), user_id, at, notify)
+        self._check_user(user_id, at, notify)
+
+    def record_many(self, events, at: Optional[float] = None, notify: bool = True):
+        """
+        Update detector state with newly ingested events; notify=False keeps
+        alerts out of drain_alerts(), for events another process reports on
+        """
+
+        at = int(at if at is not None else time.time())
+        with self._lock:
+            for event in events:
+                self._record(event.event_type, event.user_id, event.data, at, notify)
+
+    def seed(self, conn: sqlite3.Connection):
+        """
+        Rebuild the traffic and purchase baselines from stored events.
+
+        The lock is held throughout, so batches recorded meanwhile wait and
+        are counted on top of the baselines instead of being reset away.
+        """
+
+        with self._lock:
+            self._clear()
+            now = int(time.time())
+            current_window = now - (now % self.window)
+
+            windows: Dict[int, int] = {}
+            amounts = []
+            for table in partition_tables(conn):
+                for window, count in conn.execute(
+                    f"SELECT ts / 1000 / ? AS w, COUNT(*) FROM {table} GROUP BY w",
+                    (self.window,),
+                ):
+                    windows[window] = windows.get(window, 0) + count
+                amounts.extend(
+                    conn.execute(
+                        f"""
+                        SELECT json_extract(e.data, '$.amount')
+                        FROM {table} e
+                        JOIN event_types et ON et.id = e.event_type_id
+                        WHERE et.name = 'purchase'
+                        ORDER BY e.id
+                        """
+                    )
+                )
+
+            for window, count in sorted(windows.items()):
+                self.total_events += count
+                if window is None:
+                    continue
+                if window * self.window == current_window:
+                    # The open window keeps counting live events
+                    self._window_start = current_window
+                    self._window_count = count
+                else:
+                    self._traffic.add(count)
+
+            for (amount,) in amounts:
+                if isinstance(amount, (int, float)) and amount > 0:
+                    self._purchases.add(amount)
+
+    def drain_alerts(self) -> List[Dict[str, Any]]:
+        """
+        Alerts fired since the last call, for pushing to clients
+        """
+
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return [self._public(alert) for alert in pending]
+
+    @staticmethod
+    def _public(alert: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in alert.items() if not k.startswith("_")}
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Alerts still active within the TTL, in the original response shape
+        """
+
+        cutoff = int(time.time()) - ANOMALY_ALERT_TTL_SECONDS
+        with self._lock:
+            total_events = self.total_events
+            anomalies = [self._public(a) for a in self._alerts if a["_at"] >= cutoff]
+
+        if total_events < ANOMALY_MIN_EVENTS:
+            return {
+                "anomalies": [],
+                "total_anomalies": 0,
+                "message": "Insufficient data for anomaly detection",
+            }
+
+        return {
+            "anomalies": anomalies,
+            "total_anomalies": len(anomalies),
+            "analysis_period": "full event stream",
+            "detection_types": DETECTION_TYPES,
+        }
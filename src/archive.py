@@ -0,0 +1,320 @@
+import json
+import mmap
+import os
+import sys
+import zlib
+from array import array
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from rollups import event_amount
+
+# File layout:
+#   MAGIC
+#   chunk 0 column sections, each starting on an 8-byte boundary
+#   chunk 1 ...
+#   footer: UTF-8 JSON describing the chunks and their column sections
+#   footer length (8 bytes, little-endian) + MAGIC
+#
+# Fixed-width columns are stored raw so a reader can cast the mapped file
+# directly (memoryview.cast or numpy.frombuffer) without copying. Text
+# columns are zlib-compressed values plus raw offsets and a validity mask.
+MAGIC = b"SCEVARC1"
+FORMAT_VERSION = 1
+ARCHIVE_SUFFIX = ".scev"
+
+ARCHIVE_CHUNK_ROWS = int(os.environ.get("ARCHIVE_CHUNK_ROWS", "65536"))
+ARCHIVE_COMPRESSION_LEVEL = int(os.environ.get("ARCHIVE_COMPRESSION_LEVEL", "6"))
+
+# Columns in row tuple order, and the array typecode of the fixed-width ones
+ROW_COLUMNS = ["id", "ts", "event_type_id", "user_id", "data", "created_ts"]
+FIXED_COLUMNS = {"id": "q", "ts": "q", "event_type_id": "i", "created_ts": "q"}
+TEXT_COLUMNS = ["user_id", "data"]
+
+# Row tuples as read from a partition
+Row = Tuple[int, int, int, Optional[str], Optional[str], int]
+
+
+def _pad(f) -> int:
+    offset = f.tell()
+    if offset % 8:
+        f.write(b"\0" * (8 - offset % 8))
+    return f.tell()
+
+
+def _native(values: array) -> array:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+class ArchiveWriter:
+    """
+    Write rows into a chunked columnar archive.
+
+    Rows must arrive in id order. The file is written under a temporary
+    name and only renamed into place by close(), so a partial export is
+    never mistaken for a complete archive.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        event_types: Dict[int, str],
+        chunk_rows: int = ARCHIVE_CHUNK_ROWS,
+        level: int = ARCHIVE_COMPRESSION_LEVEL,
+    ):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.level = level
+        self.event_types = event_types
+        self.chunks: List[Dict[str, Any]] = []
+        self.rows = 0
+        self._pending: List[Row] = []
+        self._tmp_path = f"{path}.tmp"
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(MAGIC)
+
+    def write_rows(self, rows):
+        for row in rows:
+            self._pending.append(row)
+            if len(self._pending) >= self.chunk_rows:
+                self._flush()
+
+    def _section(self, data: bytes, codec: str, **extra) -> Dict[str, Any]:
+        offset = _pad(self._file)
+        self._file.write(data)
+        return {"offset": offset, "length": len(data), "codec": codec, **extra}
+
+    def _flush(self):
+        rows, self._pending = self._pending, []
+        if not rows:
+            return
+
+        columns = {}
+        for index, name in enumerate(ROW_COLUMNS):
+            values = [row[index] for row in rows]
+            typecode = FIXED_COLUMNS.get(name)
+            if typecode is not None:
+                data = _native(array(typecode, values)).tobytes()
+                columns[name] = self._section(data, "raw", type=typecode)
+                continue
+
+            encoded = [v.encode() if v is not None else b"" for v in values]
+            offsets = array("q", [0])
+            for value in encoded:
+                offsets.append(offsets[-1] + len(value))
+            valid = bytes(v is not None for v in values)
+            columns[name] = {
+                "offsets": self._section(_native(offsets).tobytes(), "raw", type="q"),
+                "valid": self._section(valid, "raw", type="B"),
+                "values": self._section(
+                    zlib.compress(b"".join(encoded), self.level), "zlib"
+                ),
+            }
+
+        ts = [row[1] for row in rows]
+        self.chunks.append(
+            {
+                "rows": len(rows),
+                "min_id": rows[0][0],
+                "max_id": rows[-1][0],
+                "min_ts": min(ts),
+                "max_ts": max(ts),
+                "columns": columns,
+            }
+        )
+        self.rows += len(rows)
+
+    def close(self) -> Dict[str, Any]:
+        self._flush()
+        footer = json.dumps(
+            {
+                "version": FORMAT_VERSION,
+                "rows": self.rows,
+                "event_types": {str(k): v for k, v in self.event_types.items()},
+                "chunks": self.chunks,
+            }
+        ).encode()
+        _pad(self._file)
+        self._file.write(footer)
+        self._file.write(len(footer).to_bytes(8, "little"))
+        self._file.write(MAGIC)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        return {"path": self.path, "rows": self.rows, "chunks": len(self.chunks)}
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._tmp_path)
+
+
+class ArchiveReader:
+    """
+    Memory-mapped reader for archives written by ArchiveWriter.
+
+    Fixed-width columns come back as memoryviews over the mapping; text
+    columns are decompressed only for the chunks a scan actually touches.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+        size = len(self._map)
+        if size < 2 * len(MAGIC) + 8 or self._map[-len(MAGIC) :] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an event archive")
+        length_at = size - len(MAGIC) - 8
+        footer_length = int.from_bytes(self._map[length_at : length_at + 8], "little")
+        footer = json.loads(self._map[length_at - footer_length : length_at])
+
+        self.version = footer["version"]
+        self.rows = footer["rows"]
+        self.event_types = {int(k): v for k, v in footer["event_types"].items()}
+        self.chunks: List[Dict[str, Any]] = footer["chunks"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._map is None:
+            return
+        self._file.close()
+        try:
+            self._view.release()
+            self._map.close()
+        except BufferError:
+            # Column views handed out by column() are still referenced; the
+            # mapping is released once they are garbage collected
+            pass
+        self._map = None
+
+    def _raw(self, section: Dict[str, Any]) -> memoryview:
+        view = self._view[section["offset"] : section["offset"] + section["length"]]
+        if sys.byteorder != "little" and section["type"] != "B":
+            values = array(section["type"])
+            values.frombytes(view)
+            values.byteswap()
+            return memoryview(values)
+        return view.cast(section["type"])
+
+    def chunks_in_range(
+        self, start_ms: Optional[int] = None, end_ms: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Chunks that may hold rows in [start_ms, end_ms), from the footer index
+        """
+
+        return [
+            chunk
+            for chunk in self.chunks
+            if (start_ms is None or chunk["max_ts"] >= start_ms)
+            and (end_ms is None or chunk["min_ts"] < end_ms)
+        ]
+
+    def column(self, chunk: Dict[str, Any], name: str):
+        """
+        A fixed-width column as a zero-copy memoryview, or a text column as
+        a list of str/None
+        """
+
+        section = chunk["columns"][name]
+        if name not in TEXT_COLUMNS:
+            return self._raw(section)
+
+        offsets = self._raw(section["offsets"])
+        valid = self._raw(section["valid"])
+        values = self._view[
+            section["values"]["offset"] : section["values"]["offset"]
+            + section["values"]["length"]
+        ]
+        blob = zlib.decompress(values)
+        return [
+            blob[offsets[i] : offsets[i + 1]].decode() if valid[i] else None
+            for i in range(chunk["rows"])
+        ]
+
+    def scan(
+        self,
+        columns: List[str],
+        start_ms: Optional[int] = None,
+        end_ms: Optional[int] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yield {column: values} per chunk overlapping the time range.
+
+        Chunks are selected by the footer index only; rows at the edges of
+        the range are not filtered out.
+        """
+
+        for chunk in self.chunks_in_range(start_ms, end_ms):
+            yield {name: self.column(chunk, name) for name in columns}
+
+    def iter_rows(
+        self, start_ms: Optional[int] = None, end_ms: Optional[int] = None
+    ) -> Iterator[Row]:
+        """
+        Rows in [start_ms, end_ms) in id order, as stored in a partition
+        """
+
+        for values in self.scan(ROW_COLUMNS, start_ms, end_ms):
+            for row in zip(*(values[name] for name in ROW_COLUMNS)):
+                if start_ms is not None and row[1] < start_ms:
+                    continue
+                if end_ms is not None and row[1] >= end_ms:
+                    continue
+                yield row
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "bytes": len(self._map),
+            "rows": self.rows,
+            "chunks": len(self.chunks),
+            "min_ts": min((c["min_ts"] for c in self.chunks), default=None),
+            "max_ts": max((c["max_ts"] for c in self.chunks), default=None),
+        }
+
+
+def rollup_rows(
+    reader: ArchiveReader,
+    start_ms: Optional[int] = None,
+    end_ms: Optional[int] = None,
+) -> Iterator[Tuple[int, int, float]]:
+    """
+    (ts_ms, event_type_id, amount) rows for record_rollups; only purchase
+    payloads are parsed
+    """
+
+    for ts, type_id, data in _columns(
+        reader, ["ts", "event_type_id", "data"], start_ms, end_ms
+    ):
+        event_type = reader.event_types.get(type_id)
+        amount = 0.0
+        if data and event_type is not None:
+            amount = event_amount(event_type, json.loads(data))
+        yield ts, type_id, amount
+
+
+def _columns(
+    reader: ArchiveReader,
+    names: List[str],
+    start_ms: Optional[int],
+    end_ms: Optional[int],
+) -> Iterator[tuple]:
+    # names[0] must be "ts"
+    for values in reader.scan(names, start_ms, end_ms):
+        for row in zip(*(values[name] for name in names)):
+            if start_ms is not None and row[0] < start_ms:
+                continue
+            if end_ms is not None and row[0] >= end_ms:
+                continue
+            yield row
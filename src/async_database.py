@@ -0,0 +1,112 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+from database import DB_POOL_READERS
+
+DB_READ_WORKERS = int(os.environ.get("DB_READ_WORKERS", str(DB_POOL_READERS)))
+
+
+class _ExecutorLane:
+    """
+    A bounded thread pool plus the counters needed to see its backlog
+    """
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=f"db-{name}"
+        )
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    def _call(self, submitted: float, fn: Callable, *args, **kwargs):
+        started = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_seconds += started - submitted
+
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+                self.run_seconds += time.perf_counter() - started
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        with self._lock:
+            self.queued += 1
+            if self.queued > self.max_queued:
+                self.max_queued = self.queued
+
+        loop = asyncio.get_running_loop()
+        call = functools.partial(self._call, time.perf_counter(), fn, *args, **kwargs)
+        return await loop.run_in_executor(self.executor, call)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            completed = self.completed
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queued,
+                "max_queue_depth": self.max_queued,
+                "running": self.running,
+                "completed": completed,
+                "failed": self.failed,
+                "avg_wait_seconds": self.wait_seconds / completed if completed else 0.0,
+                "avg_run_seconds": self.run_seconds / completed if completed else 0.0,
+            }
+
+
+class AsyncDatabase:
+    """
+    Run blocking database calls off the event loop.
+
+    Writes go through a single-threaded lane, matching the pool's single
+    writer connection, so ingestion never queues behind slow analytics
+    queries running on the reader lane.
+    """
+
+    def __init__(self, read_workers: int = DB_READ_WORKERS):
+        self._reads = _ExecutorLane("read", read_workers)
+        self._writes = _ExecutorLane("write", 1)
+
+    async def read(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run a read-only database function on the reader pool
+        """
+
+        return await self._reads.run(fn, *args, **kwargs)
+
+    async def write(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run a database function that writes on the writer thread
+        """
+
+        return await self._writes.run(fn, *args, **kwargs)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"read": self._reads.get_stats(), "write": self._writes.get_stats()}
+
+    def shutdown(self):
+        self._reads.executor.shutdown(wait=True)
+        self._writes.executor.shutdown(wait=True)
+
+
+async_db = AsyncDatabase()
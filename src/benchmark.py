@@ -0,0 +1,526 @@
+"""
+Load generation and benchmarks for the ingest, query and fan-out paths.
+
+Runs in-process against its own database in --workdir and prints results
+as JSON, e.g.
+
+    python src/benchmark.py --rows 1000000 --output results.json
+    python src/benchmark.py --workdir bench-10m --rows 10000000 --reuse \\
+        --scenarios queries
+
+With --reuse an existing workdir is topped up to --rows instead of being
+rebuilt, so the 10M and 100M row datasets only have to be loaded once.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FUNNEL = ["page_view", "product_view", "add_to_cart", "user_signup", "purchase"]
+# Probability of moving on from each funnel step to the next
+DEFAULT_CONTINUE_RATES = [0.6, 0.45, 0.5, 0.7]
+
+SCENARIOS = ["populate", "ingest", "ingest_direct", "queries", "fanout"]
+
+LOAD_BATCH_SIZE = 10000
+
+
+class TrafficGenerator:
+    """
+    Synthetic shoppers walking the conversion funnel.
+
+    Each journey starts with a page view and continues to the next step
+    with the configured probability; purchase amounts are log-normal
+    around amount_median.
+    """
+
+    def __init__(
+        self,
+        users: int = 10000,
+        continue_rates: List[float] = DEFAULT_CONTINUE_RATES,
+        amount_median: float = 80.0,
+        amount_sigma: float = 0.8,
+        seed: int = 42,
+    ):
+        if len(continue_rates) != len(FUNNEL) - 1:
+            raise ValueError(
+                f"Expected {len(FUNNEL) - 1} continue rates, got {len(continue_rates)}"
+            )
+
+        self.users = users
+        self.continue_rates = continue_rates
+        self.amount_mu = math.log(amount_median)
+        self.amount_sigma = amount_sigma
+        self.random = random.Random(seed)
+
+    def _data(self, event_type: str) -> Dict[str, Any]:
+        rng = self.random
+        if event_type == "page_view":
+            return {"page": rng.choice(["/home", "/sale", "/new", "/search"])}
+        if event_type == "product_view":
+            return {
+                "product": f"prod_{rng.randint(1, 500)}",
+                "price": rng.randint(5, 500),
+            }
+        if event_type == "add_to_cart":
+            return {
+                "product": f"prod_{rng.randint(1, 500)}",
+                "quantity": rng.randint(1, 3),
+            }
+        if event_type == "user_signup":
+            return {"method": rng.choice(["email", "google", "apple"])}
+        return {
+            "amount": round(rng.lognormvariate(self.amount_mu, self.amount_sigma), 2),
+            "payment": rng.choice(["card", "paypal"]),
+            "product": f"prod_{rng.randint(1, 500)}",
+        }
+
+    def journey(self) -> List[tuple]:
+        """
+        (event_type, user_id, data) tuples for one user session
+        """
+
+        user_id = f"user_{self.random.randint(1, self.users)}"
+        steps = [FUNNEL[0]]
+        for step, rate in zip(FUNNEL[1:], self.continue_rates):
+            if self.random.random() >= rate:
+                break
+            steps.append(step)
+        return [(step, user_id, self._data(step)) for step in steps]
+
+    def events(self, count: int) -> Iterator:
+        from models import Event
+
+        produced = 0
+        while produced < count:
+            for event_type, user_id, data in self.journey():
+                # Skip validation; the generator only emits well-formed events
+                yield Event.model_construct(
+                    event_type=event_type, user_id=user_id, data=data
+                )
+                produced += 1
+                if produced == count:
+                    return
+
+
+def summarize(samples_ms: List[float]) -> Dict[str, float]:
+    """
+    Count, mean and tail latencies in milliseconds
+    """
+
+    if not samples_ms:
+        return {"count": 0}
+    ordered = sorted(samples_ms)
+
+    def percentile(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 3)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "p50": percentile(0.50),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99),
+        "max": round(ordered[-1], 3),
+    }
+
+
+def time_calls(fn: Callable, repeat: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return summarize(samples)
+
+
+def stored_rows(database) -> int:
+    return database.get_events(1)["total"]
+
+
+def run_populate(database, generator: TrafficGenerator, rows: int, days: int):
+    """
+    Bulk load up to `rows` events, spread evenly over the last `days` days
+    """
+
+    existing = stored_rows(database)
+    missing = max(0, rows - existing)
+    now_ms = int(time.time() * 1000)
+    span_ms = days * 24 * 60 * 60 * 1000
+    step_ms = span_ms / missing if missing else 0
+
+    started = time.perf_counter()
+    events = generator.events(missing)
+    loaded = 0
+    while loaded < missing:
+        batch = [event for _, event in zip(range(LOAD_BATCH_SIZE), events)]
+        received_ms = [
+            int(now_ms - span_ms + (loaded + i) * step_ms) for i in range(len(batch))
+        ]
+        database.insert_events(batch, received_ms)
+        loaded += len(batch)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "existing_rows": existing,
+        "loaded_rows": loaded,
+        "total_rows": existing + loaded,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(loaded / elapsed) if loaded else None,
+    }
+
+
+async def run_ingest(
+    generator: TrafficGenerator,
+    events: int,
+    concurrency: int,
+    batch_size: int,
+    mode: str,
+):
+    """
+    Concurrent /track-style submissions through the group-commit buffer
+    """
+
+    from ingest_buffer import IngestBuffer, IngestBufferFull
+
+    buffer = IngestBuffer(mode=mode)
+    await buffer.start()
+    source = generator.events(events)
+    latencies = []
+    rejected = 0
+
+    async def client():
+        nonlocal rejected
+        while True:
+            batch = [event for _, event in zip(range(batch_size), source)]
+            if not batch:
+                return
+            started = time.perf_counter()
+            try:
+                await buffer.submit(batch)
+            except IngestBufferFull:
+                rejected += len(batch)
+                await asyncio.sleep(0.01)
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    await buffer.stop()
+    elapsed = time.perf_counter() - started
+
+    stats = buffer.get_stats()
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "batch_size": batch_size,
+        "events": stats["committed"],
+        "seconds": round(elapsed, 3),
+        "events_per_second": round(stats["committed"] / elapsed),
+        "rejected_events": rejected,
+        "group_commits": stats["group_commits"],
+        "avg_group_size": stats["avg_group_size"],
+        "submit_latency_ms": summarize(latencies),
+    }
+
+
+async def run_ingest_direct(
+    database, generator: TrafficGenerator, events: int, concurrency: int
+):
+    """
+    The same load as run_ingest with one transaction per request, as a
+    baseline for the group commit
+    """
+
+    from async_database import async_db
+
+    source = generator.events(events)
+    latencies = []
+
+    async def client():
+        for event in source:
+            started = time.perf_counter()
+            await async_db.write(database.insert_event, event)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "events": len(latencies),
+        "seconds": round(elapsed, 3),
+        "events_per_second": round(len(latencies) / elapsed),
+        "submit_latency_ms": summarize(latencies),
+    }
+
+
+def run_queries(database, repeat: int):
+    """
+    Latency of the analytics reads behind the dashboard and API
+    """
+
+    calls = {
+        "stats": database.get_stats,
+        "funnel": database.get_funnel_analysis,
+        "funnel_24h": lambda: database.get_funnel_analysis("24h"),
+        "segmentation": database.get_user_segmentation,
+        "user_profile": lambda: database.get_user_profile("user_1"),
+        "anomalies": database.detect_anomalies,
+        "timeseries_minute": lambda: database.get_timeseries("minute"),
+        "timeseries_hour": lambda: database.get_timeseries("hour"),
+        "timeseries_day_30": lambda: database.get_timeseries(
+            "day", int(time.time() * 1000) - 30 * 86400000
+        ),
+        "events_page": lambda: database.query_events(100),
+        "events_page_by_type": lambda: database.query_events(
+            100, event_type="purchase"
+        ),
+        "events_page_by_user": lambda: database.query_events(100, user_id="user_1"),
+        "recent_events": lambda: database.get_events(10),
+        "views_by_page": lambda: database.get_property_breakdown("page_view", "page"),
+        "revenue_by_product": lambda: database.get_property_breakdown(
+            "purchase", "product", "amount"
+        ),
+        "events_page_by_property": lambda: database.query_events(
+            100, event_type="purchase", properties=[("payment", "card")]
+        ),
+        "top_items_1h": lambda: database.get_top_items(window="1h"),
+        "paths": database.get_path_analysis,
+    }
+    results = {name: time_calls(fn, repeat) for name, fn in calls.items()}
+    # Rebuilding in-memory state is the startup cost at this size
+    results["reseed_analytics"] = time_calls(database.reseed_analytics, 1)
+    results["rows"] = stored_rows(database)
+    return results
+
+
+class FakeWebSocket:
+    """
+    Stand-in client socket that counts messages, optionally slowly
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.received = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def run_fanout(clients: int, messages: int, delay_ms: float, policy: str):
+    """
+    Broadcast to N simulated clients and wait for every queue to drain
+    """
+
+    from websocket_manager import TOPICS, WebSocketManager
+
+    manager = WebSocketManager(policy=policy)
+    sockets = [FakeWebSocket(delay_ms / 1000) for _ in range(clients)]
+    for socket in sockets:
+        await manager.connect(socket)
+        await manager.handle_message(socket, {"type": "subscribe", "topics": TOPICS})
+
+    started = time.perf_counter()
+    for i in range(messages):
+        if i % 2:
+            await manager.publish("stats", {"total_events": i, "tick": i % 7})
+        else:
+            await manager.send_to_topic(
+                "events", {"type": "new_event", "data": {"id": i}}
+            )
+        # Let sender tasks run, as a live event loop would between requests
+        await asyncio.sleep(0)
+    enqueued = time.perf_counter() - started
+
+    while manager.get_stats()["queued_messages"] or any(
+        client.stale_topics for client in manager.clients.values()
+    ):
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - started
+
+    stats = manager.get_stats()
+    delivered = sum(socket.received for socket in sockets)
+    for socket in sockets:
+        manager.disconnect(socket)
+
+    return {
+        "clients": clients,
+        "messages": messages,
+        "client_delay_ms": delay_ms,
+        "policy": policy,
+        "enqueue_seconds": round(enqueued, 3),
+        "drain_seconds": round(elapsed, 3),
+        "delivered": delivered,
+        "deliveries_per_second": round(delivered / elapsed),
+        "messages_dropped": stats["messages_dropped"],
+        "slow_disconnects": stats["slow_disconnects"],
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=SRC_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help=f"comma-separated subset of {','.join(SCENARIOS)}",
+    )
+    parser.add_argument("--workdir", default="benchmark-data")
+    parser.add_argument(
+        "--reuse", action="store_true", help="keep and top up an existing database"
+    )
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--seed", type=int, default=42)
+
+    traffic = parser.add_argument_group("traffic")
+    traffic.add_argument("--users", type=int, default=10000)
+    traffic.add_argument(
+        "--continue-rates",
+        default=",".join(str(r) for r in DEFAULT_CONTINUE_RATES),
+        help="probability of reaching each next funnel step",
+    )
+    traffic.add_argument("--amount-median", type=float, default=80.0)
+    traffic.add_argument("--amount-sigma", type=float, default=0.8)
+
+    populate = parser.add_argument_group("populate")
+    populate.add_argument("--rows", type=int, default=100000)
+    populate.add_argument("--days", type=int, default=7)
+
+    ingest = parser.add_argument_group("ingest")
+    ingest.add_argument("--ingest-events", type=int, default=20000)
+    ingest.add_argument("--concurrency", type=int, default=50)
+    ingest.add_argument("--batch-size", type=int, default=1)
+    ingest.add_argument("--durability", default="commit")
+
+    queries = parser.add_argument_group("queries")
+    queries.add_argument("--repeat", type=int, default=50)
+
+    fanout = parser.add_argument_group("fanout")
+    fanout.add_argument("--clients", type=int, default=1000)
+    fanout.add_argument("--messages", type=int, default=200)
+    fanout.add_argument("--client-delay-ms", type=float, default=0.0)
+    fanout.add_argument("--policy", default="drop_oldest")
+
+    args = parser.parse_args(argv)
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    args.continue_rates = [float(r) for r in args.continue_rates.split(",")]
+    return args
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    if not args.reuse:
+        for name in os.listdir("."):
+            if name.startswith("events.db"):
+                os.remove(name)
+
+    sys.path.insert(0, SRC_DIR)
+    # Imported after chdir: the database module opens events.db on import
+    import database
+
+    database.init_database()
+
+    def generator(offset: int) -> TrafficGenerator:
+        return TrafficGenerator(
+            args.users,
+            args.continue_rates,
+            args.amount_median,
+            args.amount_sigma,
+            args.seed + offset,
+        )
+
+    results: Dict[str, Any] = {}
+    if "populate" in args.scenarios:
+        results["populate"] = run_populate(database, generator(0), args.rows, args.days)
+    if "ingest" in args.scenarios:
+        results["ingest"] = await run_ingest(
+            generator(1),
+            args.ingest_events,
+            args.concurrency,
+            args.batch_size,
+            args.durability,
+        )
+    if "ingest_direct" in args.scenarios:
+        results["ingest_direct"] = await run_ingest_direct(
+            database, generator(2), args.ingest_events, args.concurrency
+        )
+    if "queries" in args.scenarios:
+        results["queries"] = run_queries(database, args.repeat)
+    if "fanout" in args.scenarios:
+        results["fanout"] = await run_fanout(
+            args.clients, args.messages, args.client_delay_ms, args.policy
+        )
+
+    from async_database import async_db
+
+    async_db.shutdown()
+    database.close_database()
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    output = os.path.abspath(args.output) if args.output else None
+    started = time.time()
+    results = asyncio.run(run(args))
+
+    report = {
+        "meta": {
+            "started_at": started,
+            "seconds": round(time.time() - started, 3),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "params": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
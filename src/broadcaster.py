@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+from database import (
+    get_stats,
+    get_funnel_analysis,
+    get_segment_counts,
+    detect_anomalies,
+    get_top_items,
+)
+from websocket_manager import websocket_manager
+from async_database import async_db
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_INTERVAL_MS = int(os.environ.get("ANALYTICS_BROADCAST_INTERVAL_MS", "500"))
+
+
+class AnalyticsBroadcaster:
+    """
+    Recompute analytics in the background and push them to clients.
+
+    Ingest paths only call mark_dirty(); bursts of events are coalesced
+    into at most one recompute and broadcast per interval.
+    """
+
+    def __init__(self, interval_ms: int = BROADCAST_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self._dirty = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.broadcasts = 0
+        self.coalesced = 0
+
+    def mark_dirty(self):
+        """
+        Flag analytics as stale so the next tick recomputes them
+        """
+
+        if self._dirty.is_set():
+            self.coalesced += 1
+        self._dirty.set()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            started = time.monotonic()
+
+            try:
+                await self.broadcast()
+            except Exception as e:
+                logger.error(f"Error broadcasting analytics: {str(e)}")
+
+            # Anything marked dirty while we were busy waits for the next tick
+            elapsed = time.monotonic() - started
+            if elapsed < self.interval:
+                await asyncio.sleep(self.interval - elapsed)
+
+    async def broadcast(self):
+        """
+        Recompute analytics and push changes to subscribed clients
+        """
+
+        if not websocket_manager.active_connections:
+            return
+
+        (
+            updated_stats,
+            funnel_data,
+            segmentation_data,
+            anomaly_data,
+            top_data,
+        ) = await asyncio.gather(
+            async_db.read(get_stats),
+            async_db.read(get_funnel_analysis),
+            async_db.read(get_segment_counts),
+            async_db.read(detect_anomalies),
+            async_db.read(get_top_items),
+        )
+
+        await websocket_manager.publish("stats", updated_stats)
+        await websocket_manager.publish("funnel", funnel_data)
+        await websocket_manager.publish("segmentation", segmentation_data)
+        await websocket_manager.publish("anomalies", anomaly_data)
+        await websocket_manager.publish("top", top_data)
+        self.broadcasts += 1
+
+    def get_stats(self):
+        return {
+            "interval_ms": int(self.interval * 1000),
+            "dirty": self._dirty.is_set(),
+            "broadcasts": self.broadcasts,
+            "coalesced": self.coalesced,
+        }
+
+
+analytics_broadcaster = AnalyticsBroadcaster()
@@ -0,0 +1,170 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List
+
+# Negative cache_size is in KiB, so this is a 64 MiB page cache per connection
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+
+# sqlite3 keeps an LRU of compiled statements per connection; since our
+# connections are long-lived, repeated queries skip the parse step.
+STATEMENT_CACHE_SIZE = 256
+
+
+class ConnectionPool:
+    """
+    One writer connection plus a bounded set of reader connections.
+
+    WAL mode lets readers run concurrently with the single writer, so
+    writes are serialized by a lock while reads are spread over the pool.
+    """
+
+    def __init__(self, db_file: str, readers: int = 4, timeout: float = 30.0):
+        self.db_file = db_file
+        self.size = readers
+        self.timeout = timeout
+
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._all_readers: List[sqlite3.Connection] = []
+        self._create_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+        self._stats = {
+            "reader_acquisitions": 0,
+            "reader_waits": 0,
+            "reader_wait_seconds": 0.0,
+            "reader_max_wait_seconds": 0.0,
+            "readers_in_use": 0,
+            "writer_acquisitions": 0,
+            "writer_waits": 0,
+            "writer_wait_seconds": 0.0,
+            "writer_max_wait_seconds": 0.0,
+        }
+
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_file,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            # Readers run in autocommit so they never pin an old WAL snapshot
+            isolation_level=None if read_only else "",
+        )
+        for name, value in PRAGMAS.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        if read_only:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def _record_wait(self, role: str, waited: float, blocked: bool):
+        with self._stats_lock:
+            self._stats[f"{role}_acquisitions"] += 1
+            self._stats[f"{role}_wait_seconds"] += waited
+            if blocked:
+                self._stats[f"{role}_waits"] += 1
+            if waited > self._stats[f"{role}_max_wait_seconds"]:
+                self._stats[f"{role}_max_wait_seconds"] = waited
+
+    def _checkout_reader(self) -> sqlite3.Connection:
+        try:
+            conn = self._readers.get_nowait()
+            self._record_wait("reader", 0.0, False)
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._create_lock:
+            if len(self._all_readers) < self.size:
+                conn = self._connect(read_only=True)
+                self._all_readers.append(conn)
+                self._record_wait("reader", 0.0, False)
+                return conn
+
+        started = time.perf_counter()
+        try:
+            conn = self._readers.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError("Timed out waiting for a database reader connection")
+        self._record_wait("reader", time.perf_counter() - started, True)
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """
+        Borrow a read-only connection from the pool
+        """
+
+        conn = self._checkout_reader()
+        with self._stats_lock:
+            self._stats["readers_in_use"] += 1
+        try:
+            yield conn
+        finally:
+            with self._stats_lock:
+                self._stats["readers_in_use"] -= 1
+            self._readers.put(conn)
+
+    @contextmanager
+    def writer(self):
+        """
+        Hold the single writer connection; commits on success
+        """
+
+        started = time.perf_counter()
+        blocked = not self._writer_lock.acquire(blocking=False)
+        if blocked and not self._writer_lock.acquire(timeout=self.timeout):
+            raise TimeoutError("Timed out waiting for the database writer connection")
+        self._record_wait("writer", time.perf_counter() - started, blocked)
+
+        try:
+            if self._writer is None:
+                self._writer = self._connect()
+            try:
+                yield self._writer
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+        finally:
+            self._writer_lock.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Snapshot of pool usage and contention counters
+        """
+
+        with self._stats_lock:
+            stats = dict(self._stats)
+
+        stats["reader_pool_size"] = self.size
+        stats["readers_open"] = len(self._all_readers)
+        stats["readers_idle"] = self._readers.qsize()
+        stats["writer_busy"] = self._writer_lock.locked()
+        for role in ("reader", "writer"):
+            acquisitions = stats[f"{role}_acquisitions"]
+            stats[f"{role}_avg_wait_seconds"] = (
+                stats[f"{role}_wait_seconds"] / acquisitions if acquisitions else 0.0
+            )
+        return stats
+
+    def close(self):
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+        with self._create_lock:
+            for conn in self._all_readers:
+                conn.close()
+            self._all_readers = []
+            self._readers = queue.Queue()
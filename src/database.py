@@ -1,150 +1,681 @@
-import sqlite3
 from models import Event
-from typing import Dict, Any
+from connection_pool import ConnectionPool
+from stats_aggregator import StatsAggregator
+from funnel_engine import FunnelEngine
+from anomaly_detector import AnomalyDetector
+from user_profiles import UserProfileStore, SEGMENTS
+from event_window import EventWindow
+import event_window as window_analytics
+from heavy_hitters import TOP_K, HeavyHitters
+from path_analysis import (
+    DEFAULT_PATH_DEPTH,
+    MAX_PATH_DEPTH,
+    MAX_PATHS,
+    OrderedFunnel,
+    PathTrie,
+    user_streams,
+)
+from migrations import migrate
+from archive import ARCHIVE_SUFFIX, ArchiveReader, ArchiveWriter, rollup_rows
+from result_cache import result_cache
+from json_codec import RawJSON, dumps_str, loads
+from metrics import analytics_seconds, events_ingested, insert_seconds
+from partitions import (
+    DAY_MS,
+    allocate_event_ids,
+    cold_partitions,
+    compact_partition,
+    drop_all_partitions,
+    drop_partitions_before,
+    ensure_partition,
+    expired_partitions,
+    forget_partitions,
+    list_partitions,
+    partition_tables,
+)
+from properties import (
+    INDEXED_PROPERTIES,
+    MAX_PROPERTY_GROUPS,
+    aggregate_property,
+    backfill_property,
+    coerce_value,
+    extract_properties,
+    parse_declarations,
+    register_property,
+)
+from rollups import (
+    GRANULARITIES,
+    MAX_TIMESERIES_POINTS,
+    clear_rollups,
+    event_amount,
+    query_timeseries,
+    record_rollups,
+)
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime, timezone
-import json
-import statistics
+from functools import lru_cache
+from itertools import islice
+import os
+import time
 
 DB_FILE = "events.db"
+DB_POOL_READERS = int(os.environ.get("DB_POOL_READERS", "4"))
+
+# Raw events are kept for this many days (0 keeps them forever); rollups
+# are never expired
+EVENT_RETENTION_DAYS = int(os.environ.get("EVENT_RETENTION_DAYS", "0"))
+# Day partitions older than this are rewritten once they stop receiving writes
+EVENT_COMPACT_AFTER_DAYS = int(os.environ.get("EVENT_COMPACT_AFTER_DAYS", "2"))
+
+# Columnar archives are written here; expired partitions are archived
+# before they are dropped unless EVENT_ARCHIVE_EXPIRED is turned off
+ARCHIVE_DIR = os.environ.get("EVENT_ARCHIVE_DIR", "archive")
+EVENT_ARCHIVE_EXPIRED = os.environ.get("EVENT_ARCHIVE_EXPIRED", "1") == "1"
+
+MAX_EVENTS_PAGE = 1000
+
+# Archive rows added to the rollups per write transaction
+BACKFILL_BATCH_SIZE = 10000
+
+pool = ConnectionPool(DB_FILE, readers=DB_POOL_READERS)
+stats_aggregator = StatsAggregator()
+funnel_engine = FunnelEngine()
+anomaly_detector = AnomalyDetector()
+user_profiles = UserProfileStore()
+event_window = EventWindow()
+heavy_hitters = HeavyHitters()
+
+
+# Event type dictionary: names are stored as small integer codes
+_type_ids: Dict[str, int] = {}
+_type_names: Dict[int, str] = {}
+
+# Indexed properties: event type id -> [(property_id, key, kind)] for
+# extraction at ingest, and (event type, key) -> (property_id, kind)
+_declared_properties: Dict[int, List[Tuple[int, str, str]]] = {}
+_property_ids: Dict[Tuple[str, str], Tuple[int, str]] = {}
 
 
 def init_database():
     """
-    Create the events table if it does not exist.
+    Bring the schema up to date and seed the in-memory analytics
+    state from it.
     """
 
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    with pool.writer() as conn:
+        migrate(conn)
+        _load_event_types(conn)
 
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            event_type TEXT NOT NULL,
-            user_id TEXT,
-            data TEXT,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP           
-        )               
-        """
+    sync_properties()
+    reseed_analytics()
+
+
+def sync_properties():
+    """
+    Register the INDEXED_PROPERTIES declarations and extract newly declared
+    properties from the events already stored, one partition per transaction
+    """
+
+    declarations = parse_declarations(INDEXED_PROPERTIES)
+    with pool.writer() as conn:
+        _declared_properties.clear()
+        _property_ids.clear()
+        for event_type, key, kind in declarations:
+            type_id = _event_type_id(conn, event_type)
+            property_id = register_property(conn, type_id, key, kind)
+            _declared_properties.setdefault(type_id, []).append(
+                (property_id, key, kind)
+            )
+            _property_ids[(event_type, key)] = (property_id, kind)
+
+        declared = {property_id for property_id, _ in _property_ids.values()}
+        pending = [
+            row
+            for row in conn.execute(
+                """
+                SELECT id, event_type_id, key, kind FROM event_properties
+                WHERE backfilled = 0
+                """
+            ).fetchall()
+            if row[0] in declared
+        ]
+        tables = partition_tables(conn)
+
+    for property_id, type_id, key, kind in pending:
+        for table in tables:
+            with pool.writer() as conn:
+                backfill_property(conn, table, property_id, type_id, key, kind)
+        with pool.writer() as conn:
+            conn.execute(
+                "UPDATE event_properties SET backfilled = 1 WHERE id = ?",
+                (property_id,),
+            )
+
+
+@analytics_seconds.labels("reseed").time()
+def reseed_analytics():
+    """
+    Rebuild all in-memory analytics state from the stored events
+    """
+
+    with pool.reader() as conn:
+        # One read transaction so every engine is seeded from the same
+        # snapshot
+        conn.execute("BEGIN")
+        try:
+            stats_aggregator.seed(conn)
+            funnel_engine.seed(conn)
+            anomaly_detector.seed(conn)
+            user_profiles.seed(conn)
+            event_window.seed(conn)
+            heavy_hitters.seed(conn)
+        finally:
+            conn.execute("COMMIT")
+    result_cache.invalidate()
+
+
+def _load_event_types(conn):
+    for type_id, name in conn.execute("SELECT id, name FROM event_types"):
+        _type_ids[name] = type_id
+        _type_names[type_id] = name
+
+
+def _event_type_id(conn, name: str) -> int:
+    """
+    Code for an event type, registering it on first use (writer only)
+    """
+
+    type_id = _type_ids.get(name)
+    if type_id is None:
+        conn.execute("INSERT OR IGNORE INTO event_types (name) VALUES (?)", (name,))
+        type_id = conn.execute(
+            "SELECT id FROM event_types WHERE name = ?", (name,)
+        ).fetchone()[0]
+        _type_ids[name] = type_id
+        _type_names[type_id] = name
+    return type_id
+
+
+def _event_type_name(conn, type_id: int) -> str:
+    name = _type_names.get(type_id)
+    if name is None:
+        # Registered by another process since we last looked
+        _load_event_types(conn)
+        name = _type_names.get(type_id, str(type_id))
+    return name
+
+
+# Rows committed together share timestamps, so page reads repeat them often
+@lru_cache(maxsize=4096)
+def _iso_from_ms(ms: int) -> str:
+    return datetime.fromtimestamp(ms / 1000, timezone.utc).isoformat()
+
+
+@lru_cache(maxsize=4096)
+def _sqlite_datetime_from_ms(ms: int) -> str:
+    # Same text format the old created_at DEFAULT CURRENT_TIMESTAMP produced
+    return datetime.fromtimestamp(ms // 1000, timezone.utc).strftime(
+        "%Y-%m-%d %H:%M:%S"
     )
 
-    conn.commit()
-    conn.close()
 
+def _insert_properties(conn, table: str, rows: List[tuple], events: List[Event]):
+    """
+    Store the indexed properties of newly inserted (id, ts, type id, ...)
+    rows in the partition's side table
+    """
+
+    values = []
+    for row, event in zip(rows, events):
+        declared = _declared_properties.get(row[2])
+        if declared:
+            values.extend(
+                (row[0], property_id, row[1], value)
+                for property_id, value in extract_properties(declared, event.data)
+            )
+    if values:
+        conn.executemany(
+            f"""
+            INSERT OR IGNORE INTO {table}_props (event_id, property_id, ts, value)
+            VALUES (?, ?, ?, ?)
+            """,
+            values,
+        )
+
+
+def _count_ingested(events: List[Event]):
+    counts: Dict[str, int] = {}
+    for event in events:
+        counts[event.event_type] = counts.get(event.event_type, 0) + 1
+    for event_type, count in counts.items():
+        events_ingested.labels(event_type).inc(count)
+
+
+def _record_ingested(events: List[Event], now: float, notify: bool = True):
+    """
+    Feed newly committed events to the in-memory analytics state
+    """
+
+    stats_aggregator.record_many(events, now)
+    funnel_engine.record_many(events, now)
+    anomaly_detector.record_many(events, now, notify)
+    user_profiles.record_many(events, now)
+    event_window.record_many(events, now)
+    heavy_hitters.record_many(events, now)
+    result_cache.invalidate()
 
+
+def apply_remote_ingest(events: List[Dict[str, Any]], at: float):
+    """
+    Apply events committed by another worker process to this process's
+    analytics state; that worker reports any anomalies they trigger
+    """
+
+    _record_ingested([Event(**event) for event in events], at, notify=False)
+
+
+@insert_seconds.labels("single").time()
 def insert_event(event: Event) -> Dict[str, Any]:
     """
     Insert a new event into the database
     """
 
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    now_ms = int(time.time() * 1000)
+    data_json = dumps_str(event.data)
+
+    try:
+        with pool.writer() as conn:
+            type_id = _event_type_id(conn, event.event_type)
+            table = ensure_partition(conn, now_ms)
+            event_id = allocate_event_ids(conn, 1)
+            conn.execute(
+                f"""
+                INSERT INTO {table}
+                    (id, ts, event_type_id, user_id, data, created_ts)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (event_id, now_ms, type_id, event.user_id, data_json, now_ms),
+            )
+            _insert_properties(conn, table, [(event_id, now_ms, type_id)], [event])
+
+            record_rollups(
+                conn, [(now_ms, type_id, event_amount(event.event_type, event.data))]
+            )
+    except Exception:
+        # A partition created in the rolled back transaction no longer exists
+        forget_partitions()
+        raise
+
+    _count_ingested([event])
+    _record_ingested([event], now_ms / 1000)
+
+    return {"event_id": event_id, "total_events": stats_aggregator.total_events}
+
+
+@insert_seconds.labels("batch").time()
+def insert_events(
+    events: List[Event],
+    received_ms: Optional[List[int]] = None,
+    log_position: Optional[Tuple[str, int]] = None,
+) -> Dict[str, Any]:
+    """
+    Insert a batch of events in a single transaction.
+
+    received_ms gives each event's arrival time when it was buffered before
+    this commit. log_position (log name, sequence) is stored in the same
+    transaction so that replaying an ingest log never inserts twice.
+    """
 
-    timestamp = datetime.now(timezone.utc).isoformat()
-    data_json = json.dumps(event.data)
+    now_ms = int(time.time() * 1000)
+    if received_ms is None:
+        received_ms = [now_ms] * len(events)
+
+    try:
+        with pool.writer() as conn:
+            # The batch occupies a contiguous range of ids
+            first_id = allocate_event_ids(conn, len(events))
+            rows = [
+                (
+                    first_id + i,
+                    ts,
+                    _event_type_id(conn, event.event_type),
+                    event.user_id,
+                    dumps_str(event.data),
+                    now_ms,
+                )
+                for i, (event, ts) in enumerate(zip(events, received_ms))
+            ]
+
+            by_table: Dict[str, Tuple[List[tuple], List[Event]]] = {}
+            for row, event in zip(rows, events):
+                table = ensure_partition(conn, row[1])
+                table_rows, table_events = by_table.setdefault(table, ([], []))
+                table_rows.append(row)
+                table_events.append(event)
+            for table, (table_rows, table_events) in by_table.items():
+                conn.executemany(
+                    f"""
+                    INSERT INTO {table}
+                        (id, ts, event_type_id, user_id, data, created_ts)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    table_rows,
+                )
+                _insert_properties(conn, table, table_rows, table_events)
+
+            record_rollups(
+                conn,
+                [
+                    (row[1], row[2], event_amount(event.event_type, event.data))
+                    for row, event in zip(rows, events)
+                ],
+            )
 
-    cursor.execute(
+            if log_position is not None:
+                _advance_ingest_log(conn, *log_position)
+    except Exception:
+        forget_partitions()
+        raise
+
+    _count_ingested(events)
+    _record_ingested(events, now_ms / 1000)
+
+    return {
+        "event_ids": list(range(first_id, first_id + len(rows))),
+        "inserted": len(rows),
+        "total_events": stats_aggregator.total_events,
+        "timestamp": _iso_from_ms(now_ms),
+    }
+
+
+def _advance_ingest_log(conn, name: str, seq: int):
+    conn.execute(
         """
-        INSERT INTO events (timestamp, event_type, user_id, data)
-        VALUES (?, ?, ?, ?)
+        INSERT INTO schema_meta (key, value) VALUES (?, ?)
+        ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)
         """,
-        (timestamp, event.event_type, event.user_id, data_json),
+        (f"ingest_log:{name}", seq),
     )
 
-    event_id = cursor.lastrowid
-    conn.commit()
 
-    cursor.execute("SELECT COUNT(*) FROM events")
-    total_events = cursor.fetchone()[0]
+def skip_ingest_log(name: str, seq: int):
+    """
+    Mark an ingest log's events up to seq as done without committing them,
+    so events dropped after failing are not replayed
+    """
+
+    with pool.writer() as conn:
+        _advance_ingest_log(conn, name, seq)
+
+
+def get_ingest_log_position(name: str) -> int:
+    """
+    Highest sequence of an ingest log whose events have been committed
+    """
+
+    with pool.reader() as conn:
+        row = conn.execute(
+            "SELECT value FROM schema_meta WHERE key = ?", (f"ingest_log:{name}",)
+        ).fetchone()
+    return row[0] if row else 0
+
+
+def forget_ingest_log(name: str):
+    with pool.writer() as conn:
+        conn.execute("DELETE FROM schema_meta WHERE key = ?", (f"ingest_log:{name}",))
+
+
+def _event_from_row(conn, row, raw: bool = False) -> Dict[str, Any]:
+    if raw:
+        data = RawJSON(row[4] or "{}")
+    else:
+        data = loads(row[4]) if row[4] else {}
+    return {
+        "id": row[0],
+        "timestamp": _iso_from_ms(row[1]),
+        "event_type": _event_type_name(conn, row[2]),
+        "user_id": row[3],
+        "data": data,
+        "created_at": _sqlite_datetime_from_ms(row[5]),
+    }
 
-    conn.close()
 
-    return {"event_id": event_id, "total_events": total_events}
+def _indexed_property(event_type: str, key: str) -> Tuple[int, str]:
+    found = _property_ids.get((event_type, key))
+    if found is None:
+        raise ValueError(f"Property '{key}' of '{event_type}' events is not indexed")
+    return found
 
 
-def get_events(limit: int = 10) -> Dict[str, Any]:
+def _property_filters(
+    event_type: str, filters: List[Tuple[str, str]]
+) -> List[Tuple[int, Any]]:
     """
-    Get recent events from the database
+    (property_id, stored value) for each (key, value text) filter
     """
 
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    resolved = []
+    for key, text in filters:
+        property_id, kind = _indexed_property(event_type, key)
+        if kind == "number":
+            try:
+                value = coerce_value(kind, float(text))
+            except ValueError:
+                raise ValueError(f"Property '{key}' is a number, got '{text}'")
+        else:
+            value = text
+        resolved.append((property_id, value))
+    return resolved
+
+
+def _parse_cursor(cursor: str):
+    try:
+        ts, event_id = cursor.split(":")
+        return int(ts), int(event_id)
+    except ValueError:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+
+
+@analytics_seconds.labels("events").time()
+def query_events(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    event_type: Optional[str] = None,
+    user_id: Optional[str] = None,
+    start_ms: Optional[int] = None,
+    end_ms: Optional[int] = None,
+    order: str = "desc",
+    raw: bool = False,
+    properties: Optional[List[Tuple[str, str]]] = None,
+) -> Dict[str, Any]:
+    """
+    One page of events ordered by (ts, id), continuing after cursor.
 
-    cursor.execute(
-        """
-        SELECT id, timestamp, event_type, user_id, data, created_at
-        FROM events
-        ORDER BY id DESC
-        LIMIT ?
-        """,
-        (limit,),
-    )
+    The cursor is the "ts:id" of the last row of the previous page, so each
+    page is an index range scan instead of an OFFSET; partitions before the
+    cursor are skipped entirely. With raw=True each event's data is the
+    stored JSON text as RawJSON, for responses that only re-encode it.
+    properties are (key, value) filters on indexed properties of event_type.
+    """
 
-    rows = cursor.fetchall()
+    if order not in ("asc", "desc"):
+        raise ValueError(f"Unknown order '{order}', expected asc or desc")
+    if not 1 <= limit <= MAX_EVENTS_PAGE:
+        raise ValueError(f"limit must be between 1 and {MAX_EVENTS_PAGE}")
+    after = _parse_cursor(cursor) if cursor else None
+    newest_first = order == "desc"
+
+    conditions = []
+    params: List[Any] = []
+    if start_ms is not None:
+        conditions.append("ts >= ?")
+        params.append(start_ms)
+    if end_ms is not None:
+        conditions.append("ts < ?")
+        params.append(end_ms)
+    if user_id is not None:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    if properties:
+        if event_type is None:
+            raise ValueError("Property filters need an event_type")
+        for property_id, value in _property_filters(event_type, properties):
+            conditions.append(
+                "id IN (SELECT event_id FROM {props} "
+                "WHERE property_id = ? AND value = ?)"
+            )
+            params.extend([property_id, value])
+    if after is not None:
+        conditions.append("(ts, id) < (?, ?)" if newest_first else "(ts, id) > (?, ?)")
+        params.extend(after)
+        if newest_first:
+            end_ms = after[0] + 1 if end_ms is None else min(end_ms, after[0] + 1)
+        else:
+            start_ms = after[0] if start_ms is None else max(start_ms, after[0])
+
+    with pool.reader() as conn:
+        if event_type is not None:
+            if event_type not in _type_ids:
+                _load_event_types(conn)
+            conditions.append("event_type_id = ?")
+            params.append(_type_ids.get(event_type, -1))
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        direction = "DESC" if newest_first else "ASC"
+        rows = []
+        for table in partition_tables(conn, start_ms, end_ms, newest_first):
+            if len(rows) >= limit:
+                break
+            rows.extend(
+                conn.execute(
+                    f"""
+                    SELECT id, ts, event_type_id, user_id, data, created_ts
+                    FROM {table}
+                    {where.format(props=f"{table}_props")}
+                    ORDER BY ts {direction}, id {direction}
+                    LIMIT ?
+                    """,
+                    params + [limit - len(rows)],
+                )
+            )
 
-    events = []
-    for row in rows:
-        events.append(
-            {
-                "id": row[0],
-                "timestamp": row[1],
-                "event_type": row[2],
-                "user_id": row[3],
-                "data": json.loads(row[4]) if row[4] else {},
-                "created_at": row[5],
-            }
-        )
+        events = [_event_from_row(conn, row, raw) for row in rows]
+
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = f"{rows[-1][1]}:{rows[-1][0]}"
+
+    return {"events": events, "next_cursor": next_cursor}
 
-    cursor.execute("SELECT COUNT(*) FROM events")
-    total = cursor.fetchone()[0]
 
-    conn.close()
+def get_events(limit: int = 10, raw: bool = False) -> Dict[str, Any]:
+    """
+    Get recent events from the database
+    """
+
+    events = []
+    cursor = None
+    while len(events) < limit:
+        page = query_events(min(limit - len(events), MAX_EVENTS_PAGE), cursor, raw=raw)
+        events.extend(page["events"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    with pool.reader() as conn:
+        # Day rollups line up with day partitions, so the stored row count
+        # is the rollup total from the oldest partition onwards
+        total = conn.execute(
+            """
+            SELECT COALESCE(SUM(count), 0) FROM rollup_day
+            WHERE bucket >= (SELECT MIN(day) FROM event_partitions)
+            """
+        ).fetchone()[0]
 
     return {"events": events, "total": total}
 
 
+@analytics_seconds.labels("stats").time()
 def get_stats() -> Dict[str, Any]:
     """
-    Get analytics statistics
+    Get analytics statistics from the running aggregator
     """
 
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    return stats_aggregator.snapshot()
 
-    cursor.execute("SELECT COUNT(*) FROM events")
-    total = cursor.fetchone()[0]
 
-    cursor.execute(
-        """
-        SELECT event_type, COUNT(*) 
-        FROM events
-        GROUP BY event_type
-        ORDER BY COUNT(*) DESC
-        """
-    )
-    event_types = dict(cursor.fetchall())
+@analytics_seconds.labels("timeseries").time()
+def get_timeseries(
+    granularity: str = "minute",
+    start_ms: Optional[int] = None,
+    end_ms: Optional[int] = None,
+    event_type: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Event counts and revenue per time bucket from the rollup tables
+    """
 
-    cursor.execute(
-        "SELECT COUNT(DISTINCT user_id) FROM events WHERE user_id IS NOT NULL"
-    )
-    unique_users = cursor.fetchone()[0]
+    if granularity not in GRANULARITIES:
+        raise ValueError(
+            f"Unknown granularity '{granularity}', "
+            f"expected one of {', '.join(GRANULARITIES)}"
+        )
 
-    cursor.execute(
-        """
-        SELECT COUNT(*) FROM events
-        WHERE datetime(created_at) > datetime('now', '-1 hour')
-        """
-    )
-    recent_events = cursor.fetchone()[0]
+    width = GRANULARITIES[granularity]
+    if end_ms is None:
+        end_ms = int(time.time() * 1000)
+    # Align to bucket edges; the bucket containing end_ms is included
+    end_ms = end_ms - end_ms % width + width
+    if start_ms is None:
+        start_ms = end_ms - 60 * width
+    start_ms -= start_ms % width
+    if start_ms >= end_ms:
+        raise ValueError("start must be before end")
+    if (end_ms - start_ms) // width > MAX_TIMESERIES_POINTS:
+        raise ValueError(
+            f"Range too large for {granularity} granularity "
+            f"(max {MAX_TIMESERIES_POINTS} points)"
+        )
 
-    conn.close()
+    with pool.reader() as conn:
+        type_ids = None
+        if event_type is not None:
+            type_id = _type_ids.get(event_type)
+            type_ids = [type_id] if type_id is not None else []
+        rows = query_timeseries(conn, granularity, start_ms, end_ms, type_ids)
+        rows = [
+            (bucket, _event_type_name(conn, type_id), count, revenue)
+            for bucket, type_id, count, revenue in rows
+        ]
+
+    by_bucket = {}
+    for bucket, name, count, revenue in rows:
+        point = by_bucket.get(bucket)
+        if point is None:
+            point = {"total": 0, "counts": {}, "revenue": 0.0}
+            by_bucket[bucket] = point
+        point["counts"][name] = count
+        point["total"] += count
+        point["revenue"] += revenue
+
+    points = []
+    for bucket in range(start_ms, end_ms, width):
+        point = by_bucket.get(bucket, {"total": 0, "counts": {}, "revenue": 0.0})
+        points.append(
+            {
+                "bucket": _iso_from_ms(bucket),
+                "total": point["total"],
+                "counts": point["counts"],
+                "revenue": round(point["revenue"], 2),
+            }
+        )
 
     return {
-        "total_events": total,
-        "unique_users": unique_users,
-        "events_last_hour": recent_events,
-        "event_types": event_types,
+        "granularity": granularity,
+        "start": _iso_from_ms(start_ms),
+        "end": _iso_from_ms(end_ms),
+        "event_type": event_type,
+        "points": points,
     }
 
 
@@ -153,239 +684,487 @@ def clear_all_events() -> Dict[str, str]:
     Clear all events from database
     """
 
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    with pool.writer() as conn:
+        drop_all_partitions(conn)
+        clear_rollups(conn)
+
+    stats_aggregator.reset()
+    funnel_engine.reset()
+    anomaly_detector.reset()
+    user_profiles.reset()
+    event_window.reset()
+    heavy_hitters.reset()
+    result_cache.invalidate()
 
-    cursor.execute("DELETE FROM events")
 
-    conn.commit()
-    conn.close()
+def run_partition_maintenance() -> Dict[str, Any]:
+    """
+    Drop day partitions past the retention period and compact cold ones
+    """
+
+    now_ms = int(time.time() * 1000)
+    today = now_ms - now_ms % DAY_MS
+    retention_cutoff = today - (EVENT_RETENTION_DAYS - 1) * DAY_MS
+    dropped = []
+    archived = []
+    compacted = []
+
+    if EVENT_RETENTION_DAYS > 0 and EVENT_ARCHIVE_EXPIRED:
+        # Expired partitions no longer receive writes, so they can be
+        # archived from a reader before the writer drops them
+        with pool.reader() as conn:
+            expired = expired_partitions(conn, retention_cutoff)
+        for day, name in expired:
+            path = os.path.join(ARCHIVE_DIR, name + ARCHIVE_SUFFIX)
+            if not os.path.exists(path):
+                export_events(day, day + DAY_MS, path)
+                archived.append(path)
+
+    with pool.writer() as conn:
+        if EVENT_RETENTION_DAYS > 0:
+            dropped = drop_partitions_before(conn, retention_cutoff)
+        cold = []
+        if EVENT_COMPACT_AFTER_DAYS > 0:
+            cold = cold_partitions(
+                conn, today - (EVENT_COMPACT_AFTER_DAYS - 1) * DAY_MS
+            )
+
+    # One transaction per partition so ingest only waits for one rewrite
+    for day, name in cold:
+        with pool.writer() as conn:
+            compact_partition(conn, day, name)
+        compacted.append(name)
 
+    if dropped:
+        # Expired events no longer count towards totals, funnels or segments
+        reseed_analytics()
 
-def get_funnel_analysis():
+    return {"dropped": dropped, "archived": archived, "compacted": compacted}
+
+
+def export_events(
+    start_ms: Optional[int] = None,
+    end_ms: Optional[int] = None,
+    path: Optional[str] = None,
+) -> Dict[str, Any]:
     """
-    Calculate conversion funnel with percentages
+    Write events in [start_ms, end_ms) to a columnar archive file
     """
 
-    result = get_events(200)
-    events = result["events"]
+    if start_ms is not None and end_ms is not None and start_ms >= end_ms:
+        raise ValueError("start must be before end")
+    if path is None:
+        path = os.path.join(
+            ARCHIVE_DIR, f"events_{start_ms or 0}_{end_ms or 'now'}{ARCHIVE_SUFFIX}"
+        )
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    with pool.reader() as conn:
+        _load_event_types(conn)
+        writer = ArchiveWriter(path, dict(_type_names))
+        try:
+            # One read transaction so the export is a consistent snapshot
+            conn.execute("BEGIN")
+            for table in partition_tables(conn, start_ms, end_ms):
+                writer.write_rows(
+                    conn.execute(
+                        f"""
+                        SELECT id, ts, event_type_id, user_id, data, created_ts
+                        FROM {table}
+                        WHERE ts >= ? AND ts < ?
+                        ORDER BY id
+                        """,
+                        (
+                            start_ms if start_ms is not None else 0,
+                            end_ms if end_ms is not None else 2**63 - 1,
+                        ),
+                    )
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            writer.abort()
+            raise
+
+    return writer.close()
 
-    user_journeys = {}
-    for event in events:
-        user_id = event.get("user_id", "anonymous")
-
-        if user_id not in user_journeys:
-            user_journeys[user_id] = []
-        user_journeys[user_id].append(event["event_type"])
-
-    funnel_counts = {
-        "page_view": 0,
-        "product_view": 0,
-        "add_to_cart": 0,
-        "user_signup": 0,
-        "purchase": 0,
-    }
 
-    for user_id, events_list in user_journeys.items():
-        if "page_view" in events_list:
-            funnel_counts["page_view"] += 1
-        if "product_view" in events_list:
-            funnel_counts["product_view"] += 1
-        if "add_to_cart" in events_list:
-            funnel_counts["add_to_cart"] += 1
-        if "user_signup" in events_list:
-            funnel_counts["user_signup"] += 1
-        if "purchase" in events_list:
-            funnel_counts["purchase"] += 1
-
-    total_users = funnel_counts["page_view"]
-    conversion_rates = {}
-
-    if total_users > 0:
-        conversion_rates = {
-            "page_view": 100.0,
-            "product_view": round(
-                (funnel_counts["product_view"] / total_users) * 100, 1
-            ),
-            "add_to_cart": round((funnel_counts["add_to_cart"] / total_users) * 100, 1),
-            "user_signup": round((funnel_counts["user_signup"] / total_users) * 100, 1),
-            "purchase": round((funnel_counts["purchase"] / total_users) * 100, 1),
-        }
+def list_archives() -> Dict[str, Any]:
+    """
+    Get the archive files in the archive directory with their time ranges
+    """
+
+    archives = []
+    if os.path.isdir(ARCHIVE_DIR):
+        for name in sorted(os.listdir(ARCHIVE_DIR)):
+            if not name.endswith(ARCHIVE_SUFFIX):
+                continue
+            with ArchiveReader(os.path.join(ARCHIVE_DIR, name)) as reader:
+                info = reader.info()
+            info["name"] = name
+            for key in ("min_ts", "max_ts"):
+                if info[key] is not None:
+                    info[key] = _iso_from_ms(info[key])
+            archives.append(info)
+
+    return {"directory": ARCHIVE_DIR, "archives": archives}
+
+
+def backfill_rollups(
+    name: str, start_ms: Optional[int] = None, end_ms: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Add the events of an archive in [start_ms, end_ms) to the rollup tables,
+    e.g. after restoring it into a fresh database.
+
+    Rollups never expire, so days they already count (such as partitions
+    archived before being dropped, or an archive backfilled before) are
+    skipped rather than counted twice.
+    """
+
+    if os.path.basename(name) != name or not name.endswith(ARCHIVE_SUFFIX):
+        raise ValueError(f"Invalid archive name '{name}'")
+    path = os.path.join(ARCHIVE_DIR, name)
+    if not os.path.exists(path):
+        raise ValueError(f"Archive '{name}' not found")
+
+    rows = 0
+    skipped = set()
+    with ArchiveReader(path) as reader:
+        # Event type codes are local to the database that wrote the archive
+        with pool.writer() as conn:
+            type_ids = {
+                archived_id: _event_type_id(conn, type_name)
+                for archived_id, type_name in reader.event_types.items()
+            }
+            covered = {
+                day for (day,) in conn.execute("SELECT DISTINCT bucket FROM rollup_day")
+            }
+        archived = rollup_rows(reader, start_ms, end_ms)
+        while True:
+            chunk = list(islice(archived, BACKFILL_BATCH_SIZE))
+            if not chunk:
+                break
+            batch = []
+            for ts, type_id, amount in chunk:
+                day = ts - ts % DAY_MS
+                if day in covered:
+                    skipped.add(day)
+                else:
+                    batch.append((ts, type_ids.get(type_id, type_id), amount))
+            if batch:
+                with pool.writer() as conn:
+                    record_rollups(conn, batch)
+                rows += len(batch)
+
+    result_cache.invalidate()
+    return {"archive": name, "rows": rows, "skipped_days": len(skipped)}
+
+
+def get_partitions() -> Dict[str, Any]:
+    """
+    Get the day partitions with their row counts
+    """
+
+    with pool.reader() as conn:
+        partitions = list_partitions(conn)
 
     return {
-        "funnel_counts": funnel_counts,
-        "conversion_rates": conversion_rates,
-        "total_users": total_users,
+        "partitions": partitions,
+        "retention_days": EVENT_RETENTION_DAYS,
+        "compact_after_days": EVENT_COMPACT_AFTER_DAYS,
     }
 
 
-def classify_user_intent(user_events):
+def get_db_size() -> int:
     """
-    Classify user intent based on behavior patterns
+    Bytes used by the database file and its write-ahead log
     """
 
-    event_types = [e["event_type"] for e in user_events]
-    total_events = len(user_events)
+    size = 0
+    for path in (DB_FILE, f"{DB_FILE}-wal"):
+        try:
+            size += os.path.getsize(path)
+        except OSError:
+            pass
+    return size
 
-    if "purchase" in event_types:
-        return "converted"
 
-    if "add_to_cart" in event_types:
-        if total_events >= 5:
-            return "high_intent"
-        else:
-            return "medium_intent"
+def list_properties() -> Dict[str, Any]:
+    """
+    Get the declared indexed properties and whether existing events have
+    been backfilled
+    """
+
+    with pool.reader() as conn:
+        backfilled = dict(
+            conn.execute("SELECT id, backfilled FROM event_properties").fetchall()
+        )
+    return {
+        "properties": [
+            {
+                "event_type": event_type,
+                "key": key,
+                "kind": kind,
+                "backfilled": bool(backfilled.get(property_id)),
+            }
+            for (event_type, key), (property_id, kind) in _property_ids.items()
+        ]
+    }
 
-    if "product_view" in event_types:
-        if total_events >= 3:
-            return "medium_intent"
-        else:
-            return "low_intent"
 
-    return "low_intent"
+@analytics_seconds.labels("property_breakdown").time()
+def get_property_breakdown(
+    event_type: str,
+    key: str,
+    metric: Optional[str] = None,
+    filters: Tuple[Tuple[str, str], ...] = (),
+    start_ms: Optional[int] = None,
+    end_ms: Optional[int] = None,
+    limit: int = 50,
+) -> Dict[str, Any]:
+    """
+    Count events per value of an indexed property, optionally with the
+    sum/avg/min/max of a numeric property of the same events, e.g. revenue
+    by product or views by page. Groups are ordered by sum, else count.
+    """
 
+    if not 1 <= limit <= MAX_PROPERTY_GROUPS:
+        raise ValueError(f"limit must be between 1 and {MAX_PROPERTY_GROUPS}")
+    group_id, _ = _indexed_property(event_type, key)
+    metric_id = None
+    if metric is not None:
+        metric_id, metric_kind = _indexed_property(event_type, metric)
+        if metric_kind != "number":
+            raise ValueError(f"Metric property '{metric}' is not a number")
+    resolved = _property_filters(event_type, list(filters))
+
+    groups: Dict[Any, list] = {}
+    with pool.reader() as conn:
+        for table in partition_tables(conn, start_ms, end_ms):
+            aggregate_property(
+                conn, table, group_id, metric_id, resolved, start_ms, end_ms, groups
+            )
 
-def get_user_segmentation():
+    rows = []
+    for value, (count, measured, total, low, high) in groups.items():
+        row = {"value": value, "count": count}
+        if metric_id is not None:
+            row.update(
+                {
+                    "sum": round(total or 0.0, 2),
+                    "avg": round(total / measured, 2) if measured else None,
+                    "min": low,
+                    "max": high,
+                }
+            )
+        rows.append(row)
+    rows.sort(
+        key=lambda row: (row["sum"] if metric_id is not None else row["count"]),
+        reverse=True,
+    )
+
+    return {
+        "event_type": event_type,
+        "property": key,
+        "metric": metric,
+        "total_count": sum(row["count"] for row in rows),
+        "groups": rows[:limit],
+        "truncated": len(rows) > limit,
+    }
+
+
+@analytics_seconds.labels("user_patterns").time()
+def get_user_patterns(limit: int = 200) -> Dict[str, Any]:
     """
-    Get real-time user intent segmentation
+    Event sequences and funnel flags of the most recently active users in
+    the in-memory event window
     """
 
-    result = get_events(200)
-    events = result["events"]
+    return {"user_patterns": window_analytics.user_patterns(event_window.view(), limit)}
 
-    user_journeys = {}
-    for event in events:
-        user_id = event.get("user_id", "anonymous")
 
-        if user_id not in user_journeys:
-            user_journeys[user_id] = []
+@analytics_seconds.labels("window_summary").time()
+def get_window_summary(minutes: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Counts, revenue, funnel and intent segments over the last `minutes`
+    of the in-memory event window (all of it by default)
+    """
 
-        user_journeys[user_id].append(event)
+    view = event_window.view()
+    if minutes is not None:
+        if minutes < 1:
+            raise ValueError("minutes must be at least 1")
+        view = view.since(int(time.time() * 1000) - minutes * 60 * 1000)
 
-    segmentation = {
-        "high_intent": [],
-        "medium_intent": [],
-        "low_intent": [],
-        "converted": [],
+    funnel = window_analytics.funnel(view, funnel_engine.steps)
+    funnel["window"] = f"{minutes}m" if minutes is not None else "all"
+    return {
+        **window_analytics.summarize(view),
+        "funnel": funnel,
+        "segments": window_analytics.segment_counts(
+            view, user_profiles.bit, user_profiles.classify
+        ),
+        "window_seconds": event_window.window_ms // 1000,
     }
 
-    for user_id, user_events in user_journeys.items():
-        intent = classify_user_intent(user_events)
-        segmentation[intent].append(
-            {
-                "user_id": user_id,
-                "total_events": len(user_events),
-                "last_event": user_events[-1]["event_type"] if user_events else None,
-            }
-        )
 
-    return segmentation
+def get_window_stats() -> Dict[str, Any]:
+    """
+    Get the size of the in-memory event window
+    """
 
+    return event_window.get_stats()
 
-def detect_anomalies():
+
+@analytics_seconds.labels("top_items").time()
+def get_top_items(
+    dimension: Optional[str] = None,
+    window: Optional[str] = None,
+    limit: int = TOP_K,
+) -> Dict[str, Any]:
     """
-    Detect statistical anomalies in recent event patterns
+    Most frequent products, pages and users over a recent window ("5m",
+    "15m" or "1h"), estimated from streaming sketches
     """
 
-    result = get_events(100)
-    events = result["events"]
-
-    if len(events) < 10:
-        return {"anomalies": [], "message": "Insufficient data for anomaly detection"}
+    return heavy_hitters.top(dimension, window, limit)
 
-    anomalies = []
 
-    time_windows = {}
-    for event in events:
-        timestamp = datetime.fromisoformat(event["timestamp"].replace("Z", "+00:00"))
-        window = timestamp.replace(
-            minute=(timestamp.minute // 5) * 5, second=0, microsecond=0
-        )
-        window_key = window.isoformat()
+def get_top_stats() -> Dict[str, Any]:
+    """
+    Get the size of the top-K sketches
+    """
 
-        if window_key not in time_windows:
-            time_windows[window_key] = 0
-        time_windows[window_key] += 1
+    return heavy_hitters.get_stats()
 
-    event_counts = list(time_windows.values())
-    if len(event_counts) >= 3:
-        avg_rate = statistics.mean(event_counts)
-        std_rate = statistics.stdev(event_counts) if len(event_counts) > 1 else 0
-        current_rate = event_counts[-1]
 
-        if std_rate > 0 and current_rate > avg_rate + (2 * std_rate):
-            anomalies.append(
-                {
-                    "type": "traffic_spike",
-                    "severity": "high",
-                    "message": f"Traffic spike detected: {current_rate} events in 5 min (avg: {avg_rate:.1f})",
-                    "current_value": current_rate,
-                    "expected_range": f"{avg_rate - std_rate:.1f} - {avg_rate + std_rate:.1f}",
-                    "detected_at": datetime.now(timezone.utc).isoformat(),
-                }
-            )
+@analytics_seconds.labels("paths").time()
+def get_path_analysis(
+    steps: Optional[Tuple[str, ...]] = None,
+    max_gap_seconds: Optional[int] = None,
+    depth: int = DEFAULT_PATH_DEPTH,
+    limit: int = 20,
+    start_ms: Optional[int] = None,
+    end_ms: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Strictly ordered funnel with time-to-convert histograms, plus the most
+    common paths, from one pass over every user's events in time order
+    """
 
-    purchase_events = [e for e in events if e["event_type"] == "purchase"]
-    if len(purchase_events) >= 5:
-        amounts = []
-        for event in purchase_events:
-            amount = event.get("data", {}).get("amount", 0)
-            if amount > 0:
-                amounts.append(amount)
-
-        if len(amounts) >= 5:
-            avg_amount = statistics.mean(amounts)
-            std_amount = statistics.stdev(amounts)
-
-            recent_purchases = purchase_events[-3:]
-            for purchase in recent_purchases:
-                amount = purchase.get("data", {}).get("amount", 0)
-                if amount > avg_amount + (2 * std_amount):
-                    anomalies.append(
-                        {
-                            "type": "unusual_purchase",
-                            "severity": "medium",
-                            "message": f"Unusual high purchase: ${amount} (avg: ${avg_amount:.2f})",
-                            "current_value": amount,
-                            "expected_range": f"${avg_amount - std_amount:.2f} - ${avg_amount + std_amount:.2f}",
-                            "user_id": purchase.get("user_id"),
-                            "detected_at": datetime.now(timezone.utc).isoformat(),
-                        }
-                    )
+    steps = list(steps) if steps else funnel_engine.steps
+    if not 1 <= depth <= MAX_PATH_DEPTH:
+        raise ValueError(f"depth must be between 1 and {MAX_PATH_DEPTH}")
+    if not 1 <= limit <= MAX_PATHS:
+        raise ValueError(f"limit must be between 1 and {MAX_PATHS}")
+    if max_gap_seconds is not None and max_gap_seconds < 1:
+        raise ValueError("max_gap_seconds must be at least 1")
 
-    user_activity = {}
-    for event in events:
-        user_id = event.get("user_id", "anonymous")
-        if user_id not in user_activity:
-            user_activity[user_id] = 0
-        user_activity[user_id] += 1
-
-    activity_counts = list(user_activity.values())
-    if len(activity_counts) >= 5:
-        avg_activity = statistics.mean(activity_counts)
-        std_activity = statistics.stdev(activity_counts)
-
-        for user_id, activity_count in user_activity.items():
-            if activity_count > avg_activity + (2 * std_activity):
-                anomalies.append(
-                    {
-                        "type": "hyperactive_user",
-                        "severity": "low",
-                        "message": f"User {user_id} has unusual activity: {activity_count} events (avg: {avg_activity:.1f})",
-                        "current_value": activity_count,
-                        "expected_range": f"{avg_activity - std_activity:.1f} - {avg_activity + std_activity:.1f}",
-                        "user_id": user_id,
-                        "detected_at": datetime.now(timezone.utc).isoformat(),
-                    }
-                )
+    funnel = OrderedFunnel(
+        steps, max_gap_seconds * 1000 if max_gap_seconds is not None else None
+    )
+    trie = PathTrie(depth)
+    with pool.reader() as conn:
+        for _, events in user_streams(conn, start_ms, end_ms):
+            funnel.add_user(events)
+            trie.add_user(events)
 
     return {
-        "anomalies": anomalies,
-        "total_anomalies": len(anomalies),
-        "analysis_period": "last 100 events",
-        "detection_types": ["traffic_spike", "unusual_purchase", "hyperactive_user"],
+        "users": trie.root[0],
+        "funnel": funnel.to_dict(),
+        "paths": {"depth": depth, "top": trie.top(limit)},
     }
 
 
-# Initialize the database on startup
-init_database()
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    Get connection pool usage and contention statistics
+    """
+
+    return pool.get_stats()
+
+
+def close_database():
+    """
+    Close all pooled connections
+    """
+
+    pool.close()
+
+
+@analytics_seconds.labels("funnel").time()
+def get_funnel_analysis(window: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Calculate conversion funnel with percentages, optionally limited
+    to a recent window ("1h", "24h" or "7d")
+    """
+
+    return funnel_engine.analyze(window)
+
+
+def classify_user_intent(user_events):
+    """
+    Classify user intent based on behavior patterns
+    """
+
+    flags = 0
+    for event in user_events:
+        flags |= user_profiles.bit(event["event_type"])
+
+    return user_profiles.classify(flags, len(user_events))
+
+
+@analytics_seconds.labels("segmentation").time()
+def get_user_segmentation(
+    segment: Optional[str] = None, offset: int = 0, limit: int = 50
+) -> Dict[str, Any]:
+    """
+    Get real-time user intent segmentation, one page per segment
+    """
+
+    if segment is not None:
+        return user_profiles.page(segment, offset, limit)
+
+    segmentation = {}
+    for name in SEGMENTS:
+        segmentation[name] = user_profiles.page(name, offset, limit)["users"]
+    segmentation["counts"] = user_profiles.counts()
+
+    return segmentation
+
+
+@analytics_seconds.labels("segment_counts").time()
+def get_segment_counts() -> Dict[str, Any]:
+    """
+    Get the number of users in each intent segment
+    """
+
+    return {"counts": user_profiles.counts()}
+
+
+@analytics_seconds.labels("user_profile").time()
+def get_user_profile(user_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Get the stored profile for a single user
+    """
+
+    return user_profiles.get_profile(user_id)
+
+
+@analytics_seconds.labels("anomalies").time()
+def detect_anomalies() -> Dict[str, Any]:
+    """
+    Get currently active anomalies from the streaming detector
+    """
+
+    return anomaly_detector.snapshot()
+
+
+def drain_new_anomalies() -> List[Dict[str, Any]]:
+    """
+    Get anomalies fired since the last call
+    """
+
+    return anomaly_detector.drain_alerts()
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# memory - deliver within this process only (single worker)
+# sqlite - also relay through a shared SQLite file, for several workers
+#          on one host
+EVENT_BUS_BACKEND = os.environ.get("EVENT_BUS_BACKEND", "memory")
+EVENT_BUS_BACKENDS = ("memory", "sqlite")
+EVENT_BUS_DB = os.environ.get("EVENT_BUS_DB", "events_bus.db")
+EVENT_BUS_POLL_MS = int(os.environ.get("EVENT_BUS_POLL_MS", "50"))
+EVENT_BUS_RETENTION_SECONDS = int(os.environ.get("EVENT_BUS_RETENTION_SECONDS", "60"))
+
+# Messages read per poll; a full batch is followed by another read at once
+FETCH_BATCH_SIZE = 1000
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class EventBus:
+    """
+    Publish/subscribe between the parts of the app that fan out state.
+
+    This base class delivers messages to handlers in the same process.
+    Backends that span processes also relay each message and deliver the
+    ones other processes published; a process never receives its own
+    messages back.
+    """
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self._handlers: Dict[str, List[Handler]] = {}
+        self.published = 0
+        self.received = 0
+        self.handler_errors = 0
+
+    def subscribe(self, channel: str, handler: Handler):
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def publish(self, channel: str, message: Dict[str, Any], local: bool = True):
+        """
+        Send a message to every subscriber; local=False skips this process,
+        for state changes it has already applied
+        """
+
+        self.published += 1
+        if local:
+            await self._dispatch(channel, message)
+        await self._relay(channel, message)
+
+    async def _dispatch(self, channel: str, message: Dict[str, Any]):
+        for handler in self._handlers.get(channel, []):
+            try:
+                await handler(message)
+            except Exception as e:
+                self.handler_errors += 1
+                logger.error(f"Error handling {channel} message: {str(e)}")
+
+    async def _relay(self, channel: str, message: Dict[str, Any]):
+        pass
+
+    def skip_pending(self):
+        """
+        Deliver only messages published from now on, e.g. once state has
+        been seeded from the database that earlier messages describe
+        """
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "published": self.published,
+            "received": self.received,
+            "handler_errors": self.handler_errors,
+        }
+
+
+class SQLiteEventBus(EventBus):
+    """
+    Relay messages through an append-only table in a shared SQLite file.
+
+    Ids are assigned under SQLite's single write lock, so they follow commit
+    order and each process can tail the table from the last id it read.
+    Old rows are pruned after EVENT_BUS_RETENTION_SECONDS.
+    """
+
+    def __init__(
+        self,
+        db_file: str = EVENT_BUS_DB,
+        poll_ms: int = EVENT_BUS_POLL_MS,
+        retention_seconds: int = EVENT_BUS_RETENTION_SECONDS,
+    ):
+        super().__init__()
+        self.db_file = db_file
+        self.poll_interval = poll_ms / 1000
+        self.retention = retention_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            db_file, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bus_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                origin TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_ts INTEGER NOT NULL
+            )
+            """
+        )
+        self.skip_pending()
+        self._last_prune = 0.0
+        self._task = None
+
+    def _insert(self, channel: str, payload: str):
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO bus_messages (origin, channel, payload, created_ts)
+                VALUES (?, ?, ?, ?)
+                """,
+                (self.origin, channel, payload, int(time.time() * 1000)),
+            )
+
+    async def _relay(self, channel: str, message: Dict[str, Any]):
+        await asyncio.to_thread(self._insert, channel, json.dumps(message))
+
+    def skip_pending(self):
+        with self._lock:
+            self._last_id = self._conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM bus_messages"
+            ).fetchone()[0]
+
+    def _fetch(self) -> List[tuple]:
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT id, origin, channel, payload FROM bus_messages
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+                """,
+                (self._last_id, FETCH_BATCH_SIZE),
+            ).fetchall()
+
+            now = time.time()
+            if now - self._last_prune >= self.retention:
+                self._last_prune = now
+                self._conn.execute(
+                    "DELETE FROM bus_messages WHERE created_ts < ?",
+                    (int((now - self.retention) * 1000),),
+                )
+        return rows
+
+    async def _run(self):
+        while True:
+            try:
+                rows = await asyncio.to_thread(self._fetch)
+            except Exception as e:
+                logger.error(f"Error polling event bus: {str(e)}")
+                rows = []
+
+            for message_id, origin, channel, payload in rows:
+                self._last_id = message_id
+                if origin == self.origin:
+                    continue
+                self.received += 1
+                await self._dispatch(channel, json.loads(payload))
+
+            if len(rows) < FETCH_BATCH_SIZE:
+                await asyncio.sleep(self.poll_interval)
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        with self._lock:
+            self._conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = super().get_stats()
+        stats.update(
+            {
+                "backend": "sqlite",
+                "db_file": self.db_file,
+                "last_id": self._last_id,
+            }
+        )
+        return stats
+
+
+def create_event_bus(backend: str = EVENT_BUS_BACKEND) -> EventBus:
+    if backend == "memory":
+        return EventBus()
+    if backend == "sqlite":
+        return SQLiteEventBus()
+    raise ValueError(
+        f"Unknown event bus backend '{backend}', "
+        f"expected one of {', '.join(EVENT_BUS_BACKENDS)}"
+    )
+
+
+event_bus = create_event_bus()
@@ -0,0 +1,387 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from json_codec import loads
+from partitions import partition_tables
+from rollups import REVENUE_EVENT_TYPE, event_amount
+
+# Recent events kept in memory as columns for ad-hoc window analytics
+EVENT_WINDOW_SECONDS = int(os.environ.get("EVENT_WINDOW_SECONDS", str(24 * 3600)))
+EVENT_WINDOW_MAX_ROWS = int(os.environ.get("EVENT_WINDOW_MAX_ROWS", "2000000"))
+
+INITIAL_CAPACITY = 65536
+
+# Most recent event types listed per user in user_patterns
+MAX_SEQUENCE = 20
+
+NO_USER = -1
+
+
+class WindowView:
+    """
+    Read-only column views of the window at one moment
+    """
+
+    __slots__ = ("ts", "types", "users", "amounts", "type_names", "user_ids")
+
+    def __init__(self, ts, types, users, amounts, type_names, user_ids):
+        self.ts = ts
+        self.types = types
+        self.users = users
+        self.amounts = amounts
+        self.type_names = type_names
+        self.user_ids = user_ids
+
+    def since(self, since_ms: Optional[int]) -> "WindowView":
+        if since_ms is None:
+            return self
+        mask = self.ts >= since_ms
+        return WindowView(
+            self.ts[mask],
+            self.types[mask],
+            self.users[mask],
+            self.amounts[mask],
+            self.type_names,
+            self.user_ids,
+        )
+
+    def type_code(self, name: str) -> int:
+        try:
+            return self.type_names.index(name)
+        except ValueError:
+            return -1
+
+
+class EventWindow:
+    """
+    The most recent events as NumPy columns, appended to on ingest.
+
+    ts (epoch ms, int64), event type code (int16), user index (int32, -1
+    for anonymous) and purchase amount (float64) live in preallocated
+    arrays that double when full. Rows older than EVENT_WINDOW_SECONDS or
+    beyond EVENT_WINDOW_MAX_ROWS are dropped by advancing a start offset;
+    the live rows are copied down (and user indexes renumbered) once the
+    dead prefix is half the buffer.
+
+    Appends only write past the current end and compaction allocates new
+    arrays, so views handed to readers stay valid without holding the lock
+    while analytics run.
+    """
+
+    def __init__(
+        self,
+        window_seconds: int = EVENT_WINDOW_SECONDS,
+        max_rows: int = EVENT_WINDOW_MAX_ROWS,
+    ):
+        self.window_ms = window_seconds * 1000
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._allocate(INITIAL_CAPACITY)
+        self._start = 0
+        self._end = 0
+        self._type_codes: Dict[str, int] = {}
+        self._type_names: List[str] = []
+        self._user_index: Dict[str, int] = {}
+        self._user_ids: List[str] = []
+
+    def _allocate(self, capacity: int):
+        self._ts = np.empty(capacity, dtype=np.int64)
+        self._types = np.empty(capacity, dtype=np.int16)
+        self._users = np.empty(capacity, dtype=np.int32)
+        self._amounts = np.empty(capacity, dtype=np.float64)
+
+    def _columns(self):
+        return (self._ts, self._types, self._users, self._amounts)
+
+    def _type_code(self, event_type: str) -> int:
+        code = self._type_codes.get(event_type)
+        if code is None:
+            code = len(self._type_names)
+            self._type_codes[event_type] = code
+            self._type_names.append(event_type)
+        return code
+
+    def _user(self, user_id: Optional[str]) -> int:
+        if user_id is None:
+            return NO_USER
+        index = self._user_index.get(user_id)
+        if index is None:
+            index = len(self._user_ids)
+            self._user_index[user_id] = index
+            self._user_ids.append(user_id)
+        return index
+
+    def _compact(self, capacity: int):
+        """
+        Copy the live rows to the front of fresh arrays, renumbering users
+        """
+
+        live = slice(self._start, self._end)
+        ts, types, users, amounts = (column[live] for column in self._columns())
+        count = len(ts)
+
+        known = users >= 0
+        kept, remapped = np.unique(users[known], return_inverse=True)
+        users = users.copy()
+        users[known] = remapped
+        self._user_ids = [self._user_ids[i] for i in kept.tolist()]
+        self._user_index = {user_id: i for i, user_id in enumerate(self._user_ids)}
+
+        self._allocate(capacity)
+        self._ts[:count] = ts
+        self._types[:count] = types
+        self._users[:count] = users
+        self._amounts[:count] = amounts
+        self._start = 0
+        self._end = count
+
+    def _append(self, rows: List[Tuple[int, int, int, float]]):
+        needed = self._end + len(rows)
+        capacity = len(self._ts)
+        if needed > capacity:
+            live = needed - self._start
+            if self._start and live <= capacity // 2:
+                self._compact(capacity)
+            else:
+                self._compact(max(capacity * 2, live))
+            needed = self._end + len(rows)
+
+        ts, types, users, amounts = zip(*rows)
+        span = slice(self._end, needed)
+        self._ts[span] = ts
+        self._types[span] = types
+        self._users[span] = users
+        self._amounts[span] = amounts
+        self._end = needed
+
+    def _expire(self, now_ms: int):
+        start = self._start
+        if self._end - start > self.max_rows:
+            start = self._end - self.max_rows
+        # Rows are appended in ingest order, so expired ones form a prefix
+        cutoff = now_ms - self.window_ms
+        self._start = start + int(np.searchsorted(self._ts[start : self._end], cutoff))
+
+    def record_many(self, events: Iterable, at: Optional[float] = None):
+        """
+        Append newly ingested events
+        """
+
+        at = at if at is not None else time.time()
+        now_ms = int(at * 1000)
+        with self._lock:
+            rows = [
+                (
+                    now_ms,
+                    self._type_code(event.event_type),
+                    self._user(event.user_id),
+                    event_amount(event.event_type, event.data),
+                )
+                for event in events
+            ]
+            if rows:
+                self._append(rows)
+            self._expire(now_ms)
+
+    def seed(self, conn: sqlite3.Connection):
+        """
+        Load the events of the last EVENT_WINDOW_SECONDS from the partitions.
+
+        The lock is held throughout, so batches recorded meanwhile wait and
+        are appended after the loaded rows, keeping the window in time order.
+        """
+
+        with self._lock:
+            self._clear()
+            since_ms = int(time.time() * 1000) - self.window_ms
+            for table in partition_tables(conn, start_ms=since_ms):
+                cursor = conn.execute(
+                    f"""
+                    SELECT e.ts, et.name, e.user_id, e.data
+                    FROM {table} e
+                    JOIN event_types et ON et.id = e.event_type_id
+                    WHERE e.ts >= ?
+                    ORDER BY e.ts, e.id
+                    """,
+                    (since_ms,),
+                )
+                while True:
+                    batch = cursor.fetchmany(INITIAL_CAPACITY)
+                    if not batch:
+                        break
+                    self._append(
+                        [
+                            (
+                                ts,
+                                self._type_code(name),
+                                self._user(user_id),
+                                _stored_amount(name, data),
+                            )
+                            for ts, name, user_id, data in batch
+                        ]
+                    )
+                    if self._end - self._start > self.max_rows:
+                        self._start = self._end - self.max_rows
+
+    def view(self) -> WindowView:
+        with self._lock:
+            live = slice(self._start, self._end)
+            return WindowView(
+                self._ts[live],
+                self._types[live],
+                self._users[live],
+                self._amounts[live],
+                list(self._type_names),
+                self._user_ids,
+            )
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rows": self._end - self._start,
+                "capacity": len(self._ts),
+                "users": len(self._user_ids),
+                "window_seconds": self.window_ms // 1000,
+                "max_rows": self.max_rows,
+            }
+
+
+def _stored_amount(event_type: str, data: Optional[str]) -> float:
+    # Only purchases carry revenue; other rows skip decoding entirely
+    if event_type != REVENUE_EVENT_TYPE or not data:
+        return 0.0
+    return event_amount(event_type, loads(data))
+
+
+def summarize(view: WindowView) -> Dict[str, Any]:
+    """
+    Event counts per type, active users and revenue
+    """
+
+    counts = np.bincount(view.types, minlength=len(view.type_names))
+    active = np.unique(view.users[view.users >= 0])
+    return {
+        "events": int(len(view.ts)),
+        "active_users": int(len(active)),
+        "revenue": round(float(view.amounts.sum()), 2),
+        "event_types": {
+            name: int(count) for name, count in zip(view.type_names, counts) if count
+        },
+    }
+
+
+def funnel(view: WindowView, steps: List[str]) -> Dict[str, Any]:
+    """
+    Users reaching each funnel step within the view.
+
+    As in the live funnel, steps are counted independently: a user counts
+    towards every step they had an event of.
+    """
+
+    step_of_type = np.full(max(len(view.type_names), 1), -1, dtype=np.int16)
+    for i, step in enumerate(steps):
+        code = view.type_code(step)
+        if code >= 0:
+            step_of_type[code] = i
+
+    step_codes = step_of_type[view.types]
+    known = (step_codes >= 0) & (view.users >= 0)
+    # One entry per distinct (user, step) pair
+    pairs = np.unique(
+        view.users[known].astype(np.int64) * len(steps) + step_codes[known]
+    )
+    counts = np.bincount(pairs % len(steps), minlength=len(steps)).tolist()
+
+    funnel_counts = dict(zip(steps, counts))
+    total_users = counts[0] if counts else 0
+    conversion_rates = {}
+    if total_users > 0:
+        conversion_rates = {
+            step: round((count / total_users) * 100, 1)
+            for step, count in funnel_counts.items()
+        }
+
+    return {
+        "funnel_counts": funnel_counts,
+        "conversion_rates": conversion_rates,
+        "total_users": total_users,
+        "steps": list(steps),
+    }
+
+
+def segment_counts(
+    view: WindowView, bit: Callable[[str], int], classify: Callable[[int, int], str]
+) -> Dict[str, int]:
+    """
+    Users per intent segment from their events within the view, using the
+    profile store's event type bits and classification rules
+    """
+
+    known = view.users >= 0
+    users = view.users[known]
+    bits = np.array([bit(name) for name in view.type_names] or [0], dtype=np.int64)
+    flags = np.zeros(len(view.user_ids), dtype=np.int64)
+    np.bitwise_or.at(flags, users, bits[view.types[known]])
+    totals = np.bincount(users, minlength=len(view.user_ids))
+
+    active = totals > 0
+    # The rules never look past 5 events, so few distinct pairs remain
+    pairs = np.stack([flags[active], np.minimum(totals[active], 5)], axis=1)
+    combos, members = np.unique(pairs, axis=0, return_counts=True)
+
+    segments: Dict[str, int] = {}
+    for (combo_flags, combo_total), count in zip(combos.tolist(), members.tolist()):
+        segment = classify(combo_flags, combo_total)
+        segments[segment] = segments.get(segment, 0) + count
+    return segments
+
+
+def user_patterns(
+    view: WindowView, limit: int, sequence_length: int = MAX_SEQUENCE
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Event sequence and funnel flags of the `limit` most recently active users
+    """
+
+    known = view.users >= 0
+    users, ts, types = view.users[known], view.ts[known], view.types[known]
+    if not len(users):
+        return {}
+
+    # Group rows by user, in time order within each group
+    order = np.lexsort((ts, users))
+    users, types = users[order], types[order]
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    ends = np.r_[starts[1:], len(users)]
+    last_seen = ts[order][ends - 1]
+
+    chosen = np.argsort(last_seen)[::-1][:limit]
+    names = view.type_names
+    patterns = {}
+    for group in chosen.tolist():
+        start, end = int(starts[group]), int(ends[group])
+        codes = types[start:end]
+        seen = {names[code] for code in np.unique(codes).tolist()}
+        patterns[view.user_ids[int(users[start])]] = {
+            "total_events": end - start,
+            "event_sequence": [
+                names[code] for code in codes[-sequence_length:].tolist()
+            ],
+            "converted": "purchase" in seen,
+            "added_to_cart": "add_to_cart" in seen,
+            "viewed_products": "product_view" in seen,
+            "signup": "user_signup" in seen,
+        }
+    return patterns
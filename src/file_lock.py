@@ -0,0 +1,49 @@
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# How often a blocking lock is retried on Windows, where msvcrt cannot wait
+LOCK_POLL_SECONDS = 0.05
+
+
+def lock_file(f, blocking: bool = True) -> bool:
+    """
+    Take an exclusive lock on an open file, held until unlock_file() or
+    until the file is closed.
+
+    Returns False when blocking is off and another process holds the lock.
+    flock() is used on Unix; on Windows the first byte is locked instead,
+    so only use files that other processes do not write to.
+    """
+
+    if fcntl is not None:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(f.fileno(), flags)
+        except BlockingIOError:
+            return False
+        return True
+
+    while True:
+        f.seek(0)
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(LOCK_POLL_SECONDS)
+
+
+def unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return
+
+    f.seek(0)
+    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
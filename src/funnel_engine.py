@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+from partitions import partition_tables
+
+DEFAULT_FUNNEL_STEPS = "page_view,product_view,add_to_cart,user_signup,purchase"
+FUNNEL_STEPS = [
+    step.strip()
+    for step in os.environ.get("FUNNEL_STEPS", DEFAULT_FUNNEL_STEPS).split(",")
+    if step.strip()
+]
+
+FUNNEL_WINDOWS = {
+    "1h": 3600,
+    "24h": 86400,
+    "7d": 7 * 86400,
+}
+
+# Windowed counts are kept in per-minute buckets
+BUCKET_SECONDS = 60
+
+
+class FunnelEngine:
+    """
+    Conversion funnel maintained incrementally from the event stream.
+
+    Each user keeps, per step, the last time they had an event of that
+    step. Steps are counted independently, as the original query did: a
+    user who purchased without signing up counts towards purchase but not
+    user_signup. Per-step minute buckets count users by that last time, so
+    windowed funnels are answered without touching per-user state.
+    """
+
+    def __init__(self, steps: List[str] = FUNNEL_STEPS):
+        self.steps = list(steps)
+        self._step_index = {step: i for i, step in enumerate(self.steps)}
+        self._max_window = max(FUNNEL_WINDOWS.values())
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        # user_id -> per-step last reach time (epoch seconds, 0 = never)
+        self._users: Dict[str, array] = {}
+        self._step_counts = [0] * len(self.steps)
+        self._buckets: List[Dict[int, int]] = [{} for _ in self.steps]
+
+    def _move_bucket(self, step: int, old: int, new: int):
+        buckets = self._buckets[step]
+        if old:
+            old_bucket = old // BUCKET_SECONDS
+            remaining = buckets.get(old_bucket, 0) - 1
+            if remaining > 0:
+                buckets[old_bucket] = remaining
+            else:
+                buckets.pop(old_bucket, None)
+        new_bucket = new // BUCKET_SECONDS
+        buckets[new_bucket] = buckets.get(new_bucket, 0) + 1
+
+    def _record(self, event_type: str, user_id: Optional[str], at: int):
+        step = self._step_index.get(event_type)
+        if step is None or user_id is None:
+            return
+
+        reached = self._users.get(user_id)
+        if reached is None:
+            reached = array("q", [0] * len(self.steps))
+            self._users[user_id] = reached
+
+        previous = reached[step]
+        if previous >= at:
+            return
+        if not previous:
+            self._step_counts[step] += 1
+        self._move_bucket(step, previous, at)
+        reached[step] = at
+
+    def record_many(self, events, at: Optional[float] = None):
+        at = int(at if at is not None else time.time())
+        with self._lock:
+            for event in events:
+                self._record(event.event_type, event.user_id, at)
+
+    def seed(self, conn: sqlite3.Connection):
+        """
+        Rebuild funnel state with one pass over the event partitions.
+
+        The lock is held from the reset to the last partition, so batches
+        recorded meanwhile wait for the seed instead of landing in between.
+        """
+
+        placeholders = ",".join("?" for _ in self.steps)
+        with self._lock:
+            self._clear()
+            for table in partition_tables(conn):
+                cursor = conn.execute(
+                    f"""
+                    SELECT et.name, e.user_id, e.ts / 1000
+                    FROM {table} e
+                    JOIN event_types et ON et.id = e.event_type_id
+                    WHERE e.user_id IS NOT NULL AND et.name IN ({placeholders})
+                    ORDER BY e.id
+                    """,
+                    self.steps,
+                )
+                self._load(cursor)
+
+    def _load(self, rows: Iterable[Tuple[str, Optional[str], int]]):
+        """
+        Replay (event_type, user_id, epoch seconds) rows from the live
+        partitions in order; the caller holds the lock
+        """
+
+        for event_type, user_id, at in rows:
+            self._record(event_type, user_id, at or int(time.time()))
+
+    def _prune(self, now: int):
+        cutoff = (now - self._max_window) // BUCKET_SECONDS
+        for buckets in self._buckets:
+            for bucket in [b for b in buckets if b < cutoff]:
+                del buckets[bucket]
+
+    def analyze(self, window: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Funnel counts and conversion rates, all-time or for a named window
+        """
+
+        if window is not None and window not in FUNNEL_WINDOWS:
+            raise ValueError(
+                f"Unknown funnel window '{window}', "
+                f"expected one of {', '.join(FUNNEL_WINDOWS)}"
+            )
+
+        now = int(time.time())
+        with self._lock:
+            if window is None:
+                counts = list(self._step_counts)
+            else:
+                self._prune(now)
+                cutoff = (now - FUNNEL_WINDOWS[window]) // BUCKET_SECONDS
+                counts = [
+                    sum(c for bucket, c in buckets.items() if bucket >= cutoff)
+                    for buckets in self._buckets
+                ]
+
+        funnel_counts = dict(zip(self.steps, counts))
+        total_users = counts[0] if counts else 0
+        conversion_rates = {}
+
+        if total_users > 0:
+            conversion_rates = {
+                step: round((count / total_users) * 100, 1)
+                for step, count in funnel_counts.items()
+            }
+
+        return {
+            "funnel_counts": funnel_counts,
+            "conversion_rates": conversion_rates,
+            "total_users": total_users,
+            "window": window or "all",
+            "steps": self.steps,
+        }
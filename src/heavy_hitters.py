@@ -0,0 +1,337 @@
+import heapq
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from partitions import partition_tables
+from properties import coerce_value
+
+TOP_WINDOWS = {
+    "5m": 300,
+    "15m": 900,
+    "1h": 3600,
+}
+DEFAULT_TOP_WINDOW = "15m"
+
+TOP_K = int(os.environ.get("TOP_K", "10"))
+MAX_TOP_K = 100
+
+# Dimension -> event data field counted, or None for the user id
+TOP_DIMENSIONS = {
+    "products": "product",
+    "pages": "page",
+    "users": None,
+}
+
+# Sliding windows are built from per-minute slices, each with its own
+# sketch and summary, so memory is fixed by these settings alone
+SLICE_SECONDS = 60
+SKETCH_WIDTH = int(os.environ.get("SKETCH_WIDTH", "1024"))
+SKETCH_DEPTH = int(os.environ.get("SKETCH_DEPTH", "4"))
+# Keys tracked per slice as top-K candidates
+SUMMARY_CAPACITY = int(os.environ.get("TOP_SUMMARY_CAPACITY", "200"))
+
+_HASH_MASK = (1 << 64) - 1
+
+
+def sketch_columns(keys: List[str], width: int, depth: int) -> np.ndarray:
+    """
+    Counter column of each key in every sketch row, shape (len(keys), depth).
+
+    One 64-bit hash per key is split into two halves and combined as
+    h1 + i * h2 (Kirsch-Mitzenmacher) instead of hashing once per row.
+    """
+
+    hashes = np.fromiter(
+        (hash(key) & _HASH_MASK for key in keys), dtype=np.uint64, count=len(keys)
+    )
+    h1 = hashes & np.uint64(0xFFFFFFFF)
+    h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+    rows = np.arange(depth, dtype=np.uint64)
+    columns = (h1[:, None] + rows * h2[:, None]) % np.uint64(width)
+    return columns.astype(np.intp)
+
+
+class CountMinSketch:
+    """
+    Approximate counts in a fixed depth x width table of counters.
+
+    Estimates never undercount; with probability 1 - e^-depth they
+    overcount by at most e / width of the total.
+    """
+
+    __slots__ = ("width", "depth", "table", "total")
+
+    def __init__(self, width: int = SKETCH_WIDTH, depth: int = SKETCH_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int32)
+        self.total = 0
+
+    def add_many(self, keys: List[str]):
+        if not keys:
+            return
+        columns = sketch_columns(keys, self.width, self.depth)
+        rows = np.arange(self.depth)[None, :]
+        np.add.at(self.table, (rows, columns), 1)
+        self.total += len(keys)
+
+
+def estimate(table: np.ndarray, keys: List[str]) -> np.ndarray:
+    """
+    Count-Min estimates of keys from a (possibly merged) counter table
+    """
+
+    depth, width = table.shape
+    columns = sketch_columns(keys, width, depth)
+    return table[np.arange(depth)[None, :], columns].min(axis=1)
+
+
+class SpaceSaving:
+    """
+    Space-Saving summary: the keys most likely to be frequent, in at most
+    `capacity` counters.
+
+    A key arriving when the summary is full takes over the smallest
+    counter. The min-heap holds one entry per key; increments leave
+    entries stale and they are corrected lazily when they reach the top.
+    """
+
+    __slots__ = ("capacity", "counts", "_heap")
+
+    def __init__(self, capacity: int = SUMMARY_CAPACITY):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self._heap: List[Tuple[int, str]] = []
+
+    def _pop_min(self) -> Tuple[int, str]:
+        heap = self._heap
+        while True:
+            count, key = heapq.heappop(heap)
+            current = self.counts[key]
+            if current == count:
+                return count, key
+            heapq.heappush(heap, (current, key))
+
+    def add(self, key: str):
+        counts = self.counts
+        current = counts.get(key)
+        if current is not None:
+            counts[key] = current + 1
+            return
+
+        if len(counts) < self.capacity:
+            counts[key] = 1
+            heapq.heappush(self._heap, (1, key))
+            return
+
+        floor, evicted = self._pop_min()
+        del counts[evicted]
+        counts[key] = floor + 1
+        heapq.heappush(self._heap, (floor + 1, key))
+
+
+class SketchSlice:
+    __slots__ = ("start", "sketch", "summary")
+
+    def __init__(self, start: int):
+        self.start = start
+        self.sketch = CountMinSketch()
+        self.summary = SpaceSaving()
+
+    def add_many(self, keys: List[str]):
+        self.sketch.add_many(keys)
+        add = self.summary.add
+        for key in keys:
+            add(key)
+
+
+class SlidingTopK:
+    """
+    Top-K keys of one dimension over sliding windows of recent minutes.
+
+    Space-Saving summaries nominate the candidates and the summed
+    Count-Min tables of the window's slices estimate their counts.
+    """
+
+    def __init__(self, max_window: int = max(TOP_WINDOWS.values())):
+        self.max_slices = max_window // SLICE_SECONDS
+        self.slices: Deque[SketchSlice] = deque()
+
+    def _expire(self, current: int):
+        while self.slices and self.slices[0].start <= current - self.max_slices:
+            self.slices.popleft()
+
+    def add_many(self, keys: List[str], at: int):
+        current = at // SLICE_SECONDS
+        if not self.slices or self.slices[-1].start < current:
+            self.slices.append(SketchSlice(current))
+            self._expire(current)
+        # Events stamped before the newest slice (the clock stepped back)
+        # count towards it
+        self.slices[-1].add_many(keys)
+
+    def top(self, window_seconds: int, limit: int, now: int) -> Dict[str, Any]:
+        current = now // SLICE_SECONDS
+        first = current - window_seconds // SLICE_SECONDS + 1
+        slices = [s for s in self.slices if first <= s.start <= current]
+
+        total = sum(s.sketch.total for s in slices)
+        if not total:
+            return {"total": 0, "max_error": 0, "items": []}
+
+        table = np.sum([s.sketch.table for s in slices], axis=0, dtype=np.int64)
+        candidates = list({key for s in slices for key in s.summary.counts})
+        counts = estimate(table, candidates).tolist()
+        ranked = heapq.nsmallest(limit, zip((-count for count in counts), candidates))
+        return {
+            "total": total,
+            "max_error": math.ceil(math.e / table.shape[1] * total),
+            "items": [
+                {
+                    "key": key,
+                    "count": -negated,
+                    "share": round(-negated / total * 100, 1),
+                }
+                for negated, key in ranked
+            ],
+        }
+
+
+class HeavyHitters:
+    """
+    Hottest products, pages and users over sliding windows, kept in
+    memory of a fixed size however many distinct keys are seen
+    """
+
+    def __init__(self, dimensions: Dict[str, Optional[str]] = TOP_DIMENSIONS):
+        self.dimensions = dict(dimensions)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._tops = {name: SlidingTopK() for name in self.dimensions}
+
+    def _add_rows(self, rows: Iterable[Tuple[Any, ...]], at: int):
+        # rows hold one raw value per dimension, in dimension order
+        keys: Dict[str, List[str]] = {name: [] for name in self.dimensions}
+        for row in rows:
+            for name, value in zip(self.dimensions, row):
+                value = coerce_value("text", value)
+                if value is not None:
+                    keys[name].append(value)
+        for name, values in keys.items():
+            if values:
+                self._tops[name].add_many(values, at)
+
+    def _values(self, event) -> Tuple[Any, ...]:
+        data = event.data or {}
+        return tuple(
+            event.user_id if field is None else data.get(field)
+            for field in self.dimensions.values()
+        )
+
+    def record_many(self, events: Iterable, at: Optional[float] = None):
+        """
+        Count newly ingested events
+        """
+
+        at = int(at if at is not None else time.time())
+        rows = [self._values(event) for event in events]
+        with self._lock:
+            self._add_rows(rows, at)
+
+    def seed(self, conn: sqlite3.Connection):
+        """
+        Rebuild the sketches from the events of the largest window.
+
+        The lock is held throughout, so batches recorded meanwhile wait for
+        the seed instead of landing in sketches that are then rebuilt.
+        """
+
+        since = int(time.time()) - max(TOP_WINDOWS.values())
+        columns = ", ".join(
+            "user_id" if field is None else f"json_extract(data, '$.\"{field}\"')"
+            for field in self.dimensions.values()
+        )
+        with self._lock:
+            self._clear()
+            for table in partition_tables(conn, start_ms=since * 1000):
+                cursor = conn.execute(
+                    f"""
+                    SELECT ts / 1000, {columns}
+                    FROM {table}
+                    WHERE ts >= ?
+                    ORDER BY ts
+                    """,
+                    (since * 1000,),
+                )
+                slice_rows: List[Tuple[Any, ...]] = []
+                slice_at = None
+                for at, *values in cursor:
+                    if slice_at is not None and at // SLICE_SECONDS != slice_at:
+                        self._add_rows(slice_rows, slice_at * SLICE_SECONDS)
+                        slice_rows = []
+                    slice_at = at // SLICE_SECONDS
+                    slice_rows.append(values)
+                if slice_rows:
+                    self._add_rows(slice_rows, slice_at * SLICE_SECONDS)
+
+    def top(
+        self,
+        dimension: Optional[str] = None,
+        window: Optional[str] = None,
+        limit: int = TOP_K,
+    ) -> Dict[str, Any]:
+        """
+        Most frequent keys per dimension within a named window
+        """
+
+        window = window or DEFAULT_TOP_WINDOW
+        if window not in TOP_WINDOWS:
+            raise ValueError(
+                f"Unknown top-K window '{window}', "
+                f"expected one of {', '.join(TOP_WINDOWS)}"
+            )
+        if dimension is not None and dimension not in self.dimensions:
+            raise ValueError(
+                f"Unknown top-K dimension '{dimension}', "
+                f"expected one of {', '.join(self.dimensions)}"
+            )
+
+        names = [dimension] if dimension is not None else list(self.dimensions)
+        now = int(time.time())
+        with self._lock:
+            dimensions = {
+                name: self._tops[name].top(TOP_WINDOWS[window], limit, now)
+                for name in names
+            }
+        return {
+            "window": window,
+            "window_seconds": TOP_WINDOWS[window],
+            "dimensions": dimensions,
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            slices = sum(len(top.slices) for top in self._tops.values())
+        per_slice = SKETCH_WIDTH * SKETCH_DEPTH * 4
+        return {
+            "dimensions": list(self.dimensions),
+            "slices": slices,
+            "slice_seconds": SLICE_SECONDS,
+            "sketch_width": SKETCH_WIDTH,
+            "sketch_depth": SKETCH_DEPTH,
+            "summary_capacity": SUMMARY_CAPACITY,
+            "sketch_bytes": slices * per_slice,
+        }
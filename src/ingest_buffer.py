@@ -0,0 +1,526 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from async_database import async_db
+from database import (
+    forget_ingest_log,
+    get_ingest_log_position,
+    insert_events,
+    skip_ingest_log,
+)
+from file_lock import lock_file
+from json_codec import dumps
+from metrics import ingest_dropped
+from models import Event
+
+logger = logging.getLogger(__name__)
+
+# When /track is acknowledged:
+#   commit - after the group commit containing the events (no loss)
+#   log    - once appended and fsynced to the ingest log (replayed on restart)
+#   memory - once queued in memory (lost if the process dies)
+INGEST_DURABILITY = os.environ.get("INGEST_DURABILITY", "commit")
+INGEST_DURABILITY_MODES = ("commit", "log", "memory")
+
+INGEST_BUFFER_CAPACITY = int(os.environ.get("INGEST_BUFFER_CAPACITY", "10000"))
+# A group commit starts when this many events are queued...
+INGEST_FLUSH_MAX_EVENTS = int(os.environ.get("INGEST_FLUSH_MAX_EVENTS", "500"))
+# ...or this long after the first queued event, whichever comes first
+INGEST_FLUSH_INTERVAL_MS = int(os.environ.get("INGEST_FLUSH_INTERVAL_MS", "10"))
+INGEST_LOG_DIR = os.environ.get("INGEST_LOG_DIR", "ingest_logs")
+
+# In log and memory modes a failed group commit is retried with doubling
+# delays; requests still failing after INGEST_MAX_ATTEMPTS are dropped
+INGEST_MAX_ATTEMPTS = int(os.environ.get("INGEST_MAX_ATTEMPTS", "5"))
+RETRY_DELAY_SECONDS = 1.0
+RETRY_MAX_DELAY_SECONDS = 30.0
+
+CommitHandler = Callable[[List[Event], Dict[str, Any]], Awaitable[None]]
+
+
+class IngestBufferFull(Exception):
+    pass
+
+
+class IngestLog:
+    """
+    Append-only JSON-lines log owned by one process, kept as a series of
+    segment files.
+
+    A new segment starts at every group commit and segments holding only
+    committed events are deleted, so the log never grows past the
+    uncommitted tail. The process keeps a lock file locked while the log
+    is open, so on startup the segments of any unlocked log left in the
+    directory belong to a process that died and can be replayed.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = f"ingest-{uuid.uuid4().hex}"
+        self._lock = threading.Lock()
+        self._lock_file = open(os.path.join(directory, self.name + ".lock"), "ab")
+        lock_file(self._lock_file, blocking=False)
+        # (path, last sequence, bytes) of segments no longer written to
+        self._sealed: List[Tuple[str, int, int]] = []
+        self._segment = 0
+        self._open_segment()
+        self.last_seq = 0
+        self.bytes = 0
+
+    def _open_segment(self):
+        self._segment += 1
+        self.path = segment_path(self.directory, self.name, self._segment)
+        self._file = open(self.path, "ab")
+        self._segment_bytes = 0
+
+    def write(self, lines: List[bytes], last_seq: int):
+        data = b"".join(lines)
+        with self._lock:
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.last_seq = last_seq
+            self.bytes += len(data)
+            self._segment_bytes += len(data)
+
+    def rotate(self, committed_seq: int):
+        """
+        Start a new segment and delete the segments whose events have all
+        been committed
+        """
+
+        with self._lock:
+            if self._segment_bytes:
+                self._file.close()
+                self._sealed.append((self.path, self.last_seq, self._segment_bytes))
+                self._open_segment()
+
+            while self._sealed and self._sealed[0][1] <= committed_seq:
+                path, _, size = self._sealed.pop(0)
+                os.remove(path)
+                self.bytes -= size
+
+    @property
+    def segments(self) -> int:
+        return len(self._sealed) + 1
+
+    def close(self, remove: bool):
+        with self._lock:
+            self._file.close()
+            self._lock_file.close()
+            if remove:
+                for path, _, _ in self._sealed:
+                    os.remove(path)
+                os.remove(self.path)
+                os.remove(self._lock_file.name)
+
+
+def segment_path(directory: str, name: str, segment: int) -> str:
+    return os.path.join(directory, f"{name}.{segment:08d}.log")
+
+
+class PendingIngest:
+    __slots__ = ("events", "received_ms", "seq", "attempts", "future")
+
+    def __init__(self, events: List[Event], received_ms: int):
+        self.events = events
+        self.received_ms = received_ms
+        self.seq = 0
+        self.attempts = 0
+        self.future: Optional[asyncio.Future] = None
+
+
+class IngestBuffer:
+    """
+    Queue tracked events and write them to the database in group commits.
+
+    One transaction covers every request that arrived during a flush
+    interval (up to INGEST_FLUSH_MAX_EVENTS), so sustained ingest costs one
+    fsync per group instead of one per request. When the queue holds
+    INGEST_BUFFER_CAPACITY events, submit() raises IngestBufferFull.
+    """
+
+    def __init__(
+        self,
+        mode: str = INGEST_DURABILITY,
+        capacity: int = INGEST_BUFFER_CAPACITY,
+        max_events: int = INGEST_FLUSH_MAX_EVENTS,
+        interval_ms: int = INGEST_FLUSH_INTERVAL_MS,
+        log_dir: str = INGEST_LOG_DIR,
+    ):
+        if mode not in INGEST_DURABILITY_MODES:
+            raise ValueError(
+                f"Unknown ingest durability mode '{mode}', "
+                f"expected one of {', '.join(INGEST_DURABILITY_MODES)}"
+            )
+
+        self.mode = mode
+        self.capacity = capacity
+        self.max_events = max_events
+        self.interval = interval_ms / 1000
+        self.log_dir = log_dir
+        self.on_commit: Optional[CommitHandler] = None
+
+        self._queue: deque = deque()
+        self._queued = 0
+        self._wake = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._log: Optional[IngestLog] = None
+        self._log_pending: List[tuple] = []
+        self._log_syncing = False
+        self._next_seq = 1
+        self._committed_seq = 0
+
+        self.accepted = 0
+        self.rejected = 0
+        self.committed = 0
+        self.group_commits = 0
+        self.failed_commits = 0
+        self.dropped = 0
+        self.replayed = 0
+        self.max_queued = 0
+        self.last_commit_ms = 0.0
+
+    async def start(self, on_commit: Optional[CommitHandler] = None):
+        self.on_commit = on_commit
+        self._closing = False
+        if self.mode == "log":
+            await self._replay_orphans()
+            self._log = IngestLog(self.log_dir)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Commit everything still queued, then stop the flusher
+        """
+
+        self._closing = True
+        if self._task is not None:
+            self._wake.set()
+            self._full.set()
+            await self._task
+            self._task = None
+        if self._log is not None:
+            self._log.close(remove=True)
+            await async_db.write(forget_ingest_log, self._log.name)
+            self._log = None
+
+    async def _replay_orphans(self):
+        """
+        Commit events from logs of processes that died before flushing them.
+
+        A log held by a running process is locked and skipped; the lock is
+        kept while replaying so two workers never replay the same log.
+        """
+
+        pattern = os.path.join(self.log_dir, "ingest-*.lock")
+        for lock_path in sorted(glob.glob(pattern)):
+            name = os.path.basename(lock_path)[: -len(".lock")]
+            with open(lock_path, "ab") as f:
+                if not lock_file(f, blocking=False):
+                    continue
+                replayed = 0
+                segments = glob.glob(os.path.join(self.log_dir, f"{name}.*.log"))
+                for path in sorted(segments):
+                    with open(path, "rb") as segment:
+                        replayed += await self._replay_log(name, segment)
+                    os.remove(path)
+
+            try:
+                os.remove(lock_path)
+            except OSError:
+                # Another worker locked it meanwhile, found no segments
+                # left and removes it itself
+                pass
+            await async_db.write(forget_ingest_log, name)
+            logger.info(f"Replayed {replayed} events from ingest log {name}")
+
+    async def _replay_log(self, name: str, f) -> int:
+        committed = await async_db.read(get_ingest_log_position, name)
+        chunk = []
+        replayed = 0
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Torn final write; it was never acknowledged
+                break
+            if entry["seq"] <= committed:
+                continue
+            # Flush only between sequences: the stored position covers
+            # whole requests
+            if len(chunk) >= self.max_events and chunk[-1]["seq"] != entry["seq"]:
+                replayed += await self._replay_chunk(name, chunk)
+                chunk = []
+            chunk.append(entry)
+        if chunk:
+            replayed += await self._replay_chunk(name, chunk)
+        return replayed
+
+    async def _replay_chunk(self, name: str, chunk: List[Dict[str, Any]]) -> int:
+        events = [Event(**entry["event"]) for entry in chunk]
+        result = await async_db.write(
+            insert_events,
+            events,
+            [entry["received_ms"] for entry in chunk],
+            (name, chunk[-1]["seq"]),
+        )
+        self.replayed += len(chunk)
+        await self._notify_commit(events, result)
+        return len(chunk)
+
+    async def submit(self, events: List[Event]) -> Dict[str, Any]:
+        """
+        Queue events for the next group commit. In commit mode this waits
+        for the commit and returns its event ids.
+        """
+
+        if self._closing or self._queued + len(events) > self.capacity:
+            self.rejected += len(events)
+            raise IngestBufferFull(
+                f"Ingest buffer full ({self._queued}/{self.capacity} events queued)"
+            )
+
+        entry = PendingIngest(events, int(time.time() * 1000))
+        self._queued += len(events)
+        self.max_queued = max(self.max_queued, self._queued)
+
+        if self.mode == "commit":
+            entry.future = asyncio.get_running_loop().create_future()
+            self._enqueue(entry)
+            result = await entry.future
+        elif self.mode == "log":
+            await self._append_log(entry)
+            result = {"queued": len(events)}
+        else:
+            self._enqueue(entry)
+            result = {"queued": len(events)}
+
+        self.accepted += len(events)
+        return result
+
+    def _enqueue(self, entry: PendingIngest):
+        self._queue.append(entry)
+        self._wake.set()
+        if self._queued >= self.max_events:
+            self._full.set()
+
+    async def _append_log(self, entry: PendingIngest):
+        future = asyncio.get_running_loop().create_future()
+        self._log_pending.append((entry, future))
+        if not self._log_syncing:
+            self._log_syncing = True
+            asyncio.create_task(self._sync_log())
+        await future
+
+    async def _sync_log(self):
+        """
+        Write and fsync every pending log entry at once
+        """
+
+        try:
+            while self._log_pending:
+                batch, self._log_pending = self._log_pending, []
+                lines = []
+                for entry, _ in batch:
+                    entry.seq = self._next_seq
+                    self._next_seq += 1
+                    for event in entry.events:
+                        lines.append(
+                            dumps(
+                                {
+                                    "seq": entry.seq,
+                                    "received_ms": entry.received_ms,
+                                    "event": {
+                                        "event_type": event.event_type,
+                                        "user_id": event.user_id,
+                                        "data": event.data,
+                                    },
+                                }
+                            )
+                            + b"\n"
+                        )
+
+                try:
+                    await asyncio.to_thread(self._log.write, lines, batch[-1][0].seq)
+                except Exception as e:
+                    for entry, future in batch:
+                        self._queued -= len(entry.events)
+                        future.set_exception(e)
+                    continue
+
+                # Queue in sequence order so commits advance the log position
+                # monotonically
+                for entry, future in batch:
+                    self._enqueue(entry)
+                    future.set_result(None)
+        finally:
+            self._log_syncing = False
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            if self._queued < self.max_events and not self._closing:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wake.clear()
+            self._full.clear()
+
+            while self._queue or (self._closing and self._log_pending):
+                await self._flush()
+            if self._closing:
+                return
+
+    async def _flush(self):
+        """
+        Commit the oldest queued requests, up to max_events, in one transaction
+        """
+
+        if not self._queue:
+            # Log writes still in flight; they queue their entries shortly
+            await asyncio.sleep(self.interval)
+            return
+
+        entries = []
+        count = 0
+        while self._queue and (
+            not entries or count + len(self._queue[0].events) <= self.max_events
+        ):
+            entry = self._queue.popleft()
+            entries.append(entry)
+            count += len(entry.events)
+
+        events = [event for entry in entries for event in entry.events]
+        received_ms = [entry.received_ms for entry in entries for _ in entry.events]
+        log_position = None
+        if self._log is not None:
+            log_position = (self._log.name, entries[-1].seq)
+
+        started = time.monotonic()
+        try:
+            result = await async_db.write(
+                insert_events, events, received_ms, log_position
+            )
+        except Exception as e:
+            self.failed_commits += 1
+            logger.error(f"Error committing {count} buffered events: {str(e)}")
+            if self.mode == "commit":
+                self._queued -= count
+                for entry in entries:
+                    entry.future.set_exception(e)
+            else:
+                await self._retry(entries)
+            return
+
+        self._queued -= count
+        self.committed += count
+        self.group_commits += 1
+        self.last_commit_ms = (time.monotonic() - started) * 1000
+
+        first_id = result["event_ids"][0]
+        for entry in entries:
+            if entry.future is not None:
+                ids = list(range(first_id, first_id + len(entry.events)))
+                entry.future.set_result(
+                    {
+                        "event_ids": ids,
+                        "inserted": len(ids),
+                        "total_events": result["total_events"],
+                    }
+                )
+            first_id += len(entry.events)
+
+        if log_position is not None:
+            self._committed_seq = log_position[1]
+            await asyncio.to_thread(self._log.rotate, self._committed_seq)
+
+        await self._notify_commit(events, result)
+
+    async def _retry(self, entries: List[PendingIngest]):
+        """
+        Put already acknowledged requests back at the front of the queue
+        after a failed commit, dropping those out of attempts, then back off
+        """
+
+        for entry in entries:
+            entry.attempts += 1
+        # Earlier requests were in every group a later one was in, so the
+        # requests out of attempts are always a prefix
+        dropped = [e for e in entries if e.attempts >= INGEST_MAX_ATTEMPTS]
+        retry = entries[len(dropped) :]
+
+        if dropped:
+            count = sum(len(entry.events) for entry in dropped)
+            self._queued -= count
+            self.dropped += count
+            ingest_dropped.inc(count)
+            logger.error(
+                f"Dropped {count} buffered events after "
+                f"{INGEST_MAX_ATTEMPTS} failed commits"
+            )
+            if self._log is not None:
+                # Keep a restart from replaying them
+                self._committed_seq = dropped[-1].seq
+                try:
+                    await async_db.write(
+                        skip_ingest_log, self._log.name, self._committed_seq
+                    )
+                    await asyncio.to_thread(self._log.rotate, self._committed_seq)
+                except Exception as e:
+                    logger.error(f"Error skipping dropped events in log: {str(e)}")
+
+        if retry:
+            self._queue.extendleft(reversed(retry))
+            delay = RETRY_DELAY_SECONDS * 2 ** (retry[0].attempts - 1)
+            await asyncio.sleep(min(delay, RETRY_MAX_DELAY_SECONDS))
+
+    async def _notify_commit(self, events: List[Event], result: Dict[str, Any]):
+        """
+        Hand committed events, live or replayed, to the commit handler
+        """
+
+        if self.on_commit is not None:
+            try:
+                await self.on_commit(events, result)
+            except Exception as e:
+                logger.error(f"Error handling committed events: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "capacity": self.capacity,
+            "queued": self._queued,
+            "max_queued": self.max_queued,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "committed": self.committed,
+            "replayed": self.replayed,
+            "group_commits": self.group_commits,
+            "failed_commits": self.failed_commits,
+            "dropped": self.dropped,
+            "avg_group_size": (
+                round(self.committed / self.group_commits, 1)
+                if self.group_commits
+                else 0.0
+            ),
+            "last_commit_ms": round(self.last_commit_ms, 3),
+            "log_bytes": self._log.bytes if self._log is not None else 0,
+            "log_segments": self._log.segments if self._log is not None else 0,
+        }
+
+
+ingest_buffer = IngestBuffer()
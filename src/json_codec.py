@@ -0,0 +1,85 @@
+import json
+import os
+import re
+from typing import Any, List
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson >= 3.9 can embed pre-encoded JSON itself
+_Fragment = getattr(orjson, "Fragment", None)
+
+# Stand-in string for RawJSON values during encoding. The per-process nonce
+# keeps stored data from ever matching it; the NUL is escaped as \u0000 by
+# both encoders
+_MARK = f"\x00raw:{os.urandom(8).hex()}:"
+_MARK_PATTERN = re.compile(
+    b'"' + re.escape(json.dumps(_MARK).strip('"').encode()) + rb'(\d+)"'
+)
+
+
+class RawJSON:
+    """
+    JSON text copied into encoded output as-is, without a decode/encode
+    round trip
+    """
+
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def decode(self) -> Any:
+        return json.loads(self.text)
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Compact UTF-8 JSON for obj, splicing in RawJSON values verbatim
+    """
+
+    if orjson is not None:
+        try:
+            return _encode(obj, fast=True)
+        except TypeError:
+            # orjson.JSONEncodeError is a TypeError; it rejects integers
+            # wider than 64 bits, which the standard library encodes
+            pass
+    return _encode(obj, fast=False)
+
+
+def _encode(obj: Any, fast: bool) -> bytes:
+    raws: List[str] = []
+
+    def default(value):
+        if isinstance(value, RawJSON):
+            if fast and _Fragment is not None:
+                return _Fragment(value.text)
+            raws.append(value.text)
+            return f"{_MARK}{len(raws) - 1}"
+        raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+    if fast:
+        body = orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+    else:
+        body = json.dumps(obj, default=default, separators=(",", ":")).encode()
+
+    if raws:
+        body = _MARK_PATTERN.sub(lambda m: raws[int(m.group(1))].encode(), body)
+    return body
+
+
+def dumps_str(obj: Any) -> str:
+    """
+    dumps() as text, for WebSocket frames and TEXT columns
+    """
+
+    return dumps(obj).decode()
+
+
+def loads(data) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -8,24 +8,77 @@ Author: Gica Tran
 Date: 2025
 """
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import (
+    FastAPI,
+    WebSocket,
+    WebSocketDisconnect,
+    HTTPException,
+    Query,
+    Request,
+)
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from database import (
     init_database,
-    insert_event,
     get_events,
+    query_events,
+    MAX_EVENTS_PAGE,
     get_stats,
     clear_all_events,
     get_funnel_analysis,
     get_user_segmentation,
+    get_segment_counts,
+    get_user_profile,
     detect_anomalies,
+    drain_new_anomalies,
+    get_pool_stats,
+    get_timeseries,
+    get_partitions,
+    run_partition_maintenance,
+    apply_remote_ingest,
+    reseed_analytics,
+    export_events,
+    list_archives,
+    backfill_rollups,
+    get_db_size,
+    list_properties,
+    get_property_breakdown,
+    get_user_patterns,
+    get_window_summary,
+    get_window_stats,
+    get_top_items,
+    get_top_stats,
+    get_path_analysis,
+    close_database,
 )
 from dashboard import get_dashboard_html
-from models import Event
-from websocket_manager import websocket_manager
+from models import Event, EventBatch
+from websocket_manager import websocket_manager, TOPICS
+from broadcaster import analytics_broadcaster
+from async_database import async_db
+from result_cache import result_cache
+from event_bus import event_bus
+from ingest_buffer import ingest_buffer, IngestBufferFull
+from json_codec import dumps
+from partitions import forget_partitions
+from properties import MAX_PROPERTY_GROUPS
+from heavy_hitters import MAX_TOP_K, TOP_K
+from path_analysis import DEFAULT_PATH_DEPTH, MAX_PATH_DEPTH, MAX_PATHS
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    REGISTRY as metrics_registry,
+    db_size_bytes,
+    ingest_queued,
+    ws_connections,
+)
+from contextlib import asynccontextmanager
+import asyncio
 import json
 import logging
+import os
+import time
+from typing import Callable, List, Optional
+from datetime import datetime, timezone
 from fastapi.middleware.cors import CORSMiddleware
 
 logging.basicConfig(
@@ -33,6 +86,108 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+RETRY_HEADERS = {"Retry-After": "1"}
+
+MAINTENANCE_INTERVAL_SECONDS = int(
+    os.environ.get("EVENT_MAINTENANCE_INTERVAL_SECONDS", "3600")
+)
+
+
+async def partition_maintenance():
+    """
+    Apply retention and compaction to the event partitions
+    """
+
+    result = await async_db.write(run_partition_maintenance)
+    if result["dropped"]:
+        logger.info(f"Dropped expired partitions: {', '.join(result['dropped'])}")
+        await event_bus.publish("reseed", {}, local=False)
+        analytics_broadcaster.mark_dirty()
+    if result["archived"]:
+        logger.info(f"Archived partitions: {', '.join(result['archived'])}")
+    if result["compacted"]:
+        logger.info(f"Compacted partitions: {', '.join(result['compacted'])}")
+    return result
+
+
+async def run_maintenance_loop():
+    while True:
+        try:
+            await partition_maintenance()
+        except Exception as e:
+            logger.error(f"Error running partition maintenance: {str(e)}")
+        await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
+
+
+async def broadcast(topic: str, message: dict):
+    """
+    Send a message to a topic's subscribers on every worker process
+    """
+
+    await event_bus.publish("topic", {"topic": topic, "message": message})
+
+
+async def publish_ingest(events):
+    """
+    Let other worker processes apply events this one has committed
+    """
+
+    await event_bus.publish(
+        "ingest",
+        {
+            "events": [
+                {
+                    "event_type": event.event_type,
+                    "user_id": event.user_id,
+                    "data": event.data,
+                }
+                for event in events
+            ],
+            "at": time.time(),
+        },
+        local=False,
+    )
+
+
+async def on_topic_message(message: dict):
+    await websocket_manager.send_to_topic(message["topic"], message["message"])
+
+
+async def on_remote_ingest(message: dict):
+    await async_db.write(apply_remote_ingest, message["events"], message["at"])
+    analytics_broadcaster.mark_dirty()
+
+
+async def on_remote_reseed(message: dict):
+    # Another worker cleared or expired events; the partitions it dropped
+    # may still be cached as existing here
+    await async_db.write(forget_partitions)
+    await async_db.write(reseed_analytics)
+    analytics_broadcaster.mark_dirty()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start and stop background tasks with the application
+    """
+
+    event_bus.subscribe("topic", on_topic_message)
+    event_bus.subscribe("ingest", on_remote_ingest)
+    event_bus.subscribe("reseed", on_remote_reseed)
+    await event_bus.start()
+    await ingest_buffer.start(on_events_committed)
+    analytics_broadcaster.start()
+    maintenance_task = asyncio.create_task(run_maintenance_loop())
+    yield
+    maintenance_task.cancel()
+    await ingest_buffer.stop()
+    await analytics_broadcaster.stop()
+    await event_bus.stop()
+    async_db.shutdown()
+    close_database()
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="StreamCommerce Analytics Platform",
@@ -40,6 +195,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/api/docs",
     redoc_url="/api/redoc",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -55,6 +211,13 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Initialize database on startup
 init_database()
+# Messages published before the seed describe events it already counted
+event_bus.skip_pending()
+
+# Gauges read at scrape time
+ws_connections.set_function(lambda: len(websocket_manager.clients))
+ingest_queued.set_function(lambda: ingest_buffer.get_stats()["queued"])
+db_size_bytes.set_function(get_db_size)
 
 
 @app.websocket("/ws")
@@ -66,32 +229,54 @@ async def websocket_endpoint(websocket: WebSocket):
     await websocket_manager.connect(websocket)
 
     try:
-        stats = get_stats()
-        events_data = get_events(10)
-        funnel_data = get_funnel_analysis()
-        segmentation_data = get_user_segmentation()
-        anomaly_data = detect_anomalies()
-
-        await websocket.send_text(
-            json.dumps(
-                {
-                    "type": "initial_data",
-                    "stats": stats,
-                    "events": events_data["events"],
-                    "funnel": funnel_data,
-                    "segmentation": segmentation_data,
-                    "anomalies": anomaly_data,
-                }
-            )
+        (
+            stats,
+            events_data,
+            funnel_data,
+            segmentation_data,
+            anomaly_data,
+            top_data,
+        ) = await asyncio.gather(
+            async_db.read(get_stats),
+            async_db.read(get_events, 10, True),
+            async_db.read(get_funnel_analysis),
+            async_db.read(get_segment_counts),
+            async_db.read(detect_anomalies),
+            async_db.read(get_top_items),
+        )
+
+        # Refresh the shared topic state so the new client starts from
+        # current data; other clients only receive the resulting patches
+        await websocket_manager.publish("stats", stats)
+        await websocket_manager.publish("funnel", funnel_data)
+        await websocket_manager.publish("segmentation", segmentation_data)
+        await websocket_manager.publish("anomalies", anomaly_data)
+        await websocket_manager.publish("top", top_data)
+
+        await websocket_manager.send_personal(
+            websocket, {"type": "initial_data", "events": events_data["events"]}
+        )
+        # Clients that never send a subscribe message get every topic
+        await websocket_manager.handle_message(
+            websocket, {"type": "subscribe", "topics": TOPICS}
         )
 
         while True:
-            # Wait for any message from client (keepalive)
+            # Keepalives and subscription requests from the client
             try:
-                await websocket.receive_text()
+                message = await websocket.receive_text()
             except:
                 break
+
+            try:
+                request = json.loads(message)
+            except ValueError:
+                continue
+            if isinstance(request, dict):
+                await websocket_manager.handle_message(websocket, request)
     except WebSocketDisconnect:
+        pass
+    finally:
         websocket_manager.disconnect(websocket)
 
 
@@ -107,51 +292,101 @@ def dashboard():
 @app.post("/track")
 async def track_event(event: Event):
     """
-    Track a new event - now with real-time updates
+    Track a new event - analytics are broadcast in the background
     """
 
     try:
         logger.info(f"Tracking event: {event.event_type} for user {event.user_id}")
 
-        newEvent = Event(
-            event_type=event.event_type,
-            user_id=event.user_id,
-            data=event.data,
-        )
+        result = await ingest_buffer.submit([event])
 
-        result = insert_event(newEvent)
+        if "event_ids" not in result:
+            return {"status": "accepted", "queued": result["queued"]}
 
-        event_data = {
-            "id": result["event_id"],
-            "event_type": newEvent.event_type,
-            "user_id": newEvent.user_id,
-            "data": newEvent.data,
-            "timestamp": "just now",
+        logger.info(f"Successfully tracked event {result['event_ids'][0]}")
+        return {
+            "status": "tracked",
+            "event_id": result["event_ids"][0],
+            "total_events": result["total_events"],
         }
+    except IngestBufferFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers=RETRY_HEADERS)
+    except Exception as e:
+        logger.error(f"Error tracking event: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to track event")
 
-        await websocket_manager.send_event_update(event_data)
 
-        updated_stats = get_stats()
-        funnel_data = get_funnel_analysis()
-        segmentation_data = get_user_segmentation()
-        anomaly_data = detect_anomalies()
+@app.post("/track/batch")
+async def track_events_batch(batch: EventBatch):
+    """
+    Track a batch of events in a single transaction
+    """
 
-        await websocket_manager.send_stats_update(updated_stats)
-        await websocket_manager.send_to_all(
-            {"type": "funnel_update", "data": funnel_data}
-        )
-        await websocket_manager.send_to_all(
-            {"type": "segmentation_update", "data": segmentation_data}
-        )
-        await websocket_manager.send_to_all(
-            {"type": "anomaly_update", "data": anomaly_data}
-        )
+    try:
+        logger.info(f"Tracking batch of {len(batch.events)} events")
 
-        logger.info(f"Successfully tracked event {result['event_id']}")
-        return {"status": "tracked", **result}
+        result = await ingest_buffer.submit(batch.events)
+
+        if "event_ids" not in result:
+            return {"status": "accepted", "queued": result["queued"]}
+
+        logger.info(f"Successfully tracked {result['inserted']} events")
+        return {
+            "status": "tracked",
+            "inserted": result["inserted"],
+            "first_event_id": result["event_ids"][0],
+            "last_event_id": result["event_ids"][-1],
+            "total_events": result["total_events"],
+        }
+    except IngestBufferFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers=RETRY_HEADERS)
     except Exception as e:
-        logger.error(f"Error tracking event: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to track event")
+        logger.error(f"Error tracking batch: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to track events")
+
+
+async def on_events_committed(events, result):
+    """
+    Fan out a group commit: other workers, the live feed and anomalies
+    """
+
+    events_data = [
+        {
+            "id": event_id,
+            "event_type": event.event_type,
+            "user_id": event.user_id,
+            "data": event.data,
+            "timestamp": "just now",
+        }
+        for event_id, event in zip(result["event_ids"], events)
+    ]
+
+    await publish_ingest(events)
+    if len(events_data) == 1:
+        message = websocket_manager.event_update_message(events_data[0])
+    else:
+        message = websocket_manager.batch_update_message(events_data)
+    await broadcast("events", message)
+    await push_new_anomalies()
+    analytics_broadcaster.mark_dirty()
+
+
+async def push_new_anomalies():
+    """
+    Push anomalies fired by the latest ingest to subscribed clients
+    """
+
+    alerts = drain_new_anomalies()
+    if alerts:
+        await broadcast("anomalies", {"type": "anomaly_alert", "data": alerts})
+
+
+def json_response(value) -> Response:
+    """
+    Encode a result directly, splicing stored event data in undecoded
+    """
+
+    return Response(dumps(value), media_type="application/json")
 
 
 @app.get("/events")
@@ -160,21 +395,41 @@ def list_events(limit: int = 10):
     Get recent events
     """
 
-    result = get_events(limit)
+    result = get_events(limit, raw=True)
 
-    return {
-        **result,
-        "showing": f"last {len(result['events'])} events",
-    }
+    return json_response(
+        {
+            **result,
+            "showing": f"last {len(result['events'])} events",
+        }
+    )
+
+
+def cached_json(request: Request, name: str, compute: Callable, *args) -> Response:
+    """
+    Serve a read result from the result cache, or 304 if the client's
+    If-None-Match already names the current version
+    """
+
+    entry = result_cache.get((name, args), lambda: compute(*args))
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if entry.etag in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+
+    return Response(entry.body, media_type="application/json", headers=headers)
 
 
 @app.get("/stats")
-def analytics_stats():
+def analytics_stats(request: Request):
     """
     Get analytics statistics
     """
 
-    return get_stats()
+    return cached_json(request, "stats", get_stats)
 
 
 @app.delete("/events")
@@ -183,16 +438,11 @@ async def clear_events():
     Clear all events - useful for testing.
     """
 
-    clear_all_events()
+    await async_db.write(clear_all_events)
+    await event_bus.publish("reseed", {}, local=False)
 
-    await websocket_manager.send_stats_update(
-        {
-            "total_events": 0,
-            "unique_users": 0,
-            "event_last_hour": 0,
-            "event_types": {},
-        }
-    )
+    await websocket_manager.send_stats_update(await async_db.read(get_stats))
+    analytics_broadcaster.mark_dirty()
 
     return {
         "status": "cleared",
@@ -219,6 +469,15 @@ def health_check():
     }
 
 
+@app.get("/metrics")
+def metrics():
+    """
+    Prometheus metrics: ingest and analytics latency, fan-out, gauges
+    """
+
+    return Response(metrics_registry.expose(), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.post("/demo/generate-traffic")
 async def generate_demo_traffic():
     """
@@ -226,7 +485,6 @@ async def generate_demo_traffic():
     """
 
     import random
-    import asyncio
 
     # Create 3 realistic user journeys
     for i in range(3):
@@ -325,87 +583,78 @@ def get_user_activity():
         user_journeys[user_id].append(event)
 
     for user_id in user_journeys:
-        user_journeys[user_id].sort(key=lambda x: x["timestamp"])
+        # Events of one batch share a timestamp; ids keep their order
+        user_journeys[user_id].sort(key=lambda x: (x["timestamp"], x["id"]))
 
     return {"user_journeys": user_journeys}
 
 
 @app.get("/funnel-analysis")
-def funnel_analysis():
+def funnel_analysis(request: Request, window: Optional[str] = None):
     """
     Get conversion funnel analysis
     """
 
-    return get_funnel_analysis()
+    try:
+        return cached_json(request, "funnel", get_funnel_analysis, window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.get("/user-patterns")
-def analyze_user_patterns():
+def analyze_user_patterns(request: Request, limit: int = Query(200, ge=1, le=1000)):
     """
     Analyze user behavior patterns to understand intent signals
     """
 
-    result = get_events(200)
-    events = result["events"]
+    return cached_json(request, "user_patterns", get_user_patterns, limit)
 
-    user_journeys = {}
-    for event in events:
-        user_id = event.get("user_id", "anonymous")
 
-        if user_id not in user_journeys:
-            user_journeys[user_id] = []
+@app.get("/user-segmentation")
+def user_segmentation(
+    request: Request,
+    segment: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=1000),
+):
+    """
+    Get real-time user intent segmentation
+    """
 
-        user_journeys[user_id].append(
-            {
-                "event_type": event["event_type"],
-                "timestamp": event["timestamp"],
-                "data": event["data"],
-            }
+    try:
+        return cached_json(
+            request, "segmentation", get_user_segmentation, segment, offset, limit
         )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    user_analysis = {}
-    for user_id, events_list in user_journeys.items():
-        events_list.sort(key=lambda x: x["timestamp"])
-
-        event_types = [e["event_type"] for e in events_list]
-
-        analysis = {
-            "total_events": len(events_list),
-            "event_sequence": event_types,
-            "converted": "purchase" in event_types,
-            "added_to_cart": "add_to_cart" in event_types,
-            "viewed_products": "product_view" in event_types,
-            "signup": "user_signup" in event_types,
-        }
 
-        user_analysis[user_id] = analysis
-
-    return {"user_patterns": user_analysis}
-
-
-@app.get("/user-segmentation")
-def user_segmentation():
+@app.get("/users/{user_id}")
+def user_profile(user_id: str):
     """
-    Get real-time user intent segmentation
+    Get a single user's profile and intent
     """
 
-    return get_user_segmentation()
+    profile = get_user_profile(user_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return profile
 
 
 @app.get("/anomalies")
-def get_anomalies():
+def get_anomalies(request: Request):
     """
     Get real-time anomaly detection results
     """
 
-    return detect_anomalies()
+    return cached_json(request, "anomalies", detect_anomalies)
 
 
 @app.post("/demo/generate-anomalies")
 async def generate_anomalies():
     """Generate anomalous behavior to test detection"""
     import random
-    import asyncio
 
     # 1. Create traffic spike - send many events quickly
     for i in range(15):  # Send 15 events rapidly
@@ -443,25 +692,329 @@ async def generate_anomalies():
 
 # API v1 routes
 @app.get("/api/v1/stats")
-def get_stats_v1():
+def get_stats_v1(request: Request):
     """Get analytics statistics - API v1"""
     try:
-        return get_stats()
+        return cached_json(request, "stats", get_stats)
     except Exception as e:
         logger.error(f"Error getting stats: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to get statistics")
 
 
 @app.get("/api/v1/funnel")
-def get_funnel_v1():
+def get_funnel_v1(request: Request, window: Optional[str] = None):
     """Get conversion funnel analysis - API v1"""
     try:
-        return get_funnel_analysis()
+        return cached_json(request, "funnel", get_funnel_analysis, window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error getting funnel: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to get funnel analysis")
 
 
+@app.get("/api/v1/timeseries")
+def get_timeseries_v1(
+    granularity: str = "minute",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    event_type: Optional[str] = None,
+):
+    """Get event counts and revenue per minute, hour or day - API v1"""
+    try:
+        return get_timeseries(
+            granularity,
+            to_epoch_ms(start) if start else None,
+            to_epoch_ms(end) if end else None,
+            event_type,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def to_epoch_ms(value: datetime) -> int:
+    # Naive datetimes are taken to be UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def parse_property_filters(filters: List[str]) -> tuple:
+    """
+    ("key", "value") pairs from key:value query parameters
+    """
+
+    pairs = []
+    for item in filters:
+        key, sep, value = item.partition(":")
+        if not sep:
+            raise ValueError(f"Invalid filter '{item}', expected key:value")
+        pairs.append((key, value))
+    return tuple(pairs)
+
+
+@app.get("/api/v1/events")
+async def list_events_v1(
+    limit: int = Query(100, ge=1, le=MAX_EVENTS_PAGE),
+    cursor: Optional[str] = None,
+    event_type: Optional[str] = None,
+    user_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    order: str = "desc",
+    filters: List[str] = Query([], alias="filter"),
+):
+    """Get a page of events, continuing from next_cursor - API v1"""
+    try:
+        page = await async_db.read(
+            query_events,
+            limit,
+            cursor,
+            event_type,
+            user_id,
+            to_epoch_ms(start) if start else None,
+            to_epoch_ms(end) if end else None,
+            order,
+            True,
+            parse_property_filters(filters),
+        )
+        return json_response(page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/v1/events/stream")
+async def stream_events_v1(
+    event_type: Optional[str] = None,
+    user_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    order: str = "asc",
+):
+    """Stream all matching events as NDJSON - API v1"""
+    args = (
+        event_type,
+        user_id,
+        to_epoch_ms(start) if start else None,
+        to_epoch_ms(end) if end else None,
+        order,
+        True,
+    )
+    try:
+        page = await async_db.read(query_events, MAX_EVENTS_PAGE, None, *args)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def lines():
+        # Each page is its own short read, so a slow client holds neither a
+        # pooled connection nor more than one page in memory
+        nonlocal page
+        while True:
+            yield b"".join(dumps(event) + b"\n" for event in page["events"])
+            if page["next_cursor"] is None:
+                break
+            page = await async_db.read(
+                query_events, MAX_EVENTS_PAGE, page["next_cursor"], *args
+            )
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/api/v1/properties")
+def list_properties_v1():
+    """Get the indexed event properties - API v1"""
+    return list_properties()
+
+
+@app.get("/api/v1/properties/{event_type}/{key}")
+def get_property_breakdown_v1(
+    request: Request,
+    event_type: str,
+    key: str,
+    metric: Optional[str] = None,
+    filters: List[str] = Query([], alias="filter"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(50, ge=1, le=MAX_PROPERTY_GROUPS),
+):
+    """Get event counts and metric totals per property value - API v1"""
+    try:
+        return cached_json(
+            request,
+            "property_breakdown",
+            get_property_breakdown,
+            event_type,
+            key,
+            metric,
+            parse_property_filters(filters),
+            to_epoch_ms(start) if start else None,
+            to_epoch_ms(end) if end else None,
+            limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/v1/window")
+def get_window_summary_v1(request: Request, minutes: Optional[int] = Query(None, ge=1)):
+    """Get counts, funnel and segments over recent events in memory - API v1"""
+    try:
+        return cached_json(request, "window_summary", get_window_summary, minutes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/v1/window/stats")
+def get_window_stats_v1():
+    """Get the size of the in-memory event window - API v1"""
+    return get_window_stats()
+
+
+@app.get("/api/v1/top")
+def get_top_items_v1(
+    request: Request,
+    dimension: Optional[str] = None,
+    window: Optional[str] = None,
+    limit: int = Query(TOP_K, ge=1, le=MAX_TOP_K),
+):
+    """Get the most frequent products, pages and users recently - API v1"""
+    try:
+        return cached_json(
+            request, "top_items", get_top_items, dimension, window, limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/v1/top/stats")
+def get_top_stats_v1():
+    """Get the size of the top-K sketches - API v1"""
+    return get_top_stats()
+
+
+@app.get("/api/v1/paths")
+def get_path_analysis_v1(
+    request: Request,
+    steps: Optional[str] = None,
+    max_gap: Optional[int] = Query(None, ge=1),
+    depth: int = Query(DEFAULT_PATH_DEPTH, ge=1, le=MAX_PATH_DEPTH),
+    limit: int = Query(20, ge=1, le=MAX_PATHS),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """Get ordered funnel, time-to-convert and common paths - API v1"""
+    funnel_steps = None
+    if steps:
+        funnel_steps = tuple(step.strip() for step in steps.split(",") if step.strip())
+    try:
+        return cached_json(
+            request,
+            "paths",
+            get_path_analysis,
+            funnel_steps,
+            max_gap,
+            depth,
+            limit,
+            to_epoch_ms(start) if start else None,
+            to_epoch_ms(end) if end else None,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/v1/partitions")
+def get_partitions_v1():
+    """Get event storage partitions and retention settings - API v1"""
+    return get_partitions()
+
+
+@app.post("/api/v1/partitions/maintenance")
+async def run_partition_maintenance_v1():
+    """Run partition retention and compaction now - API v1"""
+    return await partition_maintenance()
+
+
+@app.get("/api/v1/archive")
+def list_archives_v1():
+    """Get columnar event archives - API v1"""
+    return list_archives()
+
+
+@app.post("/api/v1/archive/export")
+async def export_archive_v1(
+    start: Optional[datetime] = None, end: Optional[datetime] = None
+):
+    """Export events in a time range to a columnar archive - API v1"""
+    try:
+        return await async_db.read(
+            export_events,
+            to_epoch_ms(start) if start else None,
+            to_epoch_ms(end) if end else None,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/api/v1/archive/backfill")
+async def backfill_archive_v1(
+    name: str, start: Optional[datetime] = None, end: Optional[datetime] = None
+):
+    """Add an archive's events to the timeseries rollups - API v1"""
+    try:
+        result = await async_db.write(
+            backfill_rollups,
+            name,
+            to_epoch_ms(start) if start else None,
+            to_epoch_ms(end) if end else None,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    analytics_broadcaster.mark_dirty()
+    return result
+
+
+@app.get("/api/v1/cache/stats")
+def get_cache_stats_v1():
+    """Get result cache hit, miss and eviction counts - API v1"""
+    return result_cache.get_stats()
+
+
+@app.get("/api/v1/ingest/stats")
+def get_ingest_stats_v1():
+    """Get ingest buffer depth and group commit statistics - API v1"""
+    return ingest_buffer.get_stats()
+
+
+@app.get("/api/v1/bus/stats")
+def get_bus_stats_v1():
+    """Get cross-process event bus statistics - API v1"""
+    return event_bus.get_stats()
+
+
+@app.get("/api/v1/db/pool")
+def get_pool_stats_v1():
+    """Get database connection pool statistics - API v1"""
+    return get_pool_stats()
+
+
+@app.get("/api/v1/db/executor")
+def get_executor_stats_v1():
+    """Get database executor queue statistics - API v1"""
+    return async_db.get_stats()
+
+
+@app.get("/api/v1/ws/stats")
+def get_websocket_stats_v1():
+    """Get WebSocket fan-out queue statistics - API v1"""
+    return websocket_manager.get_stats()
+
+
+@app.get("/api/v1/broadcaster/stats")
+def get_broadcaster_stats_v1():
+    """Get analytics broadcast and coalescing counts - API v1"""
+    return analytics_broadcaster.get_stats()
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,375 @@
+import asyncio
+import functools
+import math
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Upper bounds in seconds, from sub-millisecond cache-speed work to slow reseeds
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+DEPTH_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_str(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Timer:
+    """
+    Record elapsed seconds into a histogram, as a context manager or as a
+    decorator for plain and async functions
+    """
+
+    __slots__ = ("_histogram", "_started")
+
+    def __init__(self, histogram: "HistogramValue"):
+        self._histogram = histogram
+        self._started = 0.0
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._started)
+
+    def __call__(self, fn: Callable) -> Callable:
+        histogram = self._histogram
+
+        if asyncio.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def timed_async(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started)
+
+            return timed_async
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+
+        return timed
+
+
+class CounterValue:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name: str, labels: str) -> List[str]:
+        return [f"{name}{labels} {_format_value(self.value)}"]
+
+
+class GaugeValue:
+    __slots__ = ("_lock", "_value", "_function")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self._value = float(value)
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set_function(self, function: Callable[[], float]):
+        """
+        Read the value from function at scrape time instead
+        """
+
+        self._function = function
+
+    @property
+    def value(self) -> float:
+        if self._function is not None:
+            return float(self._function())
+        return self._value
+
+    def samples(self, name: str, labels: str) -> List[str]:
+        try:
+            value = self.value
+        except Exception:
+            value = math.nan
+        return [f"{name}{labels} {'NaN' if value != value else _format_value(value)}"]
+
+
+class HistogramValue:
+    __slots__ = ("_lock", "_bounds", "_counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        # Per-bucket counts; the last slot is +Inf. Cumulated at scrape time
+        self._counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> Timer:
+        return Timer(self)
+
+    def samples(self, name: str, labels: str) -> List[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self.sum, self.count
+
+        extra = labels[1:-1] + "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self._bounds + (math.inf,), counts):
+            cumulative += bucket_count
+            le = _format_value(bound)
+            lines.append(f'{name}_bucket{{{extra}le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{name}_count{labels} {count}")
+        return lines
+
+
+class Metric:
+    """
+    A named metric family with one child value per combination of labels.
+
+    labels() caches children, so hot paths should bind theirs once at
+    import time; metrics without labels forward inc/set/observe/time to
+    their single child.
+    """
+
+    kind = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Optional["Registry"] = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+        (registry or REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(
+                    f"Metric {self.name} expects labels "
+                    f"({', '.join(self.labelnames)}), got {len(key)} values"
+                )
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def expose(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for key, child in sorted(self._children.copy().items()):
+            lines.extend(child.samples(self.name, _label_str(self.labelnames, key)))
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        return CounterValue()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        return GaugeValue()
+
+    def set(self, value: float):
+        self._default.set(value)
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default.dec(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self._default.set_function(function)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        registry: Optional["Registry"] = None,
+    ):
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        super().__init__(name, documentation, labelnames, registry)
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def time(self) -> Timer:
+        return self._default.time()
+
+
+class Registry:
+    """
+    The set of metrics served by /metrics
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def expose(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format
+        """
+
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+events_ingested = Counter(
+    "streamcommerce_events_ingested_total",
+    "Events committed to storage by this process",
+    ["event_type"],
+)
+insert_seconds = Histogram(
+    "streamcommerce_insert_seconds",
+    "Time to commit an ingest transaction",
+    ["path"],
+)
+analytics_seconds = Histogram(
+    "streamcommerce_analytics_seconds",
+    "Time to compute an analytics result (cache misses only)",
+    ["function"],
+)
+ws_broadcast_seconds = Histogram(
+    "streamcommerce_ws_broadcast_seconds",
+    "Time to queue a message for every subscribed WebSocket client",
+    ["topic"],
+)
+ws_queue_depth = Histogram(
+    "streamcommerce_ws_queue_depth",
+    "WebSocket client send queue depth after each enqueue",
+    buckets=DEPTH_BUCKETS,
+)
+ws_connections = Gauge(
+    "streamcommerce_ws_connections",
+    "Connected WebSocket clients",
+)
+ingest_queued = Gauge(
+    "streamcommerce_ingest_queued_events",
+    "Events waiting in the ingest buffer",
+)
+ingest_dropped = Counter(
+    "streamcommerce_ingest_dropped_events_total",
+    "Acknowledged events dropped after their group commit kept failing",
+)
+db_size_bytes = Gauge(
+    "streamcommerce_db_size_bytes",
+    "Size of the database file and its write-ahead log",
+)
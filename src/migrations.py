@@ -0,0 +1,386 @@
+import logging
+import sqlite3
+from contextlib import contextmanager
+from typing import Callable, List, Tuple
+
+from file_lock import lock_file, unlock_file
+from partitions import DAY_MS, create_partition, create_props_table, create_registry
+from properties import create_property_registry
+
+logger = logging.getLogger(__name__)
+
+# Rows copied per transaction while rebuilding a table, so that other
+# connections can keep reading and writing between batches
+MIGRATION_BATCH_SIZE = 10000
+
+# ISO-8601 / SQLite datetime text to epoch milliseconds
+_EPOCH_MS = "CAST(ROUND((julianday({0}) - 2440587.5) * 86400000) AS INTEGER)"
+
+
+def _create_events(conn: sqlite3.Connection):
+    """
+    The original schema, for databases created before migrations existed
+    """
+
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            user_id TEXT,
+            data TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+def _typed_events(conn: sqlite3.Connection):
+    """
+    Rebuild events with epoch-ms time columns and event type codes.
+
+    Rows are copied into events_typed in id order and in small batches;
+    the copy resumes from the highest copied id if it was interrupted.
+    The swap at the end only has to catch up on rows written meanwhile.
+    """
+
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS event_types (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS events_typed (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts INTEGER NOT NULL,
+            event_type_id INTEGER NOT NULL REFERENCES event_types(id),
+            user_id TEXT,
+            data TEXT,
+            created_ts INTEGER NOT NULL
+        )
+        """
+    )
+    conn.commit()
+
+    event_ts = _EPOCH_MS.format("e.timestamp")
+    ingest_ts = _EPOCH_MS.format("e.created_at")
+    copy_sql = f"""
+        INSERT INTO events_typed (id, ts, event_type_id, user_id, data, created_ts)
+        SELECT
+            e.id,
+            COALESCE({event_ts}, {ingest_ts}),
+            et.id,
+            e.user_id,
+            e.data,
+            COALESCE({ingest_ts}, {event_ts})
+        FROM events e
+        JOIN event_types et ON et.name = e.event_type
+        WHERE e.id > ?
+        ORDER BY e.id
+        LIMIT ?
+    """
+
+    def copy_batch(limit: int) -> int:
+        last_id = conn.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM events_typed"
+        ).fetchone()[0]
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO event_types (name)
+            SELECT DISTINCT event_type FROM events WHERE id > ?
+            """,
+            (last_id,),
+        )
+        return conn.execute(copy_sql, (last_id, limit)).rowcount
+
+    while True:
+        copied = copy_batch(MIGRATION_BATCH_SIZE)
+        conn.commit()
+        if copied < MIGRATION_BATCH_SIZE:
+            break
+
+    # Catch up on rows inserted during the copy and swap the tables over
+    # in one short write transaction
+    conn.execute("BEGIN IMMEDIATE")
+    copy_batch(-1)
+
+    # Keep AUTOINCREMENT from reusing ids of rows deleted before the rebuild
+    row = conn.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'events'"
+    ).fetchone()
+    old_seq = row[0] if row else 0
+
+    conn.execute("DROP TABLE events")
+    conn.execute("ALTER TABLE events_typed RENAME TO events")
+    conn.execute(
+        "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'events'",
+        (old_seq,),
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_events_type_ts ON events (event_type_id, ts)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_events_user_ts ON events (user_id, ts)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_ts ON events (ts)")
+
+
+def _rollup_tables(conn: sqlite3.Connection):
+    """
+    Per-minute, per-hour and per-day rollups, backfilled from events.
+
+    Rows up to the id seen when the tables are created are aggregated in
+    id-range batches; progress is stored in schema_meta so an interrupted
+    backfill neither restarts nor double counts. Newer rows are rolled up
+    by the ingest path itself.
+    """
+
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER
+        )
+        """
+    )
+    conn.execute("BEGIN IMMEDIATE")
+    for name in ("minute", "hour", "day"):
+        conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS rollup_{name} (
+                bucket INTEGER NOT NULL,
+                event_type_id INTEGER NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                revenue REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, event_type_id)
+            ) WITHOUT ROWID
+            """
+        )
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO schema_meta (key, value)
+        SELECT 'rollup_backfill_end', COALESCE(MAX(id), 0) FROM events
+        """
+    )
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO schema_meta (key, value)
+        VALUES ('rollup_backfill_id', 0)
+        """
+    )
+    conn.commit()
+
+    end_id = conn.execute(
+        "SELECT value FROM schema_meta WHERE key = 'rollup_backfill_end'"
+    ).fetchone()[0]
+    purchase_id = conn.execute(
+        "SELECT id FROM event_types WHERE name = 'purchase'"
+    ).fetchone()
+    purchase_id = purchase_id[0] if purchase_id else -1
+
+    while True:
+        last_id = conn.execute(
+            "SELECT value FROM schema_meta WHERE key = 'rollup_backfill_id'"
+        ).fetchone()[0]
+        if last_id >= end_id:
+            break
+        upto = min(last_id + MIGRATION_BATCH_SIZE, end_id)
+
+        for name, width in (
+            ("minute", 60000),
+            ("hour", 3600000),
+            ("day", 86400000),
+        ):
+            conn.execute(
+                f"""
+                INSERT INTO rollup_{name} (bucket, event_type_id, count, revenue)
+                SELECT
+                    ts - ts % {width},
+                    event_type_id,
+                    COUNT(*),
+                    TOTAL(
+                        CASE WHEN event_type_id = ?
+                        THEN json_extract(data, '$.amount') END
+                    )
+                FROM events
+                WHERE id > ? AND id <= ?
+                GROUP BY 1, 2
+                ON CONFLICT (bucket, event_type_id) DO UPDATE SET
+                    count = count + excluded.count,
+                    revenue = revenue + excluded.revenue
+                """,
+                (purchase_id, last_id, upto),
+            )
+        conn.execute(
+            "UPDATE schema_meta SET value = ? WHERE key = 'rollup_backfill_id'",
+            (upto,),
+        )
+        conn.commit()
+
+
+def _partition_events(conn: sqlite3.Connection):
+    """
+    Move events into one table per UTC day.
+
+    Ids are handed out from schema_meta from now on, continuing after the
+    highest id the old table ever issued. Rows are moved in id-range
+    batches with progress stored in schema_meta; the last batch and the
+    drop of the old table happen in one write transaction.
+    """
+
+    create_registry(conn)
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO schema_meta (key, value)
+        SELECT 'last_event_id', MAX(
+            (SELECT COALESCE(MAX(id), 0) FROM events),
+            COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'events'), 0)
+        )
+        """
+    )
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO schema_meta (key, value)
+        VALUES ('partition_copy_id', 0)
+        """
+    )
+    conn.commit()
+
+    def copy_batch(limit: int) -> int:
+        last_id = conn.execute(
+            "SELECT value FROM schema_meta WHERE key = 'partition_copy_id'"
+        ).fetchone()[0]
+        upto, rows = conn.execute(
+            """
+            SELECT MAX(id), COUNT(*)
+            FROM (SELECT id FROM events WHERE id > ? ORDER BY id LIMIT ?)
+            """,
+            (last_id, limit),
+        ).fetchone()
+        if not rows:
+            return 0
+
+        days = conn.execute(
+            "SELECT DISTINCT ts - ts % ? FROM events WHERE id > ? AND id <= ?",
+            (DAY_MS, last_id, upto),
+        ).fetchall()
+        for (day,) in days:
+            name = create_partition(conn, day)
+            conn.execute(
+                f"""
+                INSERT OR IGNORE INTO {name}
+                    (id, ts, event_type_id, user_id, data, created_ts)
+                SELECT id, ts, event_type_id, user_id, data, created_ts
+                FROM events
+                WHERE id > ? AND id <= ? AND ts >= ? AND ts < ?
+                ORDER BY id
+                """,
+                (last_id, upto, day, day + DAY_MS),
+            )
+        conn.execute(
+            "UPDATE schema_meta SET value = ? WHERE key = 'partition_copy_id'",
+            (upto,),
+        )
+        return rows
+
+    while True:
+        copied = copy_batch(MIGRATION_BATCH_SIZE)
+        conn.commit()
+        if copied < MIGRATION_BATCH_SIZE:
+            break
+
+    # Catch up on rows inserted during the copy, then retire the old table
+    conn.execute("BEGIN IMMEDIATE")
+    copy_batch(-1)
+    conn.execute(
+        """
+        UPDATE schema_meta
+        SET value = MAX(
+            value,
+            COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'events'), 0)
+        )
+        WHERE key = 'last_event_id'
+        """
+    )
+    conn.execute("DROP TABLE events")
+
+
+def _property_tables(conn: sqlite3.Connection):
+    """
+    Property registry and a _props side table for every existing partition.
+
+    Declared properties are registered and backfilled at startup by the
+    database module, since the declarations are configuration.
+    """
+
+    create_property_registry(conn)
+    for (name,) in conn.execute("SELECT name FROM event_partitions").fetchall():
+        create_props_table(conn, name)
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "create events table", _create_events),
+    (2, "epoch-ms timestamps, event type codes and indexes", _typed_events),
+    (3, "per-minute, per-hour and per-day rollup tables", _rollup_tables),
+    (4, "one events table per day", _partition_events),
+    (5, "indexed event property side tables", _property_tables),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+@contextmanager
+def migration_lock(conn: sqlite3.Connection):
+    """
+    Hold an exclusive lock on a file beside the database while migrating.
+
+    Migrations commit in batches, so a transaction cannot keep other
+    processes out; every worker migrates at startup and must wait here
+    for the one that got in first.
+    """
+
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    if not path:
+        # In-memory databases are private to their connection
+        yield
+        return
+
+    with open(path + ".migrate.lock", "ab") as f:
+        lock_file(f)
+        try:
+            yield
+        finally:
+            unlock_file(f)
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Apply pending migrations in order; returns the resulting schema version
+    """
+
+    with migration_lock(conn):
+        for target, description, apply in MIGRATIONS:
+            # Another process may have applied this step while we waited
+            if target <= get_schema_version(conn):
+                continue
+
+            logger.info(f"Migrating database schema to v{target}: {description}")
+            try:
+                apply(conn)
+                conn.execute(f"PRAGMA user_version = {target}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        return get_schema_version(conn)
@@ -1,8 +1,14 @@
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List
+
+MAX_BATCH_SIZE = 1000
 
 
 class Event(BaseModel):
     event_type: str
     user_id: Optional[str] = None
     data: Dict[str, Any] = {}
+
+
+class EventBatch(BaseModel):
+    events: List[Event] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
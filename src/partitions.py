@@ -0,0 +1,248 @@
+import sqlite3
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+DAY_MS = 24 * 60 * 60 * 1000
+PARTITION_PREFIX = "events_p"
+
+# Days that already have a partition table, so the writer only hits the
+# registry when a new day starts
+_known_days = set()
+
+
+def day_start(ts_ms: int) -> int:
+    return ts_ms - ts_ms % DAY_MS
+
+
+def partition_name(day_ms: int) -> str:
+    day = datetime.fromtimestamp(day_ms / 1000, timezone.utc)
+    return f"{PARTITION_PREFIX}{day.strftime('%Y%m%d')}"
+
+
+def create_registry(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS event_partitions (
+            day INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            compacted INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+
+
+def _create_partition_table(conn: sqlite3.Connection, name: str):
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY,
+            ts INTEGER NOT NULL,
+            event_type_id INTEGER NOT NULL,
+            user_id TEXT,
+            data TEXT,
+            created_ts INTEGER NOT NULL
+        )
+        """
+    )
+
+
+def _create_partition_indexes(conn: sqlite3.Connection, name: str):
+    conn.execute(
+        f"CREATE INDEX IF NOT EXISTS {name}_type_ts ON {name} (event_type_id, ts)"
+    )
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_user_ts ON {name} (user_id, ts)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_ts ON {name} (ts)")
+
+
+def create_props_table(conn: sqlite3.Connection, name: str):
+    """
+    Indexed event properties for a partition, one row per (event, property)
+    """
+
+    # value is untyped: REAL for number properties, TEXT for text ones
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {name}_props (
+            event_id INTEGER NOT NULL,
+            property_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            value,
+            PRIMARY KEY (event_id, property_id)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS {name}_props_value
+        ON {name}_props (property_id, value, ts)
+        """
+    )
+
+
+def create_partition(conn: sqlite3.Connection, day: int) -> str:
+    name = partition_name(day)
+    _create_partition_table(conn, name)
+    _create_partition_indexes(conn, name)
+    create_props_table(conn, name)
+    conn.execute(
+        "INSERT OR IGNORE INTO event_partitions (day, name) VALUES (?, ?)",
+        (day, name),
+    )
+    return name
+
+
+def forget_partitions():
+    """
+    Drop the known-partition cache, e.g. after a rolled back write
+    """
+
+    _known_days.clear()
+
+
+def ensure_partition(conn: sqlite3.Connection, ts_ms: int) -> str:
+    """
+    Name of the partition holding ts_ms, creating it if needed (writer only)
+    """
+
+    day = day_start(ts_ms)
+    if day in _known_days:
+        return partition_name(day)
+
+    name = create_partition(conn, day)
+    _known_days.add(day)
+    return name
+
+
+def partition_tables(
+    conn: sqlite3.Connection,
+    start_ms: Optional[int] = None,
+    end_ms: Optional[int] = None,
+    newest_first: bool = False,
+) -> List[str]:
+    """
+    Partitions overlapping [start_ms, end_ms), in id order by default
+    """
+
+    sql = "SELECT name FROM event_partitions WHERE 1"
+    params = []
+    if start_ms is not None:
+        sql += " AND day >= ?"
+        params.append(day_start(start_ms))
+    if end_ms is not None:
+        sql += " AND day < ?"
+        params.append(end_ms)
+    sql += " ORDER BY day DESC" if newest_first else " ORDER BY day"
+    return [row[0] for row in conn.execute(sql, params)]
+
+
+def allocate_event_ids(conn: sqlite3.Connection, count: int) -> int:
+    """
+    Reserve count consecutive ids inside the current write transaction;
+    returns the first one
+    """
+
+    # A single UPDATE takes the write lock before reading, so concurrent
+    # writers in other processes can never be handed the same range
+    last_id = conn.execute(
+        """
+        UPDATE schema_meta SET value = value + ?
+        WHERE key = 'last_event_id'
+        RETURNING value
+        """,
+        (count,),
+    ).fetchone()[0]
+    return last_id - count + 1
+
+
+def drop_partition(conn: sqlite3.Connection, day: int, name: str):
+    # Dropping the table frees its pages at once; nothing is deleted row by row
+    conn.execute(f"DROP TABLE IF EXISTS {name}")
+    conn.execute(f"DROP TABLE IF EXISTS {name}_props")
+    conn.execute("DELETE FROM event_partitions WHERE day = ?", (day,))
+    _known_days.discard(day)
+
+
+def expired_partitions(
+    conn: sqlite3.Connection, cutoff_ms: int
+) -> List[Tuple[int, str]]:
+    """
+    Partitions whose whole day is older than cutoff_ms
+    """
+
+    return conn.execute(
+        "SELECT day, name FROM event_partitions WHERE day + ? <= ? ORDER BY day",
+        (DAY_MS, cutoff_ms),
+    ).fetchall()
+
+
+def drop_partitions_before(conn: sqlite3.Connection, cutoff_ms: int) -> List[str]:
+    old = expired_partitions(conn, cutoff_ms)
+    for day, name in old:
+        drop_partition(conn, day, name)
+    return [name for _, name in old]
+
+
+def drop_all_partitions(conn: sqlite3.Connection):
+    for day, name in conn.execute(
+        "SELECT day, name FROM event_partitions"
+    ).fetchall():
+        drop_partition(conn, day, name)
+
+
+def compact_partition(conn: sqlite3.Connection, day: int, name: str):
+    """
+    Rewrite a cold partition into contiguous pages in id order
+    """
+
+    compacted = f"{name}_compact"
+    conn.execute(f"DROP TABLE IF EXISTS {compacted}")
+    _create_partition_table(conn, compacted)
+    conn.execute(f"INSERT INTO {compacted} SELECT * FROM {name} ORDER BY id")
+    conn.execute(f"DROP TABLE {name}")
+    conn.execute(f"ALTER TABLE {compacted} RENAME TO {name}")
+    _create_partition_indexes(conn, name)
+    conn.execute("UPDATE event_partitions SET compacted = 1 WHERE day = ?", (day,))
+
+
+def cold_partitions(conn: sqlite3.Connection, cutoff_ms: int) -> List[Tuple[int, str]]:
+    """
+    Uncompacted partitions whose whole day is older than cutoff_ms
+    """
+
+    return conn.execute(
+        """
+        SELECT day, name FROM event_partitions
+        WHERE compacted = 0 AND day + ? <= ?
+        ORDER BY day
+        """,
+        (DAY_MS, cutoff_ms),
+    ).fetchall()
+
+
+def list_partitions(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+    """
+    Partitions with their row counts, read from the day rollups (one
+    bucket per partition) instead of counting every table
+    """
+
+    partitions = []
+    for day, name, compacted, rows in conn.execute(
+        """
+        SELECT p.day, p.name, p.compacted, COALESCE(SUM(r.count), 0)
+        FROM event_partitions p
+        LEFT JOIN rollup_day r ON r.bucket = p.day
+        GROUP BY p.day
+        ORDER BY p.day
+        """
+    ).fetchall():
+        partitions.append(
+            {
+                "name": name,
+                "day": datetime.fromtimestamp(day / 1000, timezone.utc)
+                .date()
+                .isoformat(),
+                "rows": rows,
+                "compacted": bool(compacted),
+            }
+        )
+    return partitions
@@ -0,0 +1,224 @@
+import heapq
+import sqlite3
+from bisect import bisect_left
+from itertools import groupby
+from operator import itemgetter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from partitions import partition_tables
+
+# Events per path kept in the prefix trie
+DEFAULT_PATH_DEPTH = 5
+MAX_PATH_DEPTH = 10
+MAX_PATHS = 100
+
+# Upper bounds in seconds of the time-to-convert histogram buckets
+CONVERT_BUCKETS = (10, 30, 60, 300, 900, 1800, 3600, 6 * 3600, 86400, 7 * 86400)
+
+# (timestamp in ms, event type) in time order
+Stream = List[Tuple[int, str]]
+
+
+def user_streams(
+    conn: sqlite3.Connection,
+    start_ms: Optional[int] = None,
+    end_ms: Optional[int] = None,
+) -> Iterator[Tuple[str, Stream]]:
+    """
+    (user_id, events) for every identified user, one user at a time.
+
+    Each partition is read in (user_id, ts) index order and the partitions
+    are merged on that key, so a user's events arrive contiguously and in
+    time order even when they span several days.
+    """
+
+    names = dict(conn.execute("SELECT id, name FROM event_types"))
+    conditions = ["user_id IS NOT NULL"]
+    params: List[Any] = []
+    if start_ms is not None:
+        conditions.append("ts >= ?")
+        params.append(start_ms)
+    if end_ms is not None:
+        conditions.append("ts < ?")
+        params.append(end_ms)
+
+    cursors = [
+        conn.execute(
+            f"""
+            SELECT user_id, ts, event_type_id
+            FROM {table}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY user_id, ts, id
+            """,
+            params,
+        )
+        for table in partition_tables(conn, start_ms, end_ms)
+    ]
+    rows = heapq.merge(*cursors, key=itemgetter(0, 1))
+    for user_id, events in groupby(rows, key=itemgetter(0)):
+        yield user_id, [
+            (ts, names.get(type_id, str(type_id))) for _, ts, type_id in events
+        ]
+
+
+class Histogram:
+    """
+    Counts of durations per CONVERT_BUCKETS bucket, plus one overflow bucket
+    """
+
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(CONVERT_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(CONVERT_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        bounds = list(CONVERT_BUCKETS) + [None]
+        return {
+            "count": self.count,
+            "mean_seconds": round(self.total / self.count, 1) if self.count else None,
+            "buckets": [
+                {"le_seconds": bound, "count": count}
+                for bound, count in zip(bounds, self.counts)
+            ],
+        }
+
+
+class OrderedFunnel:
+    """
+    Strictly ordered funnel: a user reaches step N only through events of
+    steps 0..N in that order, each within max_gap_ms of the previous one.
+
+    For every step the most recent chain ending there is kept; a later
+    chain can always be extended wherever an earlier one could, so this is
+    the furthest any ordering of the user's events reaches. Times between
+    steps are measured along that chain.
+    """
+
+    def __init__(self, steps: List[str], max_gap_ms: Optional[int] = None):
+        self.steps = list(steps)
+        self.max_gap_ms = max_gap_ms
+        # Event type -> its step indexes, last first, so one event never
+        # advances two steps of a funnel that repeats a type
+        self._indexes: Dict[str, List[int]] = {}
+        for i, step in enumerate(self.steps):
+            self._indexes.setdefault(step, []).insert(0, i)
+        self.counts = [0] * len(self.steps)
+        self.step_times = [Histogram() for _ in self.steps[1:]]
+        self.total_time = Histogram()
+
+    def add_user(self, events: Stream):
+        chains: List[Optional[Tuple[int, ...]]] = [None] * len(self.steps)
+        for ts, event_type in events:
+            for i in self._indexes.get(event_type, ()):
+                if i == 0:
+                    chains[0] = (ts,)
+                    continue
+                previous = chains[i - 1]
+                if previous is None:
+                    continue
+                if self.max_gap_ms is not None and ts - previous[-1] > self.max_gap_ms:
+                    continue
+                chains[i] = previous + (ts,)
+
+        furthest = max((i for i, chain in enumerate(chains) if chain), default=-1)
+        if furthest < 0:
+            return
+        for i in range(furthest + 1):
+            self.counts[i] += 1
+
+        chain = chains[furthest]
+        for i in range(furthest):
+            self.step_times[i].observe((chain[i + 1] - chain[i]) / 1000)
+        if furthest == len(self.steps) - 1 and furthest > 0:
+            self.total_time.observe((chain[-1] - chain[0]) / 1000)
+
+    def to_dict(self) -> Dict[str, Any]:
+        funnel_counts = dict(zip(self.steps, self.counts))
+        total_users = self.counts[0] if self.counts else 0
+        conversion_rates = {}
+        if total_users > 0:
+            conversion_rates = {
+                step: round((count / total_users) * 100, 1)
+                for step, count in funnel_counts.items()
+            }
+
+        return {
+            "funnel_counts": funnel_counts,
+            "conversion_rates": conversion_rates,
+            "total_users": total_users,
+            "steps": self.steps,
+            "max_gap_seconds": (
+                self.max_gap_ms // 1000 if self.max_gap_ms is not None else None
+            ),
+            "time_to_convert": {
+                "steps": [
+                    {"from": a, "to": b, **histogram.to_dict()}
+                    for a, b, histogram in zip(
+                        self.steps, self.steps[1:], self.step_times
+                    )
+                ],
+                "total": self.total_time.to_dict(),
+            },
+        }
+
+
+class PathTrie:
+    """
+    Prefix tree of the first `depth` event types of each user's stream,
+    with repeats of the same type collapsed. Every node counts the users
+    whose path starts with its prefix and those whose path ends there.
+    """
+
+    def __init__(self, depth: int = DEFAULT_PATH_DEPTH):
+        self.depth = depth
+        # node: [users through it, users ending at it, children by type]
+        self.root: List[Any] = [0, 0, {}]
+
+    def add_user(self, events: Stream):
+        node = self.root
+        node[0] += 1
+        length = 0
+        previous = None
+        for _, event_type in events:
+            if event_type == previous:
+                continue
+            if length == self.depth:
+                break
+            previous = event_type
+            node = node[2].setdefault(event_type, [0, 0, {}])
+            node[0] += 1
+            length += 1
+        node[1] += 1
+
+    def top(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        The `limit` paths followed by the most users, with how many users
+        went on to longer paths from each
+        """
+
+        paths = []
+        stack = [((), self.root)]
+        while stack:
+            prefix, (through, ending, children) = stack.pop()
+            if prefix and ending:
+                paths.append((ending, through, prefix))
+            stack.extend((prefix + (name,), child) for name, child in children.items())
+
+        paths.sort(key=lambda path: (-path[0], path[2]))
+        users = self.root[0]
+        return [
+            {
+                "path": list(prefix),
+                "users": ending,
+                "share": round(ending / users * 100, 1),
+                "continued": through - ending,
+            }
+            for ending, through, prefix in paths[:limit]
+        ]
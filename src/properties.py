@@ -0,0 +1,226 @@
+import os
+import re
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Data fields extracted at ingest into each partition's _props table, as
+# comma-separated event_type.key[:kind]; kind is text (default) or number
+INDEXED_PROPERTIES = os.environ.get(
+    "INDEXED_PROPERTIES",
+    "page_view.page,"
+    "product_view.product,product_view.price:number,"
+    "add_to_cart.product,add_to_cart.quantity:number,"
+    "purchase.product,purchase.amount:number,purchase.payment,"
+    "user_signup.method",
+)
+PROPERTY_KINDS = ("text", "number")
+
+MAX_PROPERTY_GROUPS = 1000
+
+_KEY_PATTERN = re.compile(r"^[A-Za-z0-9_]+$")
+
+# Values per group while merging partitions: count, events with the
+# metric, then the metric's sum, min and max
+Totals = List[Any]
+
+
+def parse_declarations(spec: str) -> List[Tuple[str, str, str]]:
+    """
+    (event_type, key, kind) for each entry of an INDEXED_PROPERTIES string
+    """
+
+    declarations = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, kind = entry.partition(":")
+        event_type, _, key = name.rpartition(".")
+        kind = kind or "text"
+        if not event_type or not _KEY_PATTERN.match(key):
+            raise ValueError(
+                f"Invalid indexed property '{entry}', expected event_type.key[:kind]"
+            )
+        if kind not in PROPERTY_KINDS:
+            raise ValueError(
+                f"Unknown property kind '{kind}', "
+                f"expected one of {', '.join(PROPERTY_KINDS)}"
+            )
+        declarations.append((event_type, key, kind))
+    return declarations
+
+
+def create_property_registry(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS event_properties (
+            id INTEGER PRIMARY KEY,
+            event_type_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            backfilled INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (event_type_id, key)
+        )
+        """
+    )
+
+
+def register_property(
+    conn: sqlite3.Connection, event_type_id: int, key: str, kind: str
+) -> int:
+    """
+    Id of a declared property, (re)registering it if it is new or its kind
+    changed; values stored under an old kind are discarded (writer only)
+    """
+
+    row = conn.execute(
+        "SELECT id, kind FROM event_properties WHERE event_type_id = ? AND key = ?",
+        (event_type_id, key),
+    ).fetchone()
+    if row is None:
+        return conn.execute(
+            "INSERT INTO event_properties (event_type_id, key, kind) VALUES (?, ?, ?)",
+            (event_type_id, key, kind),
+        ).lastrowid
+
+    property_id, stored_kind = row
+    if stored_kind != kind:
+        for (name,) in conn.execute("SELECT name FROM event_partitions").fetchall():
+            conn.execute(
+                f"DELETE FROM {name}_props WHERE property_id = ?", (property_id,)
+            )
+        conn.execute(
+            "UPDATE event_properties SET kind = ?, backfilled = 0 WHERE id = ?",
+            (kind, property_id),
+        )
+    return property_id
+
+
+def coerce_value(kind: str, value: Any) -> Optional[Any]:
+    """
+    The stored form of a data field, or None if it does not fit the kind
+    """
+
+    if isinstance(value, bool):
+        return None
+    if kind == "number":
+        return float(value) if isinstance(value, (int, float)) else None
+    if isinstance(value, (str, int)):
+        return str(value)
+    return None
+
+
+def extract_properties(
+    declared: Iterable[Tuple[int, str, str]], data: Optional[Dict[str, Any]]
+) -> List[Tuple[int, Any]]:
+    """
+    (property_id, value) for each declared (property_id, key, kind) present
+    in data
+    """
+
+    if not data:
+        return []
+    values = []
+    for property_id, key, kind in declared:
+        if key in data:
+            value = coerce_value(kind, data[key])
+            if value is not None:
+                values.append((property_id, value))
+    return values
+
+
+def backfill_property(
+    conn: sqlite3.Connection,
+    table: str,
+    property_id: int,
+    event_type_id: int,
+    key: str,
+    kind: str,
+):
+    """
+    Extract one property from the events already stored in a partition
+    """
+
+    # Same acceptance rules as coerce_value, in SQL
+    if kind == "number":
+        types, cast = "'integer', 'real'", "REAL"
+    else:
+        types, cast = "'text', 'integer'", "TEXT"
+    path = f'$."{key}"'
+    conn.execute(
+        f"""
+        INSERT OR IGNORE INTO {table}_props (event_id, property_id, ts, value)
+        SELECT id, ?, ts, CAST(json_extract(data, ?) AS {cast})
+        FROM {table}
+        WHERE event_type_id = ? AND json_type(data, ?) IN ({types})
+        """,
+        (property_id, path, event_type_id, path),
+    )
+
+
+def aggregate_property(
+    conn: sqlite3.Connection,
+    table: str,
+    group_id: int,
+    metric_id: Optional[int],
+    filters: List[Tuple[int, Any]],
+    start_ms: Optional[int],
+    end_ms: Optional[int],
+    groups: Dict[Any, Totals],
+):
+    """
+    Add one partition's per-value counts and metric totals to groups.
+
+    Every lookup is an index range scan on (property_id, value, ts) or the
+    (event_id, property_id) primary key; event data is never read.
+    """
+
+    props = f"{table}_props"
+    joins = []
+    params: List[Any] = []
+    if metric_id is not None:
+        joins.append(
+            f"LEFT JOIN {props} m ON m.event_id = g.event_id AND m.property_id = ?"
+        )
+        params.append(metric_id)
+    for i, (property_id, value) in enumerate(filters):
+        joins.append(
+            f"""
+            JOIN {props} f{i} ON f{i}.event_id = g.event_id
+                AND f{i}.property_id = ? AND f{i}.value = ?
+            """
+        )
+        params.extend([property_id, value])
+
+    conditions = ["g.property_id = ?"]
+    params.append(group_id)
+    if start_ms is not None:
+        conditions.append("g.ts >= ?")
+        params.append(start_ms)
+    if end_ms is not None:
+        conditions.append("g.ts < ?")
+        params.append(end_ms)
+
+    metric = "m.value" if metric_id is not None else "NULL"
+    for value, count, measured, total, low, high in conn.execute(
+        f"""
+        SELECT
+            g.value, COUNT(*), COUNT({metric}),
+            SUM({metric}), MIN({metric}), MAX({metric})
+        FROM {props} g
+        {' '.join(joins)}
+        WHERE {' AND '.join(conditions)}
+        GROUP BY g.value
+        """,
+        params,
+    ):
+        totals = groups.get(value)
+        if totals is None:
+            groups[value] = [count, measured, total, low, high]
+            continue
+        totals[0] += count
+        totals[1] += measured
+        if total is not None:
+            totals[2] = total if totals[2] is None else totals[2] + total
+            totals[3] = low if totals[3] is None else min(totals[3], low)
+            totals[4] = high if totals[4] is None else max(totals[4], high)
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+from json_codec import dumps
+
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "256"))
+# Bounds staleness of time-dependent results (events_last_hour, funnel
+# windows, alert expiry) that change without any new event arriving
+RESULT_CACHE_TTL_SECONDS = float(os.environ.get("RESULT_CACHE_TTL_SECONDS", "5"))
+
+
+class CachedResult:
+    __slots__ = ("value", "body", "etag", "generation", "created")
+
+    def __init__(self, value: Any, generation: int, created: float):
+        self.value = value
+        self.body = dumps(value)
+        self.etag = f'"{hashlib.blake2b(self.body, digest_size=16).hexdigest()}"'
+        self.generation = generation
+        self.created = created
+
+
+class ResultCache:
+    """
+    LRU cache of read endpoint results, invalidated by ingest.
+
+    Every write bumps the generation; entries computed under an older
+    generation are treated as misses. The serialized body and its ETag are
+    kept with the entry so hits cost no recomputation or re-encoding.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = RESULT_CACHE_TTL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, CachedResult]" = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def invalidate(self):
+        """
+        Mark every cached result as out of date
+        """
+
+        with self._lock:
+            self.generation += 1
+
+    def get(self, key: Hashable, compute: Callable[[], Any]) -> CachedResult:
+        """
+        Cached result for key, computing and storing it on a miss
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if (
+                    entry.generation == self.generation
+                    and now - entry.created < self.ttl
+                ):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                del self._entries[key]
+                self.stale += 1
+            self.misses += 1
+            generation = self.generation
+
+        entry = CachedResult(compute(), generation, now)
+
+        with self._lock:
+            # A write that landed while computing makes the result stale
+            if generation == self.generation:
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return entry
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "generation": self.generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+result_cache = ResultCache()
@@ -0,0 +1,92 @@
+import sqlite3
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+# Bucket width in milliseconds for each rollup table
+GRANULARITIES = {
+    "minute": 60 * 1000,
+    "hour": 60 * 60 * 1000,
+    "day": 24 * 60 * 60 * 1000,
+}
+
+ROLLUP_TABLES = {name: f"rollup_{name}" for name in GRANULARITIES}
+
+# Only purchases contribute data.amount to revenue
+REVENUE_EVENT_TYPE = "purchase"
+
+MAX_TIMESERIES_POINTS = 2000
+
+
+def event_amount(event_type: str, data: Optional[Dict[str, Any]]) -> float:
+    """
+    Revenue carried by an event, 0 for non-purchases or missing amounts
+    """
+
+    if event_type != REVENUE_EVENT_TYPE or not data:
+        return 0.0
+    amount = data.get("amount")
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)):
+        return 0.0
+    return float(amount)
+
+
+def record_rollups(conn: sqlite3.Connection, rows: Iterable[Tuple[int, int, float]]):
+    """
+    Add (ts_ms, event_type_id, amount) rows to every rollup table.
+
+    Rows are pre-aggregated per bucket so a batch costs one upsert per
+    distinct (bucket, event type) rather than one per event.
+    """
+
+    rows = list(rows)
+    for granularity, width in GRANULARITIES.items():
+        buckets: Dict[Tuple[int, int], List[float]] = {}
+        for ts, type_id, amount in rows:
+            key = (ts - ts % width, type_id)
+            totals = buckets.get(key)
+            if totals is None:
+                buckets[key] = [1, amount]
+            else:
+                totals[0] += 1
+                totals[1] += amount
+
+        conn.executemany(
+            f"""
+            INSERT INTO {ROLLUP_TABLES[granularity]}
+                (bucket, event_type_id, count, revenue)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (bucket, event_type_id) DO UPDATE SET
+                count = count + excluded.count,
+                revenue = revenue + excluded.revenue
+            """,
+            [(b, t, c, r) for (b, t), (c, r) in buckets.items()],
+        )
+
+
+def clear_rollups(conn: sqlite3.Connection):
+    for table in ROLLUP_TABLES.values():
+        conn.execute(f"DELETE FROM {table}")
+
+
+def query_timeseries(
+    conn: sqlite3.Connection,
+    granularity: str,
+    start_ms: int,
+    end_ms: int,
+    event_type_ids: Optional[List[int]] = None,
+) -> List[Tuple[int, int, int, float]]:
+    """
+    (bucket, event_type_id, count, revenue) rows in [start_ms, end_ms)
+    """
+
+    sql = f"""
+        SELECT bucket, event_type_id, count, revenue
+        FROM {ROLLUP_TABLES[granularity]}
+        WHERE bucket >= ? AND bucket < ?
+    """
+    params: List[Any] = [start_ms, end_ms]
+    if event_type_ids is not None:
+        sql += f" AND event_type_id IN ({','.join('?' for _ in event_type_ids)})"
+        params.extend(event_type_ids)
+    sql += " ORDER BY bucket"
+
+    return conn.execute(sql, params).fetchall()
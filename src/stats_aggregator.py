@@ -0,0 +1,129 @@
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Iterable, Optional
+
+from partitions import partition_tables
+
+WINDOW_SECONDS = 3600
+
+
+class StatsAggregator:
+    """
+    Running totals behind /stats, updated on every insert.
+
+    The "last hour" count is a ring buffer of per-second buckets; expired
+    buckets are subtracted as time advances, so reads and writes are O(1)
+    amortized.
+    """
+
+    def __init__(self, window_seconds: int = WINDOW_SECONDS):
+        self.window = window_seconds
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self.total_events = 0
+        self.event_types: Dict[str, int] = {}
+        self.users = set()
+        self._buckets = [0] * self.window
+        self._window_total = 0
+        self._last_second = int(time.time())
+
+    def _advance(self, now: int):
+        elapsed = now - self._last_second
+        if elapsed <= 0:
+            return
+
+        if elapsed >= self.window:
+            self._buckets = [0] * self.window
+            self._window_total = 0
+        else:
+            for second in range(self._last_second + 1, now + 1):
+                slot = second % self.window
+                self._window_total -= self._buckets[slot]
+                self._buckets[slot] = 0
+        self._last_second = now
+
+    def _add(self, event_type: str, user_id: Optional[str]):
+        self.total_events += 1
+        self.event_types[event_type] = self.event_types.get(event_type, 0) + 1
+        if user_id is not None:
+            self.users.add(user_id)
+
+    def record_many(self, events: Iterable, at: Optional[float] = None):
+        """
+        Count a batch of events inserted at the same moment
+        """
+
+        now = int(at if at is not None else time.time())
+        with self._lock:
+            self._advance(now)
+            count = 0
+            for event in events:
+                self._add(event.event_type, event.user_id)
+                count += 1
+            self._buckets[now % self.window] += count
+            self._window_total += count
+
+    def seed(self, conn: sqlite3.Connection):
+        """
+        Load the current totals from the event partitions.
+
+        The lock is held throughout, so batches recorded meanwhile wait and
+        are added on top of the loaded totals instead of being overwritten.
+        """
+
+        with self._lock:
+            self._clear()
+            now = self._last_second
+            since_ms = (now - self.window) * 1000
+            for table in partition_tables(conn):
+                for name, count in conn.execute(
+                    f"""
+                    SELECT et.name, COUNT(*)
+                    FROM {table} e
+                    JOIN event_types et ON et.id = e.event_type_id
+                    GROUP BY e.event_type_id
+                    """
+                ):
+                    self.event_types[name] = self.event_types.get(name, 0) + count
+                self.users.update(
+                    row[0]
+                    for row in conn.execute(
+                        f"""
+                        SELECT DISTINCT user_id FROM {table}
+                        WHERE user_id IS NOT NULL
+                        """
+                    )
+                )
+            self.total_events = sum(self.event_types.values())
+
+            for table in partition_tables(conn, start_ms=since_ms):
+                for second, count in conn.execute(
+                    f"SELECT ts / 1000, COUNT(*) FROM {table} WHERE ts > ? GROUP BY 1",
+                    (since_ms,),
+                ):
+                    if now - second < self.window:
+                        self._buckets[second % self.window] += count
+                        self._window_total += count
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Current stats in the same shape as the original SQL-based get_stats
+        """
+
+        with self._lock:
+            self._advance(int(time.time()))
+            return {
+                "total_events": self.total_events,
+                "unique_users": len(self.users),
+                "events_last_hour": self._window_total,
+                "event_types": dict(
+                    sorted(self.event_types.items(), key=lambda x: x[1], reverse=True)
+                ),
+            }
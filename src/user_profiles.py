@@ -0,0 +1,188 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Dict, Any, Iterable, Optional
+
+from partitions import partition_tables
+
+SEGMENTS = ["high_intent", "medium_intent", "low_intent", "converted"]
+
+
+class UserProfile:
+    """
+    Compact per-user state; event types seen are stored as a bitmask
+    """
+
+    __slots__ = ("total_events", "flags", "last_event", "last_seen", "intent")
+
+    def __init__(self):
+        self.total_events = 0
+        self.flags = 0
+        self.last_event = None
+        self.last_seen = 0
+        self.intent = None
+
+
+class UserProfileStore:
+    """
+    Per-user profiles and segment membership, updated on ingest.
+
+    A user's intent is reclassified only when one of their events arrives,
+    and each segment is an insertion-ordered dict of user ids so that
+    membership can be paged through without rebuilding journeys.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bits: Dict[str, int] = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._profiles: Dict[str, UserProfile] = {}
+        self._segments: Dict[str, Dict[str, None]] = {s: {} for s in SEGMENTS}
+
+    def bit(self, event_type: str) -> int:
+        """
+        Flag bit for an event type, allocated on first sight
+        """
+
+        bit = self._bits.get(event_type)
+        if bit is None:
+            bit = 1 << len(self._bits)
+            self._bits[event_type] = bit
+        return bit
+
+    def has(self, flags: int, event_type: str) -> bool:
+        return bool(flags & self._bits.get(event_type, 0))
+
+    def classify(self, flags: int, total_events: int) -> str:
+        """
+        Rule-based intent from which event types a user has produced
+        """
+
+        if self.has(flags, "purchase"):
+            return "converted"
+
+        if self.has(flags, "add_to_cart"):
+            if total_events >= 5:
+                return "high_intent"
+            else:
+                return "medium_intent"
+
+        if self.has(flags, "product_view"):
+            if total_events >= 3:
+                return "medium_intent"
+            else:
+                return "low_intent"
+
+        return "low_intent"
+
+    def _record(self, event_type: str, user_id: Optional[str], at: int):
+        if user_id is None:
+            return
+
+        profile = self._profiles.get(user_id)
+        if profile is None:
+            profile = UserProfile()
+            self._profiles[user_id] = profile
+
+        profile.total_events += 1
+        profile.flags |= self.bit(event_type)
+        profile.last_event = event_type
+        profile.last_seen = at
+
+        intent = self.classify(profile.flags, profile.total_events)
+        if intent != profile.intent:
+            if profile.intent is not None:
+                del self._segments[profile.intent][user_id]
+            self._segments[intent][user_id] = None
+            profile.intent = intent
+
+    def record_many(self, events: Iterable, at: Optional[float] = None):
+        """
+        Update profiles with newly ingested events
+        """
+
+        at = int(at if at is not None else time.time())
+        with self._lock:
+            for event in events:
+                self._record(event.event_type, event.user_id, at)
+
+    def seed(self, conn: sqlite3.Connection):
+        """
+        Rebuild all profiles with one pass over the event partitions.
+
+        The lock is held from the reset to the last partition, so batches
+        recorded meanwhile wait for the seed instead of landing in between.
+        """
+
+        with self._lock:
+            self._clear()
+            for table in partition_tables(conn):
+                cursor = conn.execute(
+                    f"""
+                    SELECT et.name, e.user_id, e.ts / 1000
+                    FROM {table} e
+                    JOIN event_types et ON et.id = e.event_type_id
+                    WHERE e.user_id IS NOT NULL
+                    ORDER BY e.id
+                    """
+                )
+                for event_type, user_id, at in cursor:
+                    self._record(event_type, user_id, at or 0)
+
+    def _entry(self, user_id: str) -> Dict[str, Any]:
+        profile = self._profiles[user_id]
+        return {
+            "user_id": user_id,
+            "total_events": profile.total_events,
+            "last_event": profile.last_event,
+            "last_seen": datetime.fromtimestamp(
+                profile.last_seen, timezone.utc
+            ).isoformat(),
+        }
+
+    def get_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            profile = self._profiles.get(user_id)
+            if profile is None:
+                return None
+            entry = self._entry(user_id)
+            entry["intent"] = profile.intent
+            entry["event_types"] = [
+                event_type
+                for event_type, bit in self._bits.items()
+                if profile.flags & bit
+            ]
+            return entry
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {segment: len(users) for segment, users in self._segments.items()}
+
+    def page(self, segment: str, offset: int = 0, limit: int = 50) -> Dict[str, Any]:
+        """
+        One page of a segment's members, oldest classification first
+        """
+
+        if segment not in self._segments:
+            raise ValueError(
+                f"Unknown segment '{segment}', expected one of {', '.join(SEGMENTS)}"
+            )
+
+        with self._lock:
+            members = self._segments[segment]
+            user_ids = islice(members, offset, offset + limit)
+            return {
+                "segment": segment,
+                "users": [self._entry(user_id) for user_id in user_ids],
+                "total": len(members),
+                "offset": offset,
+                "limit": limit,
+            }
@@ -1,58 +1,323 @@
-from typing import List
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Set
 from fastapi import WebSocket
-import json
+from metrics import ws_broadcast_seconds, ws_queue_depth
+from json_codec import dumps_str
+import asyncio
+import os
 
+MAX_BATCH_EVENTS = 20
 
-class WebSocketManager:
+SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE", "256"))
+
+# What to do when a client's send queue is full:
+#   drop_oldest - discard the oldest queued message
+#   coalesce    - discard queued state updates and send fresh snapshots instead
+#   disconnect  - close the connection
+SLOW_CONSUMER_POLICY = os.environ.get("WS_SLOW_CONSUMER_POLICY", "drop_oldest")
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+TOPICS = ["events", "stats", "funnel", "segmentation", "anomalies", "top"]
+
+# Topics whose state is versioned and delta-encoded; "events" is a plain feed
+SNAPSHOT_TOPICS = ["stats", "funnel", "segmentation", "anomalies", "top"]
+
+
+def merge_diff(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    JSON merge patch (RFC 7386) turning old into new; lists are replaced whole
+    """
+
+    patch = {}
+    for key in old:
+        if key not in new:
+            patch[key] = None
+
+    for key, value in new.items():
+        if key in old:
+            previous = old[key]
+            if isinstance(value, dict) and isinstance(previous, dict):
+                nested = merge_diff(previous, value)
+                if nested:
+                    patch[key] = nested
+                continue
+            if previous == value:
+                continue
+        patch[key] = value
+
+    return patch
+
+
+class TopicState:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.version = 0
+        self.data: Optional[Dict[str, Any]] = None
+
+
+class ClientConnection:
+    """
+    A connected socket with its own bounded outbound queue and sender task
+    """
+
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket
+        self.topics: Set[str] = set()
+        # Entries are (topic, message_str); topic is None for direct replies
+        self.queue = deque()
+        self.queue_size = queue_size
+        self.stale_topics: Set[str] = set()
+        self.ready = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.dropped = 0
+
+
+class WebSocketManager:
+    def __init__(
+        self,
+        queue_size: int = SEND_QUEUE_SIZE,
+        policy: str = SLOW_CONSUMER_POLICY,
+    ):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(
+                f"Unknown slow consumer policy '{policy}', "
+                f"expected one of {', '.join(SLOW_CONSUMER_POLICIES)}"
+            )
+
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self.topics: Dict[str, TopicState] = {t: TopicState() for t in SNAPSHOT_TOPICS}
+        self.queue_size = queue_size
+        self.policy = policy
+        self.messages_dropped = 0
+        self.slow_disconnects = 0
+
+    @property
+    def active_connections(self):
+        return self.clients.keys()
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
-        print(f"WebSocket connected. Total connections: {len(self.active_connections)}")
+        # Topics are added once the client has been sent its initial state
+        client = ClientConnection(websocket, self.queue_size)
+        client.task = asyncio.create_task(self._sender(client))
+        self.clients[websocket] = client
+        print(f"WebSocket connected. Total connections: {len(self.clients)}")
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-        print(
-            f"WebSocket disconnected. Total connections: {len(self.active_connections)}"
-        )
+        client = self.clients.pop(websocket, None)
+        if client is not None and client.task is not None:
+            if client.task is not asyncio.current_task():
+                client.task.cancel()
+        print(f"WebSocket disconnected. Total connections: {len(self.clients)}")
 
-    async def send_to_all(self, message: dict):
+    async def _sender(self, client: ClientConnection):
         """
-        Send a message to all connected clients.
+        Drain one client's queue so a slow socket only delays itself
         """
 
-        if not self.active_connections:
+        websocket = client.websocket
+        try:
+            while True:
+                await client.ready.wait()
+                client.ready.clear()
+
+                while client.stale_topics or client.queue:
+                    if client.stale_topics:
+                        topic = client.stale_topics.pop()
+                        message = self._snapshot_message(topic)
+                        if message is None:
+                            continue
+                        message_str = dumps_str(message)
+                    else:
+                        _, message_str = client.queue.popleft()
+                    await websocket.send_text(message_str)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error sending to WebSocket: {e}")
+            self.disconnect(websocket)
+
+    def _enqueue(
+        self, client: ClientConnection, topic: Optional[str], message_str: str
+    ):
+        if topic in client.stale_topics:
+            # A fresh snapshot is already pending for this topic
             return
 
-        message_str = json.dumps(message)
-        disconnected = []
+        if len(client.queue) >= client.queue_size:
+            if self.policy == "disconnect":
+                self.slow_disconnects += 1
+                self.disconnect(client.websocket)
+                asyncio.create_task(self._close(client.websocket))
+                return
+
+            if self.policy == "coalesce" and topic in self.topics:
+                # Replace queued state updates with one snapshot per topic
+                kept = deque()
+                for queued_topic, queued in client.queue:
+                    if queued_topic in self.topics:
+                        client.stale_topics.add(queued_topic)
+                        client.dropped += 1
+                        self.messages_dropped += 1
+                    else:
+                        kept.append((queued_topic, queued))
+                client.queue = kept
+                client.stale_topics.add(topic)
+                client.ready.set()
+                return
+
+            client.queue.popleft()
+            client.dropped += 1
+            self.messages_dropped += 1
+
+        client.queue.append((topic, message_str))
+        client.ready.set()
+        ws_queue_depth.observe(len(client.queue))
+
+    @staticmethod
+    async def _close(websocket: WebSocket):
+        try:
+            await websocket.close(code=1008)
+        except Exception:
+            pass
+
+    async def send_to_topic(self, topic: str, message: dict):
+        """
+        Send a message to clients subscribed to a topic
+        """
+
+        clients = [c for c in list(self.clients.values()) if topic in c.topics]
+        if clients:
+            with ws_broadcast_seconds.labels(topic).time():
+                message_str = dumps_str(message)
+                for client in clients:
+                    self._enqueue(client, topic, message_str)
+
+    async def send_personal(self, websocket: WebSocket, message: dict):
+        """
+        Queue a message for a single client, in order with broadcasts
+        """
+
+        client = self.clients.get(websocket)
+        if client is not None:
+            self._enqueue(client, None, dumps_str(message))
+
+    def _snapshot_message(self, topic: str) -> Optional[dict]:
+        state = self.topics[topic]
+        if state.data is None:
+            return None
+        return {
+            "type": "snapshot",
+            "topic": topic,
+            "version": state.version,
+            "data": state.data,
+        }
+
+    async def publish(self, topic: str, data: Dict[str, Any]):
+        """
+        Update a topic's snapshot and send subscribers only what changed
+        """
+
+        state = self.topics[topic]
+        if state.data is None:
+            state.version += 1
+            state.data = data
+            message = self._snapshot_message(topic)
+        else:
+            patch = merge_diff(state.data, data)
+            if not patch:
+                return
+            state.version += 1
+            state.data = data
+            message = {
+                "type": "patch",
+                "topic": topic,
+                "base": state.version - 1,
+                "version": state.version,
+                "patch": patch,
+            }
+
+        await self.send_to_topic(topic, message)
+
+    async def send_snapshots(self, websocket: WebSocket, topics: Iterable[str]):
+        """
+        Send the current full snapshot of each topic to one client
+        """
+
+        for topic in topics:
+            if topic not in self.topics:
+                continue
+            message = self._snapshot_message(topic)
+            if message is not None:
+                await self.send_personal(websocket, message)
+
+    async def handle_message(self, websocket: WebSocket, message: Dict[str, Any]):
+        """
+        Handle subscribe, unsubscribe and resync requests from a client
+        """
+
+        message_type = message.get("type")
+        topics = [t for t in message.get("topics", []) if t in TOPICS]
+        client = self.clients.get(websocket)
+        if client is None:
+            return
+        subscribed = client.topics
+
+        if message_type == "subscribe":
+            new_topics = [t for t in topics if t not in subscribed]
+            subscribed.update(topics)
+            await self.send_snapshots(websocket, new_topics)
+        elif message_type == "unsubscribe":
+            subscribed.difference_update(topics)
+        elif message_type == "resync":
+            await self.send_snapshots(websocket, [t for t in topics if t in subscribed])
+
+    @staticmethod
+    def event_update_message(event_data: dict) -> dict:
+        return {"type": "new_event", "data": event_data}
+
+    @staticmethod
+    def batch_update_message(events_data: List[dict]) -> dict:
+        """
+        A single coalesced update for a batch of events
+        """
 
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message_str)
-            except Exception as e:
-                print(f"Error sending to WebSocket: {e}")
-                disconnected.append(connection)
+        event_counts = {}
+        for event in events_data:
+            event_type = event["event_type"]
+            event_counts[event_type] = event_counts.get(event_type, 0) + 1
 
-        for connection in disconnected:
-            self.disconnect(connection)
+        return {
+            "type": "new_events",
+            "data": {
+                "count": len(events_data),
+                "event_counts": event_counts,
+                # Clients only display the most recent rows
+                "events": events_data[-MAX_BATCH_EVENTS:],
+            },
+        }
 
-    async def send_event_update(self, event_data: dict):
+    def get_stats(self) -> Dict[str, Any]:
         """
-        Send real-time event update to all clients
+        Fan-out queue depth and slow-consumer counters
         """
 
-        await self.send_to_all({"type": "new_event", "data": event_data})
+        depths = [len(client.queue) for client in self.clients.values()]
+        return {
+            "connections": len(self.clients),
+            "queue_size": self.queue_size,
+            "slow_consumer_policy": self.policy,
+            "queued_messages": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "messages_dropped": self.messages_dropped,
+            "slow_disconnects": self.slow_disconnects,
+        }
 
     async def send_stats_update(self, stats_data: dict):
         """
         Send updated statistics to all clients
         """
 
-        await self.send_to_all({"type": "stats_update", "data": stats_data})
+        await self.publish("stats", stats_data)
 
 
 websocket_manager = WebSocketManager()
@@ -13,6 +13,12 @@ function connectWebSocket() {
 		console.log("WebSocket connected");
 		isConnected = true;
 		updateConnectionStatus(true);
+
+		// Versions restart from whatever the server sends on this connection
+		topicState = {};
+		websocket.send(
+			JSON.stringify({ type: "subscribe", topics: SUBSCRIBED_TOPICS })
+		);
 	};
 
 	websocket.onmessage = function (event) {
@@ -34,39 +40,112 @@ function connectWebSocket() {
 	};
 }
 
+// Topics this dashboard renders; state topics arrive as versioned snapshots
+// followed by merge patches
+const SUBSCRIBED_TOPICS = [
+	"events",
+	"stats",
+	"funnel",
+	"segmentation",
+	"anomalies",
+	"top",
+];
+let topicState = {};
+
+function applyMergePatch(target, patch) {
+	if (patch === null || typeof patch !== "object" || Array.isArray(patch)) {
+		return patch;
+	}
+	const result =
+		target !== null && typeof target === "object" && !Array.isArray(target)
+			? { ...target }
+			: {};
+	Object.keys(patch).forEach((key) => {
+		if (patch[key] === null) {
+			delete result[key];
+		} else {
+			result[key] = applyMergePatch(result[key], patch[key]);
+		}
+	});
+	return result;
+}
+
+function renderTopic(topic, topicData) {
+	switch (topic) {
+		case "stats":
+			updateStats(topicData);
+			// Refresh charts with new data
+			loadFullData();
+			break;
+
+		case "funnel":
+			updateFunnel(topicData);
+			break;
+
+		case "segmentation":
+			updateSegmentation(topicData);
+			break;
+
+		case "anomalies":
+			updateAnomalies(topicData);
+			break;
+
+		case "top":
+			updateTopItems(topicData);
+			break;
+	}
+}
+
+function handleSnapshot(data) {
+	topicState[data.topic] = { version: data.version, data: data.data };
+	renderTopic(data.topic, data.data);
+}
+
+function handlePatch(data) {
+	const state = topicState[data.topic];
+	if (!state || state.version !== data.base) {
+		// Missed an update; ask for a fresh snapshot
+		websocket.send(JSON.stringify({ type: "resync", topics: [data.topic] }));
+		return;
+	}
+
+	state.data = applyMergePatch(state.data, data.patch);
+	state.version = data.version;
+	renderTopic(data.topic, state.data);
+}
+
 function handleWebSocketMessage(data) {
 	switch (data.type) {
 		case "initial_data":
-			updateStats(data.stats);
 			updateEventsTable(data.events);
-			updateCharts(data.stats.event_types, data.events);
-			updateFunnel(data.funnel);
-			updateSegmentation(data.segmentation);
-			updateAnomalies(data.anomalies);
 			break;
 
-		case "new_event":
-			// Add the new event to the table (prepend to top)
-			addEventToTable(data.data);
-			showEventNotification(data.data);
+		case "snapshot":
+			handleSnapshot(data);
 			break;
 
-		case "stats_update":
-			updateStats(data.data);
-			// Refresh charts with new data
-			loadFullData();
+		case "patch":
+			handlePatch(data);
 			break;
 
-		case "funnel_update":
-			updateFunnel(data.data);
+		case "new_event":
+			// Add the new event to the table (prepend to top)
+			addEventToTable(data.data);
+			showEventNotification(data.data);
 			break;
 
-		case "segmentation_update":
-			updateSegmentation(data.data);
+		case "new_events":
+			// A batch arrives as one message; rows are oldest first
+			data.data.events.forEach((eventData) => addEventToTable(eventData));
+			showBatchNotification(data.data);
 			break;
 
-		case "anomaly_update":
-			updateAnomalies(data.data);
+		case "anomaly_alert":
+			// Fired as soon as the detector crosses a threshold; the full
+			// list follows in the next anomalies patch
+			data.data.forEach((anomaly) =>
+				showEventNotification(anomaly, anomaly.message)
+			);
 			break;
 	}
 }
@@ -123,7 +202,7 @@ function addEventToTable(eventData) {
 	}
 }
 
-function showEventNotification(eventData) {
+function showEventNotification(eventData, message) {
 	// Create a simple notification
 	const notification = document.createElement("div");
 	notification.style.cssText = `
@@ -151,7 +230,7 @@ function showEventNotification(eventData) {
 		document.head.appendChild(style);
 	}
 
-	notification.textContent = `New ${eventData.event_type} event`;
+	notification.textContent = message || `New ${eventData.event_type} event`;
 	document.body.appendChild(notification);
 
 	// Remove notification after 3 seconds
@@ -160,18 +239,22 @@ function showEventNotification(eventData) {
 	}, 3000);
 }
 
+function showBatchNotification(batchData) {
+	showEventNotification(batchData, `${batchData.count} new events`);
+}
+
 async function loadFullData() {
 	// Load full data for charts (WebSocket only sends partial updates)
 	try {
-		const [statsResponse, eventsResponse] = await Promise.all([
+		const [statsResponse, timeseriesResponse] = await Promise.all([
 			fetch("/stats"),
-			fetch("/events?limit=20"),
+			fetch("/api/v1/timeseries?granularity=hour"),
 		]);
 
 		const stats = await statsResponse.json();
-		const eventsData = await eventsResponse.json();
+		const timeseries = await timeseriesResponse.json();
 
-		updateCharts(stats.event_types, eventsData.events);
+		updateCharts(stats.event_types, timeseries.points.slice(-24));
 	} catch (error) {
 		console.error("Error loading full data:", error);
 	}
@@ -205,7 +288,7 @@ function updateEventsTable(events) {
 	});
 }
 
-function updateCharts(eventTypes, events) {
+function updateCharts(eventTypes, hourlyPoints) {
 	// Event Types Chart
 	if (eventTypesChart) eventTypesChart.destroy();
 
@@ -237,23 +320,15 @@ function updateCharts(eventTypes, events) {
 	// Activity Chart
 	if (activityChart) activityChart.destroy();
 
-	const hourCounts = {};
-	events.forEach((event) => {
-		const hour = new Date(event.created_at).getHours();
-		hourCounts[hour] = (hourCounts[hour] || 0) + 1;
-	});
-
 	const ctx2 = document.getElementById("activityChart").getContext("2d");
 	activityChart = new Chart(ctx2, {
 		type: "line",
 		data: {
-			labels: Object.keys(hourCounts).sort(),
+			labels: hourlyPoints.map((point) => new Date(point.bucket).getHours()),
 			datasets: [
 				{
 					label: "Events per Hour",
-					data: Object.keys(hourCounts)
-						.sort()
-						.map((h) => hourCounts[h]),
+					data: hourlyPoints.map((point) => point.total),
 					borderColor: "#3b82f6",
 					backgroundColor: "rgba(59, 130, 246, 0.1)",
 					tension: 0.4,
@@ -329,14 +404,41 @@ function updateFunnel(funnelData) {
 }
 
 function updateSegmentation(segmentationData) {
-	document.getElementById("segmentConverted").textContent =
-		segmentationData.converted.length;
+	// Only segment sizes are pushed; members are paged via /user-segmentation
+	const counts = segmentationData.counts;
+	document.getElementById("segmentConverted").textContent = counts.converted;
 	document.getElementById("segmentHighIntent").textContent =
-		segmentationData.high_intent.length;
+		counts.high_intent;
 	document.getElementById("segmentMediumIntent").textContent =
-		segmentationData.medium_intent.length;
-	document.getElementById("segmentLowIntent").textContent =
-		segmentationData.low_intent.length;
+		counts.medium_intent;
+	document.getElementById("segmentLowIntent").textContent = counts.low_intent;
+}
+
+function updateTopItems(topData) {
+	const lists = {
+		products: "topProducts",
+		pages: "topPages",
+		users: "topUsers",
+	};
+	Object.keys(lists).forEach((dimension) => {
+		const list = document.getElementById(lists[dimension]);
+		const top = topData.dimensions[dimension];
+		list.innerHTML = "";
+		if (!top) {
+			return;
+		}
+		top.items.forEach((item) => {
+			const entry = document.createElement("li");
+			const key = document.createElement("span");
+			const count = document.createElement("span");
+			key.textContent = item.key;
+			count.className = "trending-count";
+			count.textContent = item.count;
+			entry.appendChild(key);
+			entry.appendChild(count);
+			list.appendChild(entry);
+		});
+	});
 }
 
 function updateAnomalies(anomalyData) {